@@ -0,0 +1,222 @@
+"""
+Сокращение юридических адресов из справочников ЦБ РФ к короткому формату
+для документов: "индекс, область/край, г. Город, ул. Улица, д. X, к. Y, стр. Z".
+
+Правила (те же, что раньше передавались GPT в normalize_address_with_gpt):
+1. Индекс - в начало (если его нет, адрес остаётся без индекса)
+2. "город" -> "г.", "улица" -> "ул.", "дом" -> "д.", "корпус" -> "к.",
+   "строение" -> "стр.", "литера" -> "лит." (и "переулок" -> "пер.")
+3. Удаляются "Российская Федерация", "вн.тер.г.", "муниципальный округ"
+   и другие муниципальные образования
+4. Лишние пробелы и пустые части убираются
+
+Результаты кэшируются в cbr_data/address_cache.json по исходной строке.
+В LLM уходят только адреса, которые правила не разобрали (нет населённого
+пункта или дома), причём пачками по несколько адресов в одном запросе.
+"""
+
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+
+ADDRESS_CACHE_FILE = Path("cbr_data") / "address_cache.json"
+
+# Сколько адресов отправлять в одном запросе к LLM
+LLM_BATCH_SIZE = 20
+LLM_MODEL = "gpt-4o-mini"
+
+# Части адреса, которые удаляются целиком (государство и муниципальные образования)
+_DROP_PART_RE = re.compile(
+    r"^(?:российская\s+федерация|россия|рф)$"
+    r"|вн\.?\s*тер\.?\s*г\.?"
+    r"|муниципальн\w*\s+(?:округ|район|образование)"
+    r"|^(?:г\.\s*о\.|городской\s+округ|м\.\s*р-н|м\.\s*о\.|с\.\s*п\.|г\.\s*п\.|сельское\s+поселение|городское\s+поселение)",
+    re.IGNORECASE,
+)
+
+# Полные слова -> сокращения (только целые слова перед пробелом/номером).
+# "дом" - только в начале части адреса или перед номером ("дом 5"), но не
+# внутри названия ("ул. Дом Советов")
+_ABBREVIATIONS = (
+    (re.compile(r"\bгород(?=[\s\d]|$)", re.IGNORECASE), "г."),
+    (re.compile(r"\bулица(?=[\s\d]|$)", re.IGNORECASE), "ул."),
+    (re.compile(r"^дом(?=[\s\d]|$)|\bдом(?=\s*\d)", re.IGNORECASE), "д."),
+    (re.compile(r"\bкорпус(?=[\s\d]|$)", re.IGNORECASE), "к."),
+    (re.compile(r"\bстроение(?=[\s\d]|$)", re.IGNORECASE), "стр."),
+    (re.compile(r"\bлитера(?=[\s\d]|$)", re.IGNORECASE), "лит."),
+    (re.compile(r"\bпереулок(?=[\s\d]|$)", re.IGNORECASE), "пер."),
+)
+
+# Сокращения без точки или в верхнем регистре: "ул Ленина", "Д. 5", "ПЕР Сусальный".
+# Однобуквенные "г", "д", "к" - только в начале части адреса или перед номером:
+# внутри названия это инициалы ("ул. К. Маркса", "ул. Д. Бедного") или литера
+# дома ("д. 13 Д"), а "д" в "пр-д" - часть слова
+_MARKER_RE = re.compile(
+    r"(?<![\w.])(ул|корп|стр|лит|пер)\.?(?=\s|\d|$)"
+    r"|^(г|д|к)\.?(?=\s|\d|$)"
+    r"|(?<![\w.-])(г|д|к)\.?(?=\s*\d)",
+    re.IGNORECASE,
+)
+_MARKER_CANON = {"г": "г.", "ул": "ул.", "д": "д.", "к": "к.", "корп": "к.", "стр": "стр.", "лит": "лит.", "пер": "пер."}
+
+_POSTCODE_RE = re.compile(r"(?<!\d)(\d{6})(?!\d)")
+_DUPLICATE_CITY_RE = re.compile(r"\bг\.\s*г\.", re.IGNORECASE)
+_SPACE_AFTER_MARKER_RE = re.compile(r"\b(г|ул|д|к|стр|лит|пер)\.(?=\S)(?!,)")
+_LOCALITY_RE = re.compile(r"(?:^|\s)(?:г|пос|п|с|д|дер|рп|пгт|ст-ца|х)\.\s*\S|\bпос[её]лок\b|\bсело\b|\bдеревня\b|\bстаница\b", re.IGNORECASE)
+_HOUSE_NUMBER_SIGN_RE = re.compile(r"\bд\.\s*№\s*")
+_BARE_HOUSE_RE = re.compile(r'^\d+(?:\s*-?\s*"?[а-яА-Я]"?)?(?:[-/]\w+)*$')
+_HOUSE_RE = re.compile(r"(?:^|\s)(?:д|вл|зд)\.\s*\d|\bдомовладение\b|\bздание\b", re.IGNORECASE)
+
+
+def _canon_marker(match: "re.Match") -> str:
+    return _MARKER_CANON[match.group(match.lastindex).lower()]
+
+
+def shorten_address(raw: str) -> Optional[str]:
+    """
+    Сократить адрес по правилам. None - адрес не разобран (нужна LLM).
+    """
+    text = " ".join(str(raw or "").split())
+    if not text:
+        return None
+
+    postcode_match = _POSTCODE_RE.search(text)
+    postcode = postcode_match.group(1) if postcode_match else ""
+
+    parts = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part or part == postcode or _DROP_PART_RE.search(part):
+            continue
+        for pattern, short in _ABBREVIATIONS:
+            part = pattern.sub(short, part)
+        part = _MARKER_RE.sub(_canon_marker, part)
+        part = _DUPLICATE_CITY_RE.sub("г.", part)
+        part = _SPACE_AFTER_MARKER_RE.sub(r"\1. ", part)
+        part = _HOUSE_NUMBER_SIGN_RE.sub("д. ", part)
+        # "д. 11. лит. А" -> части "д. 11", "лит. А"
+        for piece in re.split(r"(?<=\d)\.\s+(?=\w)", part):
+            piece = " ".join(piece.split())
+            if re.search(r"\d\.$", piece):
+                piece = piece[:-1]
+            if piece and piece != postcode:
+                parts.append(piece)
+
+    if not parts:
+        return None
+    # "ул. Пушкина, 36" - номер дома без "д."
+    if not any(_HOUSE_RE.search(part) for part in parts):
+        for index, part in enumerate(parts):
+            if _BARE_HOUSE_RE.match(part):
+                parts[index] = f"д. {part}"
+                break
+    body = ", ".join(parts)
+    if not _LOCALITY_RE.search(body) or not _HOUSE_RE.search(body):
+        return None
+    return f"{postcode}, {body}" if postcode else body
+
+
+class AddressNormalizer:
+    """Сокращение адресов: кэш -> правила -> пачки в LLM для неразобранных."""
+
+    def __init__(self, cache_file: Path = ADDRESS_CACHE_FILE, use_llm: bool = True):
+        self.cache_file = Path(cache_file)
+        self.use_llm = use_llm
+        self.cache: Dict[str, str] = {}
+        self._dirty = False
+        if self.cache_file.exists():
+            try:
+                with open(self.cache_file, "r", encoding="utf-8") as f:
+                    self.cache = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[WARN] Не удалось прочитать кэш адресов: {e}")
+
+    def normalize(self, raw: str) -> str:
+        """Короткий адрес для одной строки (исходная строка, если сократить не удалось)."""
+        return self.normalize_many([raw])[raw]
+
+    def normalize_many(self, addresses: Iterable[str]) -> Dict[str, str]:
+        """Короткие адреса для набора строк: {исходный адрес: короткий}."""
+        result: Dict[str, str] = {}
+        unparsed: List[str] = []
+        for raw in addresses:
+            if raw in result:
+                continue
+            cached = self.cache.get(raw)
+            if cached is not None:
+                result[raw] = cached
+                continue
+            short = shorten_address(raw)
+            if short is None:
+                unparsed.append(raw)
+                result[raw] = raw
+                continue
+            result[raw] = short
+            self._remember(raw, short)
+
+        if unparsed and self.use_llm:
+            for start in range(0, len(unparsed), LLM_BATCH_SIZE):
+                batch = unparsed[start:start + LLM_BATCH_SIZE]
+                for raw, short in zip(batch, self._normalize_with_llm(batch)):
+                    if short:
+                        result[raw] = short
+                        self._remember(raw, short)
+        self.save()
+        return result
+
+    def _remember(self, raw: str, short: str):
+        self.cache[raw] = short
+        self._dirty = True
+
+    def save(self):
+        """Сохранить кэш (атомарно, только если он изменился)."""
+        if not self._dirty:
+            return
+        self.cache_file.parent.mkdir(exist_ok=True)
+        tmp_file = self.cache_file.with_name(f"{self.cache_file.name}.{os.getpid()}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.cache, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_file, self.cache_file)
+        self._dirty = False
+
+    def _normalize_with_llm(self, addresses: List[str]) -> List[Optional[str]]:
+        """Один запрос к LLM на пачку адресов; при ошибке - None для всех."""
+        from openai import OpenAI
+
+        numbered = "\n".join(f"{number}. {address}" for number, address in enumerate(addresses, start=1))
+        prompt = f"""Преобразуй каждый адрес в короткий юридический формат для документов.
+
+АДРЕСА:
+{numbered}
+
+ПРАВИЛА:
+1. Добавь индекс в начало (если нет - оставь без индекса)
+2. Сократи: "город" → "г.", "улица" → "ул.", "дом" → "д.", "корпус" → "к.", "строение" → "стр.", "литера" → "лит."
+3. Удали "Российская Федерация", "вн.тер.г.", "муниципальный округ"
+4. Формат: "индекс, область/край (если есть), г. Город, ул. Улица, д. X, к. Y, стр. Z"
+5. Убери лишние пробелы
+
+ПРИМЕР:
+Вход: "191144, г. Санкт-Петербург, Дегтярный переулок, д.11. лит. А"
+Выход: "191144, г. Санкт-Петербург, Дегтярный пер., д. 11, лит. А"
+
+Верни ТОЛЬКО JSON-массив из {len(addresses)} строк в том же порядке, без объяснений."""
+
+        try:
+            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            response = client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+            )
+            content = response.choices[0].message.content.strip()
+            content = re.sub(r"^```(?:json)?\s*|\s*```$", "", content)
+            shortened = json.loads(content)
+            if not isinstance(shortened, list) or len(shortened) != len(addresses):
+                raise ValueError(f"ожидалось {len(addresses)} адресов, получено {len(shortened) if isinstance(shortened, list) else 0}")
+            return [str(item).strip() if item else None for item in shortened]
+        except Exception as e:
+            print(f"⚠️  Ошибка нормализации адресов через LLM: {e}")
+            return [None] * len(addresses)
@@ -7,7 +7,7 @@ import uuid
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 import threading
 import time
@@ -17,8 +17,16 @@ from dotenv import load_dotenv
 # Загружаем переменные окружения
 load_dotenv()
 
-from processor import DocumentProcessor
+from processor import DocumentProcessor, render_document_set
+from template_cache import context_fingerprint
 from scheduler_updater import get_updater
+from creditor_aliases import CreditorAliasStore, ensure_schema as ensure_creditor_aliases_schema
+from job_queue import (
+    JobCheckpointStore, ensure_schema as ensure_job_queue_schema, prune_checkpoints,
+    PRIORITY_NORMAL, PRIORITY_URGENT, EtaPredictor, order_queued_jobs,
+    pdf_page_count, record_stage_timings,
+    publish_event, wait_for_events, latest_event_id, fetch_events
+)
 
 app = Flask(__name__)
 
@@ -35,6 +43,10 @@ app.config['OUTPUT_FOLDER'] = Path('outputs')
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_FILE_SIZE', 50 * 1024 * 1024))  # По умолчанию 50MB
 app.config['DATABASE'] = os.getenv('DATABASE_PATH', 'debtors.db')
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
+# Сколько заданий обрабатывается параллельно (по одному worker на процесс) - для прогноза ETA
+app.config['QUEUE_CONCURRENCY'] = int(os.getenv('QUEUE_CONCURRENCY', 1))
+# Максимальная длительность одного SSE-соединения (браузер переподключается сам)
+app.config['SSE_MAX_SECONDS'] = int(os.getenv('SSE_MAX_SECONDS', 240))
 
 app.config['UPLOAD_FOLDER'].mkdir(exist_ok=True)
 app.config['OUTPUT_FOLDER'].mkdir(exist_ok=True)
@@ -109,8 +121,46 @@ def init_db():
         print("[MIGRATION] Adding lawyer column to debtors table")
         cursor.execute('ALTER TABLE debtors ADD COLUMN lawyer TEXT DEFAULT "urist1"')
     
+    # Тип задания: 'full' - полная обработка, 'append' - дозагрузка документов
+    try:
+        cursor.execute('SELECT job_type, payload FROM processing_jobs LIMIT 1')
+    except sqlite3.OperationalError:
+        print("[MIGRATION] Adding job_type/payload columns to processing_jobs table")
+        cursor.execute('ALTER TABLE processing_jobs ADD COLUMN job_type TEXT DEFAULT "full"')
+        cursor.execute('ALTER TABLE processing_jobs ADD COLUMN payload TEXT')
+    
+    # Приоритет (срочность) и объём задания в страницах - для порядка очереди
+    try:
+        cursor.execute('SELECT priority, total_pages FROM processing_jobs LIMIT 1')
+    except sqlite3.OperationalError:
+        print("[MIGRATION] Adding priority/total_pages columns to processing_jobs table")
+        cursor.execute('ALTER TABLE processing_jobs ADD COLUMN priority INTEGER DEFAULT 0')
+        cursor.execute('ALTER TABLE processing_jobs ADD COLUMN total_pages INTEGER DEFAULT 0')
+    
+    # Число страниц загруженного документа - для прогноза длительности
+    try:
+        cursor.execute('SELECT pages FROM documents LIMIT 1')
+    except sqlite3.OperationalError:
+        print("[MIGRATION] Adding pages column to documents table")
+        cursor.execute('ALTER TABLE documents ADD COLUMN pages INTEGER DEFAULT 0')
+    
+    # Отпечаток данных, из которых отрендерен сгенерированный документ (перегенерация только изменившихся)
+    try:
+        cursor.execute('SELECT context_hash FROM documents LIMIT 1')
+    except sqlite3.OperationalError:
+        print("[MIGRATION] Adding context_hash column to documents table")
+        cursor.execute('ALTER TABLE documents ADD COLUMN context_hash TEXT')
+    
+    # Таблицы чекпоинтов обработки (возобновление прерванных заданий)
+    ensure_job_queue_schema(cursor)
+    
+    # Словарь названий кредиторов, накопленный по всем должникам
+    ensure_creditor_aliases_schema(cursor)
+    
     conn.commit()
     conn.close()
+    
+    DocumentProcessor.set_creditor_aliases(CreditorAliasStore(app.config['DATABASE']))
 
 def get_db():
     conn = sqlite3.connect(app.config['DATABASE'], timeout=30.0)  # Увеличиваем таймаут до 30 секунд
@@ -223,6 +273,60 @@ def before_request():
 worker_lock = threading.Lock()
 worker_running = False
 
+def publish_job_event(debtor_id, status, job_id=None, **extra):
+    """Событие смены статуса задания/должника для SSE-потока /api/events."""
+    publish_event(app.config['DATABASE'], 'job', {
+        'debtor_id': debtor_id,
+        'job_id': job_id,
+        'status': status,
+        **extra
+    })
+
+def make_progress_callback(debtor_id, job_id):
+    """Callback для DocumentProcessor: пересылает прогресс обработки в SSE-поток."""
+    def on_progress(progress):
+        publish_event(app.config['DATABASE'], 'progress', {
+            'debtor_id': debtor_id,
+            'job_id': job_id,
+            **progress
+        })
+    return on_progress
+
+def load_queue_order(cursor, claimable_only=False):
+    """Задания в статусе 'queued' в эффективном порядке обработки.
+    
+    Порядок: срочные, затем round-robin по юристам, внутри юриста - кратчайшие
+    по числу страниц (см. job_queue.order_queued_jobs).
+    claimable_only - исключить задания должников, у которых уже идёт обработка.
+    """
+    blocked_filter = '''
+        AND NOT EXISTS (
+            SELECT 1 FROM processing_jobs p
+            WHERE p.debtor_id = j.debtor_id AND p.status = 'processing'
+        )
+    ''' if claimable_only else ''
+    cursor.execute(f'''
+        SELECT j.id, j.debtor_id, j.job_type, j.payload, j.priority, j.total_pages,
+               j.created_at, d.lawyer, d.full_name
+        FROM processing_jobs j
+        LEFT JOIN debtors d ON j.debtor_id = d.id
+        WHERE j.status = 'queued' {blocked_filter}
+    ''')
+    jobs = [dict(row) for row in cursor.fetchall()]
+    if not jobs:
+        return []
+    
+    cursor.execute('''
+        SELECT d.lawyer, MAX(j.started_at) AS last_started
+        FROM processing_jobs j
+        JOIN debtors d ON j.debtor_id = d.id
+        WHERE j.started_at IS NOT NULL
+        GROUP BY d.lawyer
+    ''')
+    lawyer_last_started = {row['lawyer'] or 'urist1': row['last_started'] for row in cursor.fetchall()}
+    
+    return order_queued_jobs(jobs, lawyer_last_started)
+
 def processing_worker():
     """Единственный worker thread для последовательной обработки документов."""
     print("[WORKER] Processing worker started")
@@ -233,18 +337,16 @@ def processing_worker():
             conn = get_db()
             cursor = conn.cursor()
             
-            # Получаем ID следующего задания
-            cursor.execute('''
-                SELECT id, debtor_id FROM processing_jobs 
-                WHERE status = 'queued' 
-                ORDER BY created_at ASC 
-                LIMIT 1
-            ''')
-            job_row = cursor.fetchone()
+            # Получаем следующее задание с учётом приоритета и справедливости между юристами
+            # (задания одного должника выполняются строго по очереди, даже в разных процессах)
+            queue_order = load_queue_order(cursor, claimable_only=True)
+            job_row = queue_order[0] if queue_order else None
             
             if job_row:
                 job_id = job_row['id']
                 debtor_id = job_row['debtor_id']
+                job_type = job_row['job_type'] or 'full'
+                job_payload = job_row['payload']
                 
                 # Транзакционное обновление статуса (atomic claim)
                 cursor.execute('''
@@ -269,10 +371,14 @@ def processing_worker():
                 
                 conn.commit()
                 conn.close()
+                publish_job_event(debtor_id, 'processing', job_id=job_id)
                 
                 # Обрабатываем документы
                 try:
-                    process_documents_for_job(debtor_id)
+                    if job_type == 'append':
+                        append_documents_for_job(debtor_id, json.loads(job_payload or '[]'), job_id=job_id)
+                    else:
+                        process_documents_for_job(debtor_id, job_id=job_id)
                     
                     # Успешно завершено
                     conn = get_db()
@@ -291,6 +397,7 @@ def processing_worker():
                     
                     conn.commit()
                     conn.close()
+                    publish_job_event(debtor_id, 'completed', job_id=job_id)
                     
                     print(f"[WORKER] Job {job_id} completed successfully")
 
@@ -315,12 +422,22 @@ def processing_worker():
 
                         conn.commit()
                         conn.close()
+                        publish_job_event(debtor_id, 'error', job_id=job_id, error=str(e))
                     except Exception as db_error:
                         print(f"[ERROR] Failed to update error status: {db_error}")
                         try:
                             conn.close()
                         except:
                             pass
+                
+                finally:
+                    # Задание завершено (успешно или с ошибкой) - промежуточные результаты
+                    # больше не нужны. Остаются только у заданий, прерванных вместе
+                    # с процессом: reset_orphaned_jobs вернёт их в очередь
+                    try:
+                        JobCheckpointStore(app.config['DATABASE'], job_id).clear()
+                    except sqlite3.Error as e:
+                        print(f"[WORKER] Failed to clear checkpoints of job {job_id}: {e}")
             else:
                 # Нет заданий в очереди, ждем
                 conn.close()
@@ -350,11 +467,16 @@ def reset_orphaned_jobs():
         ''')
         
         reset_count = cursor.rowcount
+        
+        # Чекпоинты нужны только заданиям, которые снова в очереди
+        pruned_count = prune_checkpoints(cursor)
         conn.commit()
         conn.close()
         
         if reset_count > 0:
             print(f"[WORKER] Reset {reset_count} orphaned 'processing' jobs to 'queued'")
+        if pruned_count > 0:
+            print(f"[WORKER] Pruned {pruned_count} checkpoints of finished jobs")
     except Exception as e:
         print(f"[WORKER] Error resetting orphaned jobs: {e}")
 
@@ -463,24 +585,66 @@ def get_queue_status():
     cursor.execute('SELECT COUNT(*) as count FROM processing_jobs WHERE status = "processing"')
     processing_count = cursor.fetchone()['count']
     
-    # Получаем список заданий в очереди с позициями
+    # Обрабатываемые задания, затем очередь в эффективном порядке (приоритет, юристы, объём)
     cursor.execute('''
-        SELECT j.id, j.debtor_id, j.status, j.created_at, d.full_name
+        SELECT j.id, j.debtor_id, j.status, j.created_at, j.started_at, j.priority, j.total_pages,
+               j.job_type, j.payload, d.full_name, d.lawyer
         FROM processing_jobs j
         LEFT JOIN debtors d ON j.debtor_id = d.id
-        WHERE j.status IN ('queued', 'processing')
-        ORDER BY j.created_at ASC
+        WHERE j.status = 'processing'
+        ORDER BY j.started_at ASC
     ''')
+    processing_rows = [dict(row) for row in cursor.fetchall()]
+    queued_rows = load_queue_order(cursor)
+    
     jobs = []
-    for idx, row in enumerate(cursor.fetchall(), start=1):
-        jobs.append({
-            'job_id': row['id'],
-            'debtor_id': row['debtor_id'],
-            'full_name': row['full_name'],
-            'status': row['status'],
-            'position': idx if row['status'] == 'queued' else 0,
-            'created_at': row['created_at']
-        })
+    for row in processing_rows:
+        row['status'] = 'processing'
+        row['position'] = 0
+        jobs.append(row)
+    for idx, row in enumerate(queued_rows, start=1):
+        row['status'] = 'queued'
+        row['position'] = idx
+        jobs.append(row)
+    
+    # Прогноз времени: оценка каждого задания по его документам и истории замеров
+    predictor = EtaPredictor.from_db(cursor)
+    cursor.execute('''
+        SELECT debtor_id, filename, filepath, pages FROM documents
+        WHERE is_generated = 0 AND debtor_id IN (
+            SELECT debtor_id FROM processing_jobs WHERE status IN ('queued', 'processing')
+        )
+    ''')
+    debtor_documents = {}
+    for doc in cursor.fetchall():
+        doc_type = DocumentProcessor.detect_document_type(doc['filename'])[0]
+        debtor_documents.setdefault(doc['debtor_id'], []).append((doc['filepath'], doc_type, doc['pages'] or 0))
+    
+    for row in jobs:
+        documents = debtor_documents.get(row['debtor_id'], [])
+        if row['job_type'] == 'append':
+            # Дозагрузка извлекает только новые файлы из payload
+            new_files = set(json.loads(row['payload'] or '[]'))
+            documents = [doc for doc in documents if doc[0] in new_files]
+        row['estimate_seconds'] = predictor.estimate_job((doc_type, pages) for _, doc_type, pages in documents)
+    
+    predictor.schedule(processing_rows, queued_rows, concurrency=app.config['QUEUE_CONCURRENCY'])
+    
+    jobs = [{
+        'job_id': row['id'],
+        'debtor_id': row['debtor_id'],
+        'full_name': row['full_name'],
+        'lawyer': row['lawyer'] or 'urist1',
+        'status': row['status'],
+        'position': row['position'],
+        'urgent': (row['priority'] or 0) >= PRIORITY_URGENT,
+        'total_pages': row['total_pages'] or 0,
+        'created_at': row['created_at'],
+        'estimate_seconds': round(row['estimate_seconds']),
+        'eta_start': row.get('eta_start') or row.get('started_at'),
+        'eta_finish': row.get('eta_finish'),
+        'remaining_seconds': row.get('remaining_seconds')
+    } for row in jobs]
     
     conn.close()
     
@@ -490,6 +654,72 @@ def get_queue_status():
         'jobs': jobs
     })
 
+@app.route('/api/queue/<int:job_id>/priority', methods=['POST'])
+def set_job_priority(job_id):
+    """Отметить задание в очереди как срочное (или снять отметку)."""
+    payload = request.json or {}
+    urgent = bool(payload.get('urgent', True))
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE processing_jobs SET priority = ? WHERE id = ? AND status = 'queued'",
+        (PRIORITY_URGENT if urgent else PRIORITY_NORMAL, job_id)
+    )
+    updated = cursor.rowcount
+    conn.commit()
+    conn.close()
+    
+    if not updated:
+        return jsonify({'error': 'Queued job not found'}), 404
+    
+    print(f"[QUEUE] Job {job_id} priority set to {'urgent' if urgent else 'normal'}")
+    publish_event(app.config['DATABASE'], 'queue', {'job_id': job_id, 'urgent': urgent})
+    return jsonify({'success': True, 'job_id': job_id, 'urgent': urgent})
+
+@app.route('/api/events')
+def event_stream():
+    """SSE-поток событий: статусы заданий (job), прогресс обработки (progress),
+    изменения очереди (queue) и обновления реестров (registry).
+    
+    Клиент держит одно соединение; при переподключении браузер передаёт
+    Last-Event-ID и получает пропущенные события.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since', '')
+    max_seconds = app.config['SSE_MAX_SECONDS']
+    
+    def generate():
+        conn = get_db()
+        try:
+            after_id = int(last_event_id) if last_event_id.isdigit() else latest_event_id(conn)
+            yield 'retry: 3000\n\n'
+            
+            started = time.time()
+            last_write = started
+            while time.time() - started < max_seconds:
+                events = fetch_events(conn, after_id)
+                for event_id, event, payload in events:
+                    after_id = event_id
+                    yield f'id: {event_id}\nevent: {event}\ndata: {payload}\n\n'
+                if events:
+                    last_write = time.time()
+                    continue
+                
+                # Комментарий-heartbeat, чтобы прокси не закрывали соединение
+                if time.time() - last_write > 15:
+                    yield ': keepalive\n\n'
+                    last_write = time.time()
+                
+                wait_for_events(1.0)
+        finally:
+            conn.close()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/debtors/<debtor_id>/deals', methods=['GET'])
 def get_debtor_deals(debtor_id):
     """Получить сделки должника за последние 3 года."""
@@ -555,6 +785,7 @@ def delete_debtor(debtor_id):
     
     conn.commit()
     conn.close()
+    publish_job_event(debtor_id, 'deleted')
     
     # Удаляем папку с загруженными файлами
     debtor_upload_folder = app.config['UPLOAD_FOLDER'] / debtor_id
@@ -714,17 +945,24 @@ def update_debtor_data(debtor_id):
         cursor.execute('UPDATE debtors SET status = ? WHERE id = ?', ('processing', debtor_id))
         conn.commit()
         conn.close()
+        publish_job_event(debtor_id, 'processing')
         
-        # Запускаем перегенерацию документов
-        threading.Thread(target=regenerate_documents, args=(debtor_id,), daemon=True).start()
+        # Запускаем перегенерацию документов, данные которых изменились с последнего рендера
+        # (правка могла прийти раньше через save-data - сравниваем с документами, а не с result.json)
+        threading.Thread(target=regenerate_documents, args=(debtor_id, True), daemon=True).start()
         
         return jsonify({'success': True, 'message': 'Данные обновлены, документы генерируются'})
     except Exception as e:
         safe_print_exc()
         return jsonify({'error': str(e)}), 500
 
-def regenerate_documents(debtor_id):
-    """Перегенерировать документы на основе обновленного result.json."""
+def regenerate_documents(debtor_id, only_changed=False):
+    """Перегенерировать документы на основе обновленного result.json.
+    
+    only_changed - перегенерировать только шаблоны, у которых изменились
+    значения используемых полей (отпечаток context_hash в documents) или нет
+    документа. False - все шаблоны.
+    """
     import shutil
     from pathlib import Path
     
@@ -764,41 +1002,80 @@ def regenerate_documents(debtor_id):
             print(f"[REGEN WARNING] Template folder {template_dir} not found, using default")
             template_dir = Path("templ/urist1")
         
-        # Получаем список шаблонов
-        templates = list(template_dir.glob('*.docx'))
+        # Получаем список шаблонов (сортировка - стабильный порядок документов;
+        # ~$*.docx - файлы блокировки открытых в Word шаблонов)
+        templates = [path for path in sorted(template_dir.glob('*.docx')) if not path.name.startswith('~$')]
         
         # Папка для сохранения документов (resultdoc/)
         from processor import OUTPUT_DIR
         output_dir = OUTPUT_DIR / debtor_id
         output_dir.mkdir(parents=True, exist_ok=True)
         
-        # Удаляем старые сгенерированные документы из БД
         conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM documents WHERE debtor_id = ? AND is_generated = 1', (debtor_id,))
+        
+        # Файлы, которые пишет перегенерация: по одному на шаблон
+        output_paths = {template_path: str(output_dir / template_path.name) for template_path in templates}
+        # Отпечатки текущих данных каждого шаблона (набор полей кэшируется на версию шаблона)
+        fingerprints = {template_path: context_fingerprint(template_path, context) for template_path in templates}
+        
+        if only_changed:
+            cursor.execute('SELECT filepath, context_hash FROM documents WHERE debtor_id = ? AND is_generated = 1', (debtor_id,))
+            rendered_from = {row['filepath']: row['context_hash'] for row in cursor.fetchall()}
+            if set(rendered_from) - set(output_paths.values()):
+                # Документы сформированы обработкой дела под другими именами
+                # ("... (заполненное).docx") - заменяем весь комплект
+                print(f"[REGEN] Generated documents have other file names, regenerating all templates")
+                only_changed = False
+        
+        if only_changed:
+            # Только шаблоны, документ которых отрендерен из других данных (или его нет)
+            affected = [
+                template_path for template_path in templates
+                if fingerprints[template_path] is None
+                or rendered_from.get(output_paths[template_path]) != fingerprints[template_path]
+                or not Path(output_paths[template_path]).exists()
+            ]
+            print(f"[REGEN] Templates with changed data: {len(affected)} of {len(templates)}")
+            templates = affected
+        
+        # Удаляем старые записи перегенерируемых документов из БД (остальные не трогаем)
+        if not only_changed:
+            cursor.execute('DELETE FROM documents WHERE debtor_id = ? AND is_generated = 1', (debtor_id,))
+        else:
+            cursor.executemany(
+                'DELETE FROM documents WHERE debtor_id = ? AND is_generated = 1 AND filepath = ?',
+                [(debtor_id, output_paths[template_path]) for template_path in templates]
+            )
         conn.commit()
         
-        # Генерируем новые документы
-        for template_path in templates:
-            try:
-                output_path = output_dir / template_path.name
-                DocumentProcessor.fill_template(template_path, output_path, context)
-                
-                # Добавляем в БД
-                cursor.execute('''
-                    INSERT INTO documents (debtor_id, filename, filepath, doc_type, is_generated)
-                    VALUES (?, ?, ?, ?, 1)
-                ''', (debtor_id, template_path.name, str(output_path), 'generated'))
-                
-                print(f"[REGEN] Generated: {template_path.name}")
-            except Exception as e:
-                print(f"[REGEN ERROR] Failed to generate {template_path.name}: {e}")
+        # Генерируем новые документы (параллельно, результаты - в порядке шаблонов)
+        saved_seconds = 0.0
+        jobs = [(template_path, Path(output_paths[template_path])) for template_path in templates]
+        for result in render_document_set(jobs, context):
+            template_path = result.template_path
+            if result.error is not None:
+                print(f"[REGEN ERROR] Failed to generate {template_path.name}: {result.error}")
+                continue
+            saved_seconds += result.saved_seconds
+            
+            # Добавляем в БД
+            cursor.execute('''
+                INSERT INTO documents (debtor_id, filename, filepath, doc_type, is_generated, context_hash)
+                VALUES (?, ?, ?, ?, 1, ?)
+            ''', (debtor_id, template_path.name, str(result.output_path), 'generated', fingerprints[template_path]))
+            
+            print(f"[REGEN] Generated: {template_path.name}")
+        
+        if saved_seconds:
+            print(f"[REGEN] Template cache saved ~{saved_seconds * 1000:.0f} ms of rendering")
         
         # Обновляем статус должника на "completed"
         cursor.execute('UPDATE debtors SET status = ? WHERE id = ?', ('completed', debtor_id))
         
         conn.commit()
         conn.close()
+        publish_job_event(debtor_id, 'completed')
         
         print(f"[REGEN] Completed for debtor {debtor_id}")
         
@@ -813,9 +1090,19 @@ def regenerate_documents(debtor_id):
             cursor.execute('UPDATE debtors SET status = ? WHERE id = ?', ('error', debtor_id))
             conn.commit()
             conn.close()
+            publish_job_event(debtor_id, 'error')
         except:
             pass
 
+def _publish_registry_event(info):
+    """Уведомить клиентов об обновлении реестров (вызывается BankRegistryUpdater)."""
+    publish_event(app.config['DATABASE'], 'registry', {
+        'status': info.get('status'),
+        'last_update': info.get('last_update')
+    })
+
+get_updater().add_update_listener(_publish_registry_event)
+
 @app.route('/api/registry/status', methods=['GET'])
 def get_registry_status():
     """Получить статус реестров банков и МФО, информацию об обновлениях"""
@@ -824,9 +1111,11 @@ def get_registry_status():
     
     # Добавляем количество банков и МФО в текущих реестрах
     from processor import DocumentProcessor
-    info['bank_registry_size'] = len(DocumentProcessor.BANK_REGISTRY)
-    info['mfo_registry_size'] = len(DocumentProcessor.MFO_REGISTRY)
-    info['registry_size'] = len(DocumentProcessor.BANK_REGISTRY) + len(DocumentProcessor.MFO_REGISTRY)
+    registries = DocumentProcessor.registries()
+    info['bank_registry_size'] = len(registries.bank)
+    info['mfo_registry_size'] = len(registries.mfo)
+    info['registry_size'] = len(registries.bank) + len(registries.mfo)
+    info['registry_generation'] = registries.generation
     
     return jsonify(info)
 
@@ -835,18 +1124,69 @@ def force_registry_update():
     """Принудительно запустить обновление реестра"""
     updater = get_updater()
     
-    # Запускаем обновление в отдельном потоке, чтобы не блокировать API
-    def run_update():
-        updater.force_update()
-    
-    update_thread = threading.Thread(target=run_update, daemon=True)
-    update_thread.start()
+    # Запускаем обновление в отдельном потоке, чтобы не блокировать API.
+    # Повторные запросы (из любого воркера) не запускают второе обновление
+    if not updater.start_force_update():
+        return jsonify({
+            'message': 'Обновление уже выполняется',
+            'status': 'already_running'
+        })
     
     return jsonify({
         'message': 'Обновление запущено',
         'status': 'started'
     })
 
+def _creditor_alias_store() -> CreditorAliasStore:
+    store = DocumentProcessor.CREDITOR_ALIASES
+    if store is None:
+        store = CreditorAliasStore(app.config['DATABASE'])
+        DocumentProcessor.set_creditor_aliases(store)
+    return store
+
+@app.route('/api/creditor-aliases', methods=['GET'])
+def list_creditor_aliases():
+    """Словарь названий кредиторов (поиск по подстроке: ?q=...&limit=...)"""
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    aliases = _creditor_alias_store().search(query, limit)
+    return jsonify({
+        'aliases': [alias.to_dict() for alias in aliases],
+        'count': len(aliases),
+    })
+
+@app.route('/api/creditor-aliases', methods=['POST'])
+def save_creditor_alias():
+    """Добавить или исправить запись словаря кредиторов (ручные записи не перезаписываются автоматически)"""
+    payload = request.json or {}
+    alias = (payload.get('alias') or '').strip()
+    canonical = (payload.get('canonical') or '').strip()
+    if not alias or not canonical:
+        return jsonify({'error': 'alias and canonical are required'}), 400
+    
+    saved = _creditor_alias_store().save_manual(
+        alias,
+        canonical,
+        normalized=(payload.get('normalized') or '').strip(),
+        inn=(payload.get('inn') or '').strip(),
+        ogrn=(payload.get('ogrn') or '').strip(),
+        address=(payload.get('address') or '').strip(),
+    )
+    print(f"[ALIASES] {alias!r} -> {canonical!r} (manual)")
+    return jsonify({'success': True, 'alias': saved.to_dict()})
+
+@app.route('/api/creditor-aliases', methods=['DELETE'])
+def delete_creditor_alias():
+    """Удалить запись словаря кредиторов (название снова будет разрешаться по правилам и реестрам)"""
+    payload = request.json or {}
+    alias = (payload.get('alias') or request.args.get('alias') or '').strip()
+    if not alias:
+        return jsonify({'error': 'alias is required'}), 400
+    
+    if not _creditor_alias_store().delete(alias):
+        return jsonify({'error': 'Alias not found'}), 404
+    return jsonify({'success': True})
+
 @app.route('/api/upload', methods=['POST'])
 def upload_documents():
     if 'files[]' not in request.files:
@@ -854,6 +1194,7 @@ def upload_documents():
     
     files = request.files.getlist('files[]')
     lawyer = request.form.get('lawyer', 'urist1')
+    urgent = request.form.get('urgent', '').lower() in ('1', 'true', 'on', 'yes')
     
     if not files or all(file.filename == '' for file in files):
         return jsonify({'error': 'No files selected'}), 400
@@ -882,31 +1223,193 @@ def upload_documents():
         (debtor_id, 'В очереди...', datetime.now().isoformat(), 'queued', '{}', lawyer)
     )
     
-    # Сохраняем документы
+    # Сохраняем документы (с числом страниц - для порядка очереди и прогноза времени)
+    total_pages = 0
     for filepath in uploaded_files:
+        pages = pdf_page_count(filepath)
+        total_pages += pages
         cursor.execute(
-            'INSERT INTO documents (debtor_id, filename, filepath, doc_type, is_generated) VALUES (?, ?, ?, ?, ?)',
-            (debtor_id, filepath.name, str(filepath), 'uploaded', 0)
+            'INSERT INTO documents (debtor_id, filename, filepath, doc_type, is_generated, pages) VALUES (?, ?, ?, ?, ?, ?)',
+            (debtor_id, filepath.name, str(filepath), 'uploaded', 0, pages)
         )
     
     # Добавляем задание в очередь
     cursor.execute(
-        'INSERT INTO processing_jobs (debtor_id, status, created_at) VALUES (?, ?, ?)',
-        (debtor_id, 'queued', datetime.now().isoformat())
+        'INSERT INTO processing_jobs (debtor_id, status, created_at, priority, total_pages) VALUES (?, ?, ?, ?, ?)',
+        (debtor_id, 'queued', datetime.now().isoformat(),
+         PRIORITY_URGENT if urgent else PRIORITY_NORMAL, total_pages)
     )
     
     conn.commit()
     conn.close()
     
-    print(f"[UPLOAD] Added debtor {debtor_id} to processing queue")
+    print(f"[UPLOAD] Added debtor {debtor_id} to processing queue ({total_pages} pages{', urgent' if urgent else ''})")
+    publish_job_event(debtor_id, 'queued')
     
     return jsonify({
         'success': True,
         'debtor_id': debtor_id
     })
 
-def process_documents_for_job(debtor_id):
-    """Обрабатывает документы для конкретного должника из очереди."""
+@app.route('/api/debtors/<debtor_id>/documents', methods=['POST'])
+def add_debtor_documents(debtor_id):
+    """Добавить документы к существующему должнику.
+    
+    Файлы сохраняются в папку должника, а в очередь ставится задание 'append':
+    извлекаются только новые файлы, их данные добавляются к raw_data,
+    после чего документы генерируются заново.
+    """
+    if 'files[]' not in request.files:
+        return jsonify({'error': 'No files provided'}), 400
+    
+    files = request.files.getlist('files[]')
+    if not files or all(file.filename == '' for file in files):
+        return jsonify({'error': 'No files selected'}), 400
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id FROM debtors WHERE id = ?', (debtor_id,))
+    if not cursor.fetchone():
+        conn.close()
+        return jsonify({'error': 'Debtor not found'}), 404
+    
+    debtor_folder = app.config['UPLOAD_FOLDER'] / debtor_id
+    debtor_folder.mkdir(exist_ok=True)
+    
+    uploaded_files = []
+    for file in files:
+        if file and allowed_file(file.filename):
+            filename = custom_secure_filename(file.filename)
+            filepath = debtor_folder / filename
+            # Не перезаписываем уже загруженные файлы с тем же именем
+            counter = 1
+            while filepath.exists():
+                filepath = debtor_folder / f"{Path(filename).stem}_{counter}{Path(filename).suffix}"
+                counter += 1
+            file.save(filepath)
+            uploaded_files.append(filepath)
+    
+    if not uploaded_files:
+        conn.close()
+        return jsonify({'error': 'No valid PDF files provided'}), 400
+    
+    new_pages = 0
+    for filepath in uploaded_files:
+        pages = pdf_page_count(filepath)
+        new_pages += pages
+        cursor.execute(
+            'INSERT INTO documents (debtor_id, filename, filepath, doc_type, is_generated, pages) VALUES (?, ?, ?, ?, ?, ?)',
+            (debtor_id, filepath.name, str(filepath), 'uploaded', 0, pages)
+        )
+    
+    # Если полная обработка ещё не началась, новые файлы попадут в неё сами
+    cursor.execute(
+        "SELECT id FROM processing_jobs WHERE debtor_id = ? AND status = 'queued' AND COALESCE(job_type, 'full') = 'full'",
+        (debtor_id,)
+    )
+    pending_full_job = cursor.fetchone()
+    
+    if pending_full_job:
+        job_id = pending_full_job['id']
+        cursor.execute(
+            'UPDATE processing_jobs SET total_pages = COALESCE(total_pages, 0) + ? WHERE id = ?',
+            (new_pages, job_id)
+        )
+    else:
+        cursor.execute(
+            'INSERT INTO processing_jobs (debtor_id, status, created_at, job_type, payload, total_pages) VALUES (?, ?, ?, ?, ?, ?)',
+            (debtor_id, 'queued', datetime.now().isoformat(), 'append',
+             json.dumps([str(p) for p in uploaded_files], ensure_ascii=False), new_pages)
+        )
+        job_id = cursor.lastrowid
+        cursor.execute('UPDATE debtors SET status = ? WHERE id = ?', ('queued', debtor_id))
+    
+    conn.commit()
+    conn.close()
+    
+    print(f"[APPEND] Added {len(uploaded_files)} file(s) to debtor {debtor_id}, job {job_id}")
+    publish_job_event(debtor_id, 'queued', job_id=job_id)
+    
+    return jsonify({
+        'success': True,
+        'debtor_id': debtor_id,
+        'job_id': job_id,
+        'files': [p.name for p in uploaded_files]
+    })
+
+def append_documents_for_job(debtor_id, new_files, job_id=None):
+    """Дозагрузка документов: извлекает только новые файлы и перегенерирует документы."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT raw_data, lawyer FROM debtors WHERE id = ?', (debtor_id,))
+    debtor_row = cursor.fetchone()
+    cursor.execute(
+        'SELECT filepath FROM documents WHERE debtor_id = ? AND is_generated = 0',
+        (debtor_id,)
+    )
+    all_files = [Path(row['filepath']) for row in cursor.fetchall()]
+    conn.close()
+    
+    if not debtor_row:
+        raise ValueError(f"Debtor {debtor_id} not found")
+    
+    aggregated = json.loads(debtor_row['raw_data']) if debtor_row['raw_data'] else {}
+    lawyer = debtor_row['lawyer'] if debtor_row['lawyer'] else 'urist1'
+    
+    # Должник ещё ни разу не был обработан успешно - нужна полная обработка
+    if not aggregated:
+        print(f"[APPEND] No stored data for debtor {debtor_id}, running full processing")
+        process_documents_for_job(debtor_id, job_id=job_id)
+        return
+    
+    new_pdf_files = [Path(p) for p in new_files if Path(p).exists()]
+    print(f"[APPEND] Extracting {len(new_pdf_files)} new file(s) for debtor {debtor_id}: {[f.name for f in new_pdf_files]}")
+    
+    output_folder = app.config['OUTPUT_FOLDER'] / debtor_id
+    output_folder.mkdir(exist_ok=True)
+    
+    checkpoints = JobCheckpointStore(app.config['DATABASE'], job_id) if job_id is not None else None
+    
+    processor = DocumentProcessor(progress_callback=make_progress_callback(debtor_id, job_id))
+    results, merged, filled_templates = processor.process_additional_documents(
+        new_pdf_files,
+        aggregated,
+        all_files,
+        output_json=output_folder / 'result.json',
+        debtor_id=debtor_id,
+        lawyer=lawyer,
+        checkpoints=checkpoints
+    )
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        'UPDATE debtors SET raw_data = ? WHERE id = ?',
+        (json.dumps(merged, ensure_ascii=False), debtor_id)
+    )
+    
+    # Документы сгенерированы заново - заменяем записи о них
+    cursor.execute('DELETE FROM documents WHERE debtor_id = ? AND is_generated = 1', (debtor_id,))
+    for template_path in filled_templates or []:
+        if template_path and template_path.exists():
+            cursor.execute(
+                'INSERT INTO documents (debtor_id, filename, filepath, doc_type, is_generated) VALUES (?, ?, ?, ?, ?)',
+                (debtor_id, template_path.name, str(template_path), 'generated', 1)
+            )
+    
+    conn.commit()
+    conn.close()
+    
+    record_stage_timings(app.config['DATABASE'], job_id, processor.stage_timings)
+    
+    print(f"[APPEND] Completed for debtor {debtor_id}: {len(results)} new document(s), {len(filled_templates or [])} generated")
+
+def process_documents_for_job(debtor_id, job_id=None):
+    """Обрабатывает документы для конкретного должника из очереди.
+    
+    Если передан job_id, каждый обработанный документ сохраняется как чекпоинт,
+    и перезапущенное задание продолжает работу с первого необработанного документа.
+    """
     try:
         print(f"[DEBUG] Starting processing for debtor {debtor_id}")
         
@@ -929,19 +1432,27 @@ def process_documents_for_job(debtor_id):
         pdf_files = [Path(row['filepath']) for row in file_rows]
         print(f"[DEBUG] Files to process: {[f.name for f in pdf_files]}")
         
-        processor = DocumentProcessor()
+        processor = DocumentProcessor(progress_callback=make_progress_callback(debtor_id, job_id))
         
         output_folder = app.config['OUTPUT_FOLDER'] / debtor_id
         output_folder.mkdir(exist_ok=True)
         
         output_json = output_folder / 'result.json'
         
+        checkpoints = None
+        if job_id is not None:
+            checkpoints = JobCheckpointStore(app.config['DATABASE'], job_id)
+            resumed = checkpoints.completed_count()
+            if resumed:
+                print(f"[CHECKPOINT] Job {job_id}: {resumed} документ(ов) уже обработано, продолжаю")
+        
         print(f"[DEBUG] Calling process_batch with lawyer: {lawyer}")
         results, aggregated, filled_templates = processor.process_batch(
             pdf_files,
             output_json=output_json,
             debtor_id=debtor_id,
-            lawyer=lawyer
+            lawyer=lawyer,
+            checkpoints=checkpoints
         )
         
         print(f"[DEBUG] process_batch completed. Results: {len(results)}, Aggregated keys: {list(aggregated.keys()) if aggregated else 'None'}")
@@ -991,6 +1502,10 @@ def process_documents_for_job(debtor_id):
         conn.commit()
         conn.close()
         
+        # Замеры этапов - для прогноза времени очереди
+        # (чекпоинты задания удаляет processing_worker после его завершения)
+        record_stage_timings(app.config['DATABASE'], job_id, processor.stage_timings)
+        
         print(f"[DEBUG] Processing completed successfully for debtor {debtor_id}")
         
     except Exception as e:
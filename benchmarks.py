@@ -0,0 +1,528 @@
+"""
+Бенчмарки горячих участков обработки.
+
+Запуск: python benchmarks.py [имя_бенчмарка ...]
+Без аргументов выполняются все бенчмарки. Используются реальные реестры
+из cbr_data/ (если они есть), остальные данные генерируются.
+"""
+
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+
+CBR_DATA = Path("cbr_data")
+
+
+def _timeit(func: Callable[[], object], repeat: int = 5) -> float:
+    """Лучшее время из repeat запусков, секунды."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _load_registries() -> tuple:
+    banks = {}
+    mfos = {}
+    bank_file = CBR_DATA / "bank_registry.json"
+    mfo_file = CBR_DATA / "mfo_registry.json"
+    if bank_file.exists():
+        banks = json.loads(bank_file.read_text(encoding="utf-8"))
+    if mfo_file.exists():
+        mfos = json.loads(mfo_file.read_text(encoding="utf-8"))
+    return banks, mfos
+
+
+def _creditor_names(banks: Dict, mfos: Dict) -> List[str]:
+    """Типичные названия кредиторов из отчётов + выборка названий из реестров."""
+    names = [
+        "ПАО «Сбербанк»", "Сбербанк России", "АО «Тинькофф Банк»", "ПАО «МТС-Банк»",
+        "МТС-БАНК ПАО", "АО «Альфа-Банк»", "ПАО Совкомбанк", "Почта Банк",
+        "ООО КБ «Ренессанс Кредит»", "ООО МФК «Займер»", "ООО МКК «ВэбБанкир»",
+        "ООО «Да-кредит МКК»", "ООО МФК «Лайм-Займ»", "ООО МФК «МигКредит»",
+        "Быстроденьги", "ООО МКК «Екапуста»", "МФО: ООО МФК «Мани Мен»",
+    ]
+    names += [entry["название"] for entry in list(banks.values())[:200]]
+    names += [entry["название"] for entry in list(mfos.values())[:200]]
+    return names
+
+
+def bench_registry_lookup() -> None:
+    """Поиск кредитора в реестрах: полный перебор против инвертированного индекса."""
+    from processor import DocumentProcessor
+    from registry_index import get_registry_index
+
+    banks, mfos = _load_registries()
+    if not banks and not mfos:
+        print("[SKIP] Нет реестров в cbr_data/")
+        return
+
+    names = _creditor_names(banks, mfos)
+    keywords = [DocumentProcessor.extract_search_keywords(name) for name in names]
+
+    def linear_scan():
+        for kws in keywords:
+            if not kws:
+                continue
+            for registry in (mfos, banks):
+                for key, data in registry.items():
+                    name_lower = data.get("название", "").lower()
+                    if sum(1 for kw in kws if kw in name_lower) >= len(kws) * 0.7:
+                        break
+
+    build_time = _timeit(lambda: (get_registry_index(dict(banks)), get_registry_index(dict(mfos))), repeat=1)
+    bank_index = get_registry_index(banks)
+    mfo_index = get_registry_index(mfos)
+
+    def indexed():
+        for kws in keywords:
+            if kws:
+                mfo_index.best_keyword_match(kws)
+                bank_index.best_keyword_match(kws)
+
+    linear = _timeit(linear_scan)
+    fast = _timeit(indexed)
+    per_lookup = len(keywords) or 1
+    print(f"Реестры: {len(banks)} банков, {len(mfos)} МФО; запросов: {len(keywords)}")
+    print(f"  построение индексов:  {build_time * 1000:8.1f} мс")
+    print(f"  полный перебор:       {linear / per_lookup * 1000:8.3f} мс/запрос")
+    print(f"  индекс:               {fast / per_lookup * 1000:8.3f} мс/запрос  (x{linear / fast if fast else 0:.0f})")
+
+
+def bench_registry_fuzzy() -> None:
+    """Нечёткий поиск по триграммам: построение индекса и top-5 запросы."""
+    from registry_index import TrigramIndex
+
+    banks, mfos = _load_registries()
+    if not banks and not mfos:
+        print("[SKIP] Нет реестров в cbr_data/")
+        return
+
+    names = _creditor_names(banks, mfos)
+    items = [(key, data.get("название", "")) for registry in (banks, mfos) for key, data in registry.items()]
+    build_time = _timeit(lambda: TrigramIndex(items), repeat=3)
+    index = TrigramIndex(items)
+
+    search_time = _timeit(lambda: [index.search(name, k=5) for name in names])
+    print(f"Записей: {len(index)}; запросов: {len(names)}")
+    print(f"  построение индекса:   {build_time * 1000:8.1f} мс")
+    print(f"  поиск top-5:          {search_time / len(names) * 1000:8.3f} мс/запрос")
+
+
+def bench_registry_update() -> None:
+    """Перенос ИНН при обновлении реестра банков: вложенный перебор против хэш-соединения."""
+    from cbr_registry import CBRExcelRegistry
+
+    banks, _ = _load_registries()
+    if not banks:
+        print("[SKIP] Нет реестра банков в cbr_data/")
+        return
+
+    # Строки XLSX в формате ЦБ: 'КБ "Название" (ООО)'; локальная база - старый формат {ИНН: ...}
+    xlsx_rows = []
+    local_registry = {}
+    for number, (ogrn, data) in enumerate(banks.items()):
+        name = data["название"].replace("«", '"').replace("»", '"')
+        xlsx_rows.append({"ogrn": ogrn, "bnk_name": name, "bnk_addr": data.get("адрес", "")})
+        if number % 2 == 0:
+            local_name = data["название"]
+            if number % 10 == 0 and len(local_name) > 8:
+                local_name = local_name[:-3] + local_name[-2:]  # опечатка OCR
+            local_registry[f"{7700000000 + number}"] = {"название": local_name, "адрес": ""}
+
+    registry = CBRExcelRegistry()
+
+    def legacy_update():
+        matched = 0
+        for bank in xlsx_rows:
+            xlsx_name = registry.normalize_bank_name_from_xlsx(bank["bnk_name"]).lower()
+            for inn, data in local_registry.items():
+                local_name = data["название"].lower()
+                local_clean = local_name.replace("пао", "").replace("ао", "").replace("оао", "").replace("ооо", "").replace("«", "").replace("»", "").strip()
+                xlsx_clean = xlsx_name.replace("пао", "").replace("ао", "").replace("оао", "").replace("ооо", "").replace("«", "").replace("»", "").strip()
+                if local_clean in xlsx_clean or xlsx_clean in local_clean:
+                    matched += 1
+                    break
+        return matched
+
+    import contextlib
+    import io
+
+    legacy = _timeit(legacy_update, repeat=1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        fast = _timeit(lambda: registry.update_bank_registry_addresses(local_registry, xlsx_rows), repeat=3)
+    stats = registry.last_match_stats
+    print(f"Банков в XLSX: {len(xlsx_rows)}; записей локальной базы: {len(local_registry)}")
+    print(f"  вложенный перебор:    {legacy * 1000:8.1f} мс")
+    print(f"  хэш-соединение:       {fast * 1000:8.1f} мс  (x{legacy / fast if fast else 0:.0f})")
+    print(f"  совпадения: по ОГРН {stats['by_ogrn']}, по названию {stats['by_name']}, "
+          f"нечётко {stats['fuzzy']}, без ИНН {stats['unmatched']}")
+
+
+def bench_registry_startup() -> None:
+    """Старт процесса: загрузка JSON-реестров против открытия registry.sqlite."""
+    import tempfile
+    import tracemalloc
+
+    from registry_index import get_identifier_index, get_registry_index
+    from registry_store import build_registry_store, open_registry_store
+
+    banks, mfos = _load_registries()
+    if not banks and not mfos:
+        print("[SKIP] Нет реестров в cbr_data/")
+        return
+
+    def load_json():
+        for name in ("bank_registry.json", "mfo_registry.json"):
+            with open(CBR_DATA / name, encoding="utf-8") as f:
+                json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_time = _timeit(lambda: build_registry_store(banks, mfos, Path(tmp)), repeat=1)
+
+        def open_store():
+            store = open_registry_store(directory=Path(tmp))
+            return len(store.mapping("bank")) + len(store.mapping("mfo"))
+
+        tracemalloc.start()
+        load_json()
+        json_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        tracemalloc.start()
+        open_store()
+        store_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        store = open_registry_store(directory=Path(tmp))
+        bank_map, mfo_map = store.mapping("bank"), store.mapping("mfo")
+        lookup_keys = list(mfos)[:200]
+        lookups = _timeit(lambda: [get_identifier_index(bank_map, mfo_map).lookup(inn=key) for key in lookup_keys])
+        names = _creditor_names(banks, mfos)
+        keyword_time = _timeit(lambda: [get_registry_index(bank_map).best_keyword_match(name.lower().split()) for name in names], repeat=1)
+
+        print(f"Реестры: {len(banks)} банков, {len(mfos)} МФО; размер хранилища: {store.path.stat().st_size // 1024} КБ")
+        print(f"  сборка хранилища:     {build_time * 1000:8.1f} мс")
+        print(f"  json.load:            {_timeit(load_json) * 1000:8.1f} мс, пик памяти {json_memory // 1024} КБ")
+        print(f"  открытие хранилища:   {_timeit(open_store) * 1000:8.1f} мс, пик памяти {store_memory // 1024} КБ")
+        print(f"  поиск по ИНН:         {lookups / len(lookup_keys) * 1000:8.3f} мс/запрос")
+        print(f"  поиск по словам:      {keyword_time / len(names) * 1000:8.3f} мс/запрос")
+
+
+def bench_xlsx_parse() -> None:
+    """Разбор справочника банков (синтетика, 10 000 строк): словари по строкам против потока."""
+    import contextlib
+    import io
+    import tempfile
+
+    try:
+        import openpyxl
+    except ImportError:
+        print("[SKIP] openpyxl не установлен")
+        return
+    from cbr_registry import CBRExcelRegistry
+
+    headers = ["cregnum", "bnk_name", "ogrn", "bnk_addr", "reg_date", "lic_status", "okpo", "bik", "swift", "phone"]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "banks_registry.xlsx"
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(headers)
+        for number in range(10_000):
+            sheet.append([
+                str(number), f'АКБ "Тестовый банк {number}" (АО)', f"{1027700000000 + number}",
+                f"Российская Федерация, город Москва, улица Тестовая, дом {number}",
+                "01.01.2000", "Действующая", "00000000", "044525000", "TESTRUMM", "+7 495 000-00-00",
+            ])
+        workbook.save(path)
+
+        registry = CBRExcelRegistry()
+
+        def dict_rows():
+            with contextlib.redirect_stdout(io.StringIO()):
+                registry.update_bank_registry_addresses({}, registry.parse_banks_registry(path))
+
+        def streamed():
+            with contextlib.redirect_stdout(io.StringIO()):
+                registry.update_bank_registry_addresses({}, registry.iter_banks(path))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            dict_parse = _timeit(lambda: registry.parse_banks_registry(path), repeat=3)
+        stream_parse = _timeit(lambda: sum(1 for _ in registry.iter_banks(path)), repeat=3)
+        print(f"Строк: 10000, колонок: {len(headers)}")
+        print(f"  parse_banks_registry: {dict_parse * 1000:8.1f} мс")
+        print(f"  iter_banks:           {stream_parse * 1000:8.1f} мс  (x{dict_parse / stream_parse if stream_parse else 0:.1f})")
+        print(f"  разбор + реестр (словари): {_timeit(dict_rows, repeat=3) * 1000:8.1f} мс")
+        print(f"  разбор + реестр (поток):   {_timeit(streamed, repeat=3) * 1000:8.1f} мс")
+
+
+def bench_credit_linkage() -> None:
+    """Дедупликация 5 000 синтетических кредитов (ОКБ/БКИ/НБКИ/справки) через credit_linkage."""
+    import random
+    from datetime import date, timedelta
+    from decimal import Decimal
+
+    from credit_linkage import CreditRecord, link_credits
+
+    rng = random.Random(42)
+    creditors = [(f"кредитор {number}", f"{7700000000 + number}") for number in range(300)]
+    sources = ("отчет_окб", "отчет_бки", "отчет_нбки")
+
+    # ~2 000 договоров, каждый встречается в 1-3 источниках; ±1 день у части дублей
+    records = []
+    truth = []
+    contract = 0
+    while len(records) < 5_000:
+        name, inn = rng.choice(creditors)
+        signed = date(2018, 1, 1) + timedelta(days=rng.randrange(2500))
+        original = Decimal(rng.randrange(5, 500) * 1000)
+        for source in rng.sample(sources, rng.randint(1, 3)):
+            shifted = signed + timedelta(days=rng.choice((0, 0, 0, 1)))
+            records.append(CreditRecord(
+                source=source,
+                creditor_key=name,
+                inn=inn if source != "отчет_бки" else "",
+                contract_date=shifted,
+                original_amount=original,
+                debt=Decimal(rng.randrange(1000, 500_000)),
+            ))
+            truth.append(contract)
+        if rng.random() < 0.1:
+            records.append(CreditRecord(
+                source="справка_о_задолженности", creditor_key=name, contract_date=signed,
+                debt=Decimal(rng.randrange(1000, 500_000)), is_statement=True,
+            ))
+            truth.append(contract)
+        contract += 1
+
+    elapsed = _timeit(lambda: link_credits(records), repeat=3)
+    result = link_credits(records)
+
+    predicted = {}
+    for cluster_id, cluster in enumerate(result.clusters):
+        for index in cluster:
+            predicted[index] = cluster_id
+    true_pairs = predicted_pairs = common_pairs = 0
+    by_contract = {}
+    for index, contract_id in enumerate(truth):
+        by_contract.setdefault(contract_id, []).append(index)
+    for members in by_contract.values():
+        true_pairs += len(members) * (len(members) - 1) // 2
+        common_pairs += sum(
+            1 for i, a in enumerate(members) for b in members[i + 1:] if predicted[a] == predicted[b]
+        )
+    for cluster in result.clusters:
+        predicted_pairs += len(cluster) * (len(cluster) - 1) // 2
+
+    all_pairs = len(records) * (len(records) - 1) // 2
+    print(f"Записей: {len(records)}; договоров: {contract}; кластеров: {len(result.clusters)}")
+    print(f"  связывание:           {elapsed * 1000:8.1f} мс")
+    print(f"  сравнений пар:        {result.comparisons} из {all_pairs} ({result.comparisons / all_pairs:.4%})")
+    print(f"  точность / полнота:   {common_pairs / (predicted_pairs or 1):.3f} / {common_pairs / (true_pairs or 1):.3f}")
+
+
+def bench_name_normalization() -> None:
+    """Нормализация названий кредиторов: первый вызов (без кэша) и повторные (кэш)."""
+    from processor import DocumentProcessor
+
+    banks, mfos = _load_registries()
+    names = list(dict.fromkeys(_creditor_names(banks, mfos)))
+    # Как в обработке дела: каждое название встречается в нескольких отчётах и таблицах
+    workload = names * 5
+    creditor_name = DocumentProcessor.normalize_creditor_name
+    bank_name = DocumentProcessor.normalize_bank_name
+    bank_rules = DocumentProcessor._normalize_bank_name_by_rules
+
+    def clear():
+        creditor_name.cache_clear()
+        bank_rules.cache_clear()
+
+    def cold(func):
+        def run():
+            clear()
+            for name in names:
+                func(name)
+        return run
+
+    def workload_run():
+        clear()
+        for name in workload:
+            bank_name(name)
+            creditor_name(name)
+
+    creditor_cold = _timeit(cold(creditor_name))
+    bank_cold = _timeit(cold(bank_name))
+    clear()
+    for name in names:
+        bank_name(name)
+    bank_warm = _timeit(lambda: [bank_name(name) for name in names])
+    workload_time = _timeit(workload_run)
+    info = bank_rules.cache_info()
+    print(f"Названий: {len(names)}; нагрузка: {len(workload)} вызовов normalize_bank_name + normalize_creditor_name")
+    print(f"  normalize_creditor_name (без кэша): {creditor_cold / len(names) * 1e6:8.2f} мкс/вызов")
+    print(f"  normalize_bank_name (без кэша):     {bank_cold / len(names) * 1e6:8.2f} мкс/вызов")
+    print(f"  normalize_bank_name (кэш):          {bank_warm / len(names) * 1e6:8.2f} мкс/вызов")
+    print(f"  нагрузка целиком:                   {workload_time * 1000:8.2f} мс "
+          f"(попаданий в кэш: {info.hits}, промахов: {info.misses})")
+
+
+def _legacy_parse_decimal(value):
+    """parse_decimal до перехода на регулярное выражение (эталон для сравнения)."""
+    from decimal import Decimal, InvalidOperation
+
+    if not value:
+        return None
+    cleaned = str(value)
+    for token in ("\xa0", " ", "руб.", "руб", "р.", "р", "₽"):
+        cleaned = cleaned.replace(token, "")
+    cleaned = cleaned.replace(",", ".")
+    allowed = "0123456789.-"
+    normalized = "".join(ch for ch in cleaned if ch in allowed)
+    if not normalized or normalized in {"-", ".", "-."}:
+        return None
+    try:
+        return Decimal(normalized)
+    except InvalidOperation:
+        return None
+
+
+def bench_parse_decimal() -> None:
+    """parse_decimal: сверка с прежней реализацией и пропускная способность."""
+    import random
+    from decimal import Decimal
+
+    from processor import DocumentProcessor, _parse_amount_text
+
+    rng = random.Random(7)
+    # Форматы, которые прежний разбор понимал правильно - результаты должны совпасть
+    samples = []
+    for _ in range(20_000):
+        rubles = rng.randrange(0, 10_000_000)
+        kopecks = rng.randrange(100)
+        text = rng.choice((
+            f"{rubles}", f"{rubles}.{kopecks:02d}", f"{rubles},{kopecks:02d}",
+            f"{rubles:,}".replace(",", " ") + f",{kopecks:02d}",
+            f"{rubles:,}".replace(",", "\xa0") + f",{kopecks:02d} руб.",
+            f"-{rubles}.{kopecks:02d}", f"{rubles} р.", f"{rubles}₽", f"{rubles},{kopecks:02d} руб",
+        ))
+        samples.append(text)
+    samples += [12345.67, 100, 0, None, "", "-", "н/д", "долг 5000 руб"]
+
+    mismatches = [
+        value for value in samples
+        if DocumentProcessor.parse_decimal(value) != _legacy_parse_decimal(value)
+    ]
+    # Форматы, которые прежний разбор портил
+    fixed = {
+        "1.234.567,89": Decimal("1234567.89"),
+        "1,234,567.89": Decimal("1234567.89"),
+        "1 234 руб. 56 коп.": Decimal("1234.56"),
+        "1.500 руб. 50 коп.": Decimal("1500.50"),
+        "−2 500,00": Decimal("-2500.00"),
+        "1 000 000 рублей": Decimal("1000000"),
+    }
+    wrong = {
+        text: DocumentProcessor.parse_decimal(text)
+        for text, expected in fixed.items()
+        if DocumentProcessor.parse_decimal(text) != expected
+    }
+    print(f"Сверка с прежней реализацией: {len(samples)} значений, расхождений {len(mismatches)}")
+    for value in mismatches[:10]:
+        print(f"  [DIFF] {value!r}: {DocumentProcessor.parse_decimal(value)} != {_legacy_parse_decimal(value)}")
+    print(f"Исправленные форматы: {len(fixed) - len(wrong)}/{len(fixed)}")
+    for text, result in wrong.items():
+        print(f"  [FAIL] {text!r} -> {result}, ожидалось {fixed[text]}")
+
+    strings = [value for value in samples if isinstance(value, str)]
+    # Как в обработке дела: одни и те же суммы разбираются несколько раз
+    repeated = strings[:2_000] * 10
+
+    def uncached():
+        _parse_amount_text.cache_clear()
+        for value in strings:
+            DocumentProcessor.parse_decimal(value)
+
+    legacy = _timeit(lambda: [_legacy_parse_decimal(value) for value in strings])
+    fast = _timeit(uncached)
+    legacy_repeated = _timeit(lambda: [_legacy_parse_decimal(value) for value in repeated])
+    _parse_amount_text.cache_clear()
+    cached = _timeit(lambda: [DocumentProcessor.parse_decimal(value) for value in repeated])
+    print(f"  прежний разбор:       {legacy / len(strings) * 1e6:8.2f} мкс/значение")
+    print(f"  регулярное выражение: {fast / len(strings) * 1e6:8.2f} мкс/значение")
+    print(f"  повторы (x10), прежний / с кэшем: {legacy_repeated / len(repeated) * 1e6:.2f} / "
+          f"{cached / len(repeated) * 1e6:.2f} мкс/значение")
+    if mismatches or wrong:
+        raise SystemExit(1)
+
+
+def bench_template_render() -> None:
+    """Рендер шаблонов templ/urist*: новый DocxTemplate на документ против кэша template_cache."""
+    import io
+    import zipfile
+
+    from docxtpl import DocxTemplate
+
+    import template_cache
+
+    folders = sorted(path for path in Path("templ").glob("urist*") if path.is_dir())
+    if not folders:
+        print("[SKIP] Нет шаблонов в templ/")
+        return
+    context = {"credits": [], "taxes": []}
+
+    def render(make, template_path):
+        buffer = io.BytesIO()
+        make(template_path).save(buffer)
+        with zipfile.ZipFile(buffer) as archive:
+            return archive.read("word/document.xml")
+
+    def fresh(template_path):
+        doc = DocxTemplate(template_path)
+        doc.render(context)
+        return doc
+
+    def cached(template_path):
+        return template_cache.render_template(template_path, context)[0]
+
+    mismatches = 0
+    for folder in folders:
+        templates = sorted(path for path in folder.glob("*.docx") if not path.name.startswith("~$"))
+        template_cache.clear_templates()
+        mismatches += sum(render(fresh, path) != render(cached, path) for path in templates)
+        cold = _timeit(lambda: [render(fresh, path) for path in templates], repeat=3)
+        warm = _timeit(lambda: [render(cached, path) for path in templates], repeat=3)
+        print(f"{folder.name}: {len(templates)} шаблонов; на должника без кэша {cold * 1000:7.1f} мс, "
+              f"с кэшем {warm * 1000:7.1f} мс (экономия {(cold - warm) * 1000:.1f} мс)")
+    print(f"Расхождений document.xml: {mismatches}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+BENCHMARKS = {
+    "registry_lookup": bench_registry_lookup,
+    "registry_fuzzy": bench_registry_fuzzy,
+    "registry_update": bench_registry_update,
+    "registry_startup": bench_registry_startup,
+    "xlsx_parse": bench_xlsx_parse,
+    "credit_linkage": bench_credit_linkage,
+    "name_normalization": bench_name_normalization,
+    "parse_decimal": bench_parse_decimal,
+    "template_render": bench_template_render,
+}
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        if name not in BENCHMARKS:
+            print(f"[ERROR] Неизвестный бенчмарк: {name}. Доступны: {', '.join(BENCHMARKS)}")
+            continue
+        print("=" * 80)
+        print(f"[BENCH] {name}")
+        print("=" * 80)
+        BENCHMARKS[name]()
+        print()
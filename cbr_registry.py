@@ -15,12 +15,68 @@
 - Можно автоматически обновлять периодически
 """
 
+import hashlib
+import json
+import os
+
 import requests
 import openpyxl
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 from datetime import datetime
 
+from registry_index import FUZZY_THRESHOLD, TrigramIndex, get_trigram_index, normalize_org_name, split_identifiers
+
+
+# Колонки справочников, нужные для реестров (заголовок в XLSX)
+BANK_COLUMNS = ('ogrn', 'bnk_name', 'bnk_addr')
+BANK_HEADER_ROW = 1
+MFO_COLUMNS = (
+    'Идентификационный номер налогоплательщика',
+    'Полное наименование',
+    'Сокращенное наименование',
+    'Адрес, указанный в едином государственном реестре юридических лиц',
+)
+MFO_HEADER_ROW = 5
+
+
+def iter_xlsx_rows(filepath: Path, header_row: int, columns: Sequence[str]) -> Iterator[Tuple[str, ...]]:
+    """
+    Потоковое чтение XLSX: кортежи значений нужных колонок (пустые - '')
+    
+    Колонки сопоставляются по заголовку один раз; строки не превращаются
+    в словари и не накапливаются в памяти. Строки без первой колонки пропускаются.
+    """
+    workbook = openpyxl.load_workbook(filepath, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(min_row=header_row, values_only=True)
+        headers = [str(value).strip() if value is not None else None for value in next(rows, ())]
+        missing = [column for column in columns if column not in headers]
+        if missing:
+            raise ValueError(f"В {filepath.name} нет колонок: {', '.join(missing)}")
+        indexes = [headers.index(column) for column in columns]
+        width = max(indexes) + 1
+        key_index = indexes[0]
+        
+        for row in rows:
+            if len(row) < width or row[key_index] is None:
+                continue
+            values = tuple('' if row[i] is None else str(row[i]).strip() for i in indexes)
+            if values[0]:
+                yield values
+    finally:
+        workbook.close()
+
+
+def build_mfo_registry(rows: Iterable[Tuple[str, ...]]) -> Dict[str, Dict[str, str]]:
+    """MFO_REGISTRY {ИНН: {название, адрес}} из строк iter_xlsx_rows(..., MFO_COLUMNS)"""
+    registry = {}
+    for inn, full_name, short_name, address in rows:
+        name = full_name or short_name
+        if name:
+            registry[inn] = {'название': name, 'адрес': address}
+    return registry
+
 
 class CBRExcelRegistry:
     """Класс для работы со XLSX-справочниками ЦБ РФ"""
@@ -35,9 +91,93 @@ class CBRExcelRegistry:
     # Папка для хранения скачанных файлов
     DATA_DIR = Path("cbr_data")
     
+    # Порог нечёткого совпадения названий при переносе ИНН из локальной базы
+    # (строже, чем для поиска: ошибочный ИНН хуже отсутствующего)
+    INN_FUZZY_THRESHOLD = 0.85
+    
     def __init__(self):
         """Создает папку для данных, если её нет"""
         self.DATA_DIR.mkdir(exist_ok=True)
+        # Статистика последнего update_bank_registry_addresses
+        self.last_match_stats: Dict[str, int] = {}
+        # Изменился ли файл при последнем скачивании: {"banks": bool, "mfo": bool}
+        self.download_changed: Dict[str, bool] = {}
+        # Валидаторы скачанных файлов, ещё не подтверждённые успешной пересборкой
+        self._pending_state: Dict[str, Dict[str, Any]] = {}
+        # Сокращение адресов (создаётся при первом обращении)
+        self._address_normalizer = None
+    
+    @property
+    def download_state_file(self) -> Path:
+        return self.DATA_DIR / "download_state.json"
+    
+    def load_download_state(self) -> Dict[str, Dict[str, Any]]:
+        """ETag / Last-Modified / sha256 последних обработанных файлов"""
+        try:
+            with open(self.download_state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def commit_download_state(self):
+        """Запомнить валидаторы скачанных файлов после успешной пересборки реестров.
+        
+        До этого момента состояние не сохраняется: если разбор или сборка упадут,
+        следующий запуск не пропустит файл как "не изменившийся".
+        """
+        if not self._pending_state:
+            return
+        state = self.load_download_state()
+        state.update(self._pending_state)
+        tmp_file = self.download_state_file.with_name(f"{self.download_state_file.name}.{os.getpid()}.tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.download_state_file)
+        self._pending_state = {}
+    
+    def _conditional_download(self, source: str, url: str, filepath: Path) -> Path:
+        """
+        Скачивает файл с условными заголовками (If-None-Match / If-Modified-Since)
+        
+        Ответ 304 или совпадение sha256 с последним обработанным файлом означают,
+        что справочник не изменился (download_changed[source] = False).
+        
+        Raises:
+            requests.RequestException: при ошибке сети или HTTP
+        """
+        known = self.load_download_state().get(source, {})
+        headers = {}
+        if filepath.exists():
+            if known.get('etag'):
+                headers['If-None-Match'] = known['etag']
+            if known.get('last_modified'):
+                headers['If-Modified-Since'] = known['last_modified']
+        
+        response = requests.get(url, timeout=30, headers=headers)
+        if response.status_code == 304:
+            print(f"   Не изменился (HTTP 304): {filepath}")
+            self.download_changed[source] = False
+            return filepath
+        response.raise_for_status()
+        
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'sha256': content_hash,
+        }
+        if filepath.exists() and known.get('sha256') == content_hash:
+            print(f"   Содержимое не изменилось (sha256): {filepath}")
+            self.download_changed[source] = False
+            # Обновляем валидаторы (сервер мог сменить ETag при том же содержимом)
+            self._pending_state[source] = validators
+            return filepath
+        
+        filepath.write_bytes(response.content)
+        self.download_changed[source] = True
+        self._pending_state[source] = validators
+        print(f"   Размер: {len(response.content) / 1024:.1f} KB")
+        return filepath
     
     def download_banks_registry(self) -> Optional[Path]:
         """
@@ -53,15 +193,8 @@ class CBRExcelRegistry:
         url = f"{self.BANKS_URL}?FromDate={today}&ToDate={today}&posted=False"
         
         try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            
-            # Сохраняем файл
-            filepath = self.DATA_DIR / "banks_registry.xlsx"
-            filepath.write_bytes(response.content)
-            
+            filepath = self._conditional_download('banks', url, self.DATA_DIR / "banks_registry.xlsx")
             print(f"✅ Справочник банков сохранен: {filepath}")
-            print(f"   Размер: {len(response.content) / 1024:.1f} KB")
             return filepath
             
         except requests.RequestException as e:
@@ -78,21 +211,22 @@ class CBRExcelRegistry:
         print("\n📥 Скачиваю справочник МФО...")
         
         try:
-            response = requests.get(self.MFO_URL, timeout=30)
-            response.raise_for_status()
-            
-            # Сохраняем файл
-            filepath = self.DATA_DIR / "mfo_registry.xlsx"
-            filepath.write_bytes(response.content)
-            
+            filepath = self._conditional_download('mfo', self.MFO_URL, self.DATA_DIR / "mfo_registry.xlsx")
             print(f"✅ Справочник МФО сохранен: {filepath}")
-            print(f"   Размер: {len(response.content) / 1024:.1f} KB")
             return filepath
             
         except requests.RequestException as e:
             print(f"❌ Ошибка скачивания справочника МФО: {e}")
             return None
     
+    def iter_banks(self, filepath: Path) -> Iterator[Tuple[str, str, str]]:
+        """Потоковый разбор справочника банков: (ОГРН, название, адрес)"""
+        return iter_xlsx_rows(filepath, BANK_HEADER_ROW, BANK_COLUMNS)
+    
+    def iter_mfos(self, filepath: Path) -> Iterator[Tuple[str, str, str, str]]:
+        """Потоковый разбор справочника МФО: (ИНН, полное название, сокращенное, адрес)"""
+        return iter_xlsx_rows(filepath, MFO_HEADER_ROW, MFO_COLUMNS)
+    
     def parse_banks_registry(self, filepath: Path) -> List[Dict]:
         """
         Парсит XLSX-файл со справочником банков
@@ -209,33 +343,33 @@ class CBRExcelRegistry:
             traceback.print_exc()
             return []
     
-    def search_bank(self, banks: List[Dict], query: str) -> List[Dict]:
+    def search_bank(self, banks: List[Dict], query: str, limit: int = 10, threshold: float = 0.4) -> List[Dict]:
         """
         Поиск банка в справочнике по названию или ОГРН
         
         Args:
             banks: Список банков из справочника
             query: Строка поиска (название или ОГРН)
+            limit: Максимум результатов нечёткого поиска
+            threshold: Минимальное сходство названий (0..1)
         
         Returns:
-            Список найденных банков
+            Список найденных банков (по убыванию сходства названия)
         """
-        query_lower = query.lower()
-        results = []
+        query = query.strip()
         
-        for bank in banks:
-            # Ищем в названии
-            name = bank.get('bnk_name', '')
-            if name and query_lower in name.lower():
-                results.append(bank)
-                continue
-            
-            # Ищем по ОГРН
-            ogrn = bank.get('ogrn', '')
-            if ogrn and query in str(ogrn):
-                results.append(bank)
+        # Поиск по ОГРН
+        if query.isdigit():
+            return [bank for bank in banks if bank.get('ogrn') and query in str(bank.get('ogrn'))]
         
-        return results
+        # Нечёткий поиск по названию (индекс строится один раз на список банков)
+        found = get_trigram_index(banks, 'bnk_name').search(query, k=limit, threshold=threshold)
+        if found:
+            return [banks[position] for position, _ in found]
+        
+        # Короткие запросы ("ВТБ") дают низкое сходство - ищем вхождение подстроки
+        query_lower = query.lower()
+        return [bank for bank in banks if query_lower in bank.get('bnk_name', '').lower()][:limit]
     
     def get_bank_info_by_name(self, banks: List[Dict], bank_name: str) -> Optional[Dict]:
         """
@@ -248,69 +382,50 @@ class CBRExcelRegistry:
         Returns:
             Словарь с информацией о банке или None
         """
-        # Нормализуем название для поиска
-        search_name = bank_name.lower().replace('пао', '').replace('ао', '').replace('оао', '').replace('ооо', '').replace('«', '').replace('»', '').strip()
+        # Лучшее совпадение по нормализованному названию (без ОПФ и кавычек)
+        match = get_trigram_index(banks, 'bnk_name').best(bank_name, threshold=FUZZY_THRESHOLD)
+        if not match:
+            return None
         
-        for bank in banks:
-            bank_full_name = bank.get('bnk_name', '').lower()
-            
-            if search_name in bank_full_name or bank_full_name in search_name:
-                return {
-                    'название': bank.get('bnk_name', ''),
-                    'адрес': bank.get('bnk_addr', ''),
-                    'огрн': bank.get('ogrn', ''),
-                    'рег_номер': bank.get('cregnum', ''),
-                    'дата_регистрации': bank.get('reg_date', ''),
-                    'статус_лицензии': bank.get('lic_status', '')
-                }
-        
-        return None
-    
-    def normalize_address_with_gpt(self, long_address: str) -> str:
+        bank = banks[match[0]]
+        return {
+            'название': bank.get('bnk_name', ''),
+            'адрес': bank.get('bnk_addr', ''),
+            'огрн': bank.get('ogrn', ''),
+            'рег_номер': bank.get('cregnum', ''),
+            'дата_регистрации': bank.get('reg_date', ''),
+            'статус_лицензии': bank.get('lic_status', '')
+        }
+    
+    def normalize_addresses(self, addresses: Iterable[str]) -> Dict[str, str]:
         """
-        Нормализует длинный адрес из XLSX ЦБ к короткому формату через GPT-4o-mini
-        
-        Args:
-            long_address: Длинный адрес (например: "Российская Федерация, город Москва, улица Вавилова, дом 19")
+        Пакетная нормализация адресов: {исходный адрес: короткий}
         
-        Returns:
-            Короткий адрес (например: "117312, г. Москва, ул. Вавилова, д. 19")
+        Неразобранные правилами адреса уходят в GPT пачками, а не по одному.
         """
-        from openai import OpenAI
-        import os
+        from address_normalizer import AddressNormalizer
         
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        if self._address_normalizer is None:
+            self._address_normalizer = AddressNormalizer(self.DATA_DIR / "address_cache.json")
+        return self._address_normalizer.normalize_many(addresses)
+    
+    def shorten_registry_addresses(self, registry: Dict[str, Dict]) -> Dict[str, Dict]:
+        """
+        Заменяет адреса реестра {ключ: {название, адрес, ...}} короткими (на месте)
         
-        prompt = f"""Преобразуй адрес в короткий юридический формат для документов.
-
-ДЛИННЫЙ АДРЕС: {long_address}
-
-ПРАВИЛА:
-1. Добавь индекс в начало (если нет - оставь без индекса)
-2. Сократи: "город" → "г.", "улица" → "ул.", "дом" → "д.", "корпус" → "к.", "строение" → "стр.", "литера" → "лит."
-3. Удали "Российская Федерация", "вн.тер.г.", "муниципальный округ"
-4. Формат: "индекс, область/край (если есть), г. Город, ул. Улица, д. X, к. Y, стр. Z"
-5. Убери лишние пробелы
-
-ПРИМЕРЫ:
-Вход: "Российская Федерация, город Москва, улица Вавилова, дом 19"
-Выход: "117312, г. Москва, ул. Вавилова, д. 19"
-
-Вход: "191144, г. Санкт-Петербург, Дегтярный переулок, д.11. лит. А"
-Выход: "191144, г. Санкт-Петербург, Дегтярный пер., д. 11, лит. А"
-
-Верни ТОЛЬКО короткий адрес, без объяснений."""
-
+        При ошибке сокращения адреса остаются как в справочнике ЦБ.
+        """
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
+            shortened = self.normalize_addresses(
+                data['адрес'] for data in registry.values() if data.get('адрес')
             )
-            normalized = response.choices[0].message.content.strip()
-            return normalized
         except Exception as e:
-            print(f"⚠️  Ошибка нормализации адреса: {e}")
-            return long_address  # Возвращаем исходный адрес при ошибке
+            print(f"[WARN] Не удалось сократить адреса: {e}")
+            return registry
+        for data in registry.values():
+            if data.get('адрес'):
+                data['адрес'] = shortened.get(data['адрес'], data['адрес'])
+        return registry
     
     def normalize_bank_name_from_xlsx(self, raw_name: str) -> str:
         """
@@ -368,77 +483,199 @@ class CBRExcelRegistry:
         
         return result
 
-    def update_bank_registry_addresses(self, current_registry: Dict[str, Dict], banks: List[Dict]) -> Dict[str, Dict]:
+    def update_bank_registry_addresses(self, current_registry: Dict[str, Dict],
+                                       banks: Iterable[Union[Dict, Tuple[str, str, str]]]) -> Dict[str, Dict]:
         """
         Обновляет BANK_REGISTRY: берет ВСЕ банки из XLSX + добавляет ИНН из локальной базы
         
-        Логика:
+        Логика (названия нормализуются один раз, сопоставление - через хэш-таблицы):
         1. Берем ВСЕ банки из XLSX (ключ = ОГРН, значение = название + адрес)
         2. Нормализуем названия банков (елочки, правильный порядок ОПФ)
-        3. Ищем ИНН в локальной базе по названию банка
-        4. Если ИНН найден и название совпадает - добавляем его
+        3. ИНН из локальной базы ищем: по ОГРН -> по точному нормализованному
+           названию -> нечётко по триграммам (порог INN_FUZZY_THRESHOLD)
         
         Args:
-            current_registry: Локальный BANK_REGISTRY {ИНН: {адрес, название}}
-            banks: Список банков из XLSX справочника ЦБ РФ
+            current_registry: Локальный BANK_REGISTRY ({ОГРН: {название, адрес, инн}}
+                или старый формат {ИНН: {название, адрес}})
+            banks: Банки из XLSX справочника ЦБ РФ: словари parse_banks_registry
+                или кортежи (ОГРН, название, адрес) из iter_banks
         
         Returns:
             Полный обновленный словарь: {ОГРН: {название, адрес, инн (опционально)}}
         """
+        # Локальная база: ОГРН -> ИНН, нормализованное название -> ИНН
+        inn_by_ogrn: Dict[str, str] = {}
+        inn_by_name: Dict[str, str] = {}
+        fuzzy_items = []
+        for key, data in current_registry.items():
+            # Ключ может быть ОГРН (текущий формат) или ИНН (старый формат)
+            key_inn, key_ogrn = split_identifiers(key)
+            local_inn = str(data.get('инн') or '').strip() or key_inn
+            if not local_inn:
+                continue
+            if key_ogrn:
+                inn_by_ogrn.setdefault(key_ogrn, local_inn)
+            normalized = normalize_org_name(data.get('название', ''))
+            if normalized:
+                inn_by_name.setdefault(normalized, local_inn)
+                fuzzy_items.append((local_inn, data.get('название', '')))
+        fuzzy_index = None  # Строится только если понадобится
+        
+        stats = {'total': 0, 'by_ogrn': 0, 'by_name': 0, 'fuzzy': 0, 'unmatched': 0, 'skipped': 0}
         updated_registry = {}
-        added_count = 0
-        inn_matched_count = 0
         
-        print(f"\n[UPDATE] Обрабатываю {len(banks)} банков из справочника ЦБ РФ...")
+        print(f"\n[UPDATE] Обрабатываю банки из справочника ЦБ РФ...")
         
         for bank in banks:
-            # Получаем ОГРН как ключ
-            ogrn = bank.get('ogrn', '').strip()
-            if not ogrn:
-                continue
-            
-            # Получаем название и адрес из XLSX (формат ЦБ РФ)
-            raw_name = bank.get('bnk_name', '').strip()
-            if not raw_name:
+            # Получаем ОГРН как ключ, название и адрес
+            if isinstance(bank, dict):
+                ogrn = str(bank.get('ogrn', '') or '').strip()
+                raw_name = str(bank.get('bnk_name', '') or '').strip()
+                raw_address = str(bank.get('bnk_addr', '') or '').strip()
+            else:
+                ogrn, raw_name, raw_address = bank
+            if not ogrn or not raw_name:
+                stats['skipped'] += 1
                 continue
             
-            # Нормализуем название (елочки, правильный порядок ОПФ)
+            # Нормализуем название (елочки, правильный порядок ОПФ); адрес сокращается после цикла
             normalized_name = self.normalize_bank_name_from_xlsx(raw_name)
             
-            # Получаем адрес из XLSX (используем как есть, без нормализации)
-            raw_address = bank.get('bnk_addr', '').strip()
-            
-            # Ищем ИНН в локальной базе по названию
-            matched_inn = None
-            for inn, data in current_registry.items():
-                local_name = data['название'].lower()
-                xlsx_name = normalized_name.lower()
-                
-                # Упрощенное сравнение: убираем ОПФ и кавычки
-                local_clean = local_name.replace('пао', '').replace('ао', '').replace('оао', '').replace('ооо', '').replace('«', '').replace('»', '').strip()
-                xlsx_clean = xlsx_name.replace('пао', '').replace('ао', '').replace('оао', '').replace('ооо', '').replace('«', '').replace('»', '').strip()
-                
-                if local_clean in xlsx_clean or xlsx_clean in local_clean:
-                    matched_inn = inn
-                    inn_matched_count += 1
-                    break
+            matched_inn = inn_by_ogrn.get(ogrn)
+            if matched_inn:
+                stats['by_ogrn'] += 1
+            else:
+                matched_inn = inn_by_name.get(normalize_org_name(normalized_name))
+                if matched_inn:
+                    stats['by_name'] += 1
+                elif fuzzy_items:
+                    if fuzzy_index is None:
+                        fuzzy_index = TrigramIndex(fuzzy_items)
+                    best = fuzzy_index.best(normalized_name, threshold=self.INN_FUZZY_THRESHOLD)
+                    if best:
+                        matched_inn = best[0]
+                        stats['fuzzy'] += 1
+            if not matched_inn:
+                stats['unmatched'] += 1
             
             # Добавляем банк с ОГРН как ключ
             updated_registry[ogrn] = {
                 'название': normalized_name,
                 'адрес': raw_address,
-                'инн': matched_inn if matched_inn else ''  # ИНН из локальной базы (если нашли)
+                'инн': matched_inn or ''  # ИНН из локальной базы (если нашли)
             }
-            added_count += 1
+        
+        # Короткие адреса для документов: кэш -> правила -> пачки в GPT
+        self.shorten_registry_addresses(updated_registry)
+        
+        stats['total'] = len(updated_registry)
+        self.last_match_stats = stats
         
         print(f"\n✅ Обновление завершено:")
-        print(f"   Всего банков из XLSX: {len(updated_registry)}")
-        print(f"   Из них с ИНН из локальной базы: {inn_matched_count}")
-        print(f"   Без ИНН: {len(updated_registry) - inn_matched_count}")
+        print(f"   Всего банков из XLSX: {stats['total']}")
+        print(f"   ИНН по ОГРН: {stats['by_ogrn']}, по названию: {stats['by_name']}, нечётко: {stats['fuzzy']}")
+        print(f"   Без ИНН: {stats['unmatched']}")
+        if stats['skipped']:
+            print(f"   Пропущено строк без ОГРН/названия: {stats['skipped']}")
         
         return updated_registry
 
 
+def diff_registries(old: Dict[str, Dict], new: Dict[str, Dict]) -> Dict[str, List[str]]:
+    """
+    Построчное сравнение двух версий реестра по ключу (ОГРН / ИНН)
+    
+    Returns:
+        {"added": [...], "removed": [...], "changed": [...]} - списки ключей
+    """
+    old_keys = set(old)
+    new_keys = set(new)
+    return {
+        'added': [key for key in new if key not in old_keys],
+        'removed': [key for key in old if key not in new_keys],
+        'changed': [key for key in new if key in old_keys and dict(old[key]) != dict(new[key])],
+    }
+
+
+def apply_registry_diff(current: Dict[str, Dict], new: Dict[str, Dict], diff: Dict[str, List[str]]) -> Dict[str, Dict]:
+    """
+    Новая версия реестра: неизменные записи переносятся из current как есть,
+    заменяются только добавленные и изменённые (порядок - как в new)
+    """
+    touched = set(diff['added']) | set(diff['changed'])
+    return {key: (new[key] if key in touched else current[key]) for key in new}
+
+
+def test_conditional_download():
+    """Тест условного скачивания на локальном HTTP-сервере (ETag / 304 / sha256)"""
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    
+    print("\n" + "=" * 80)
+    print("🌐 ТЕСТ: Условное скачивание справочников")
+    print("=" * 80)
+    
+    payload = {'body': b'registry v1', 'etag': '"v1"', 'requests': 0}
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            payload['requests'] += 1
+            if self.headers.get('If-None-Match') == payload['etag']:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', payload['etag'])
+            self.send_header('Content-Length', str(len(payload['body'])))
+            self.end_headers()
+            self.wfile.write(payload['body'])
+        
+        def log_message(self, *args):
+            pass
+    
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/list_MFO.xlsx"
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = CBRExcelRegistry()
+        registry.DATA_DIR = Path(tmp)
+        target = Path(tmp) / "mfo_registry.xlsx"
+        
+        # 1. Первое скачивание - файл новый
+        registry._conditional_download('mfo', url, target)
+        assert registry.download_changed['mfo'] is True
+        registry.commit_download_state()
+        
+        # 2. Повтор с ETag - сервер отвечает 304
+        registry._conditional_download('mfo', url, target)
+        assert registry.download_changed['mfo'] is False
+        
+        # 3. Сервер сменил ETag, но не содержимое - пропуск по sha256
+        payload['etag'] = '"v1-gzip"'
+        registry._conditional_download('mfo', url, target)
+        assert registry.download_changed['mfo'] is False
+        registry.commit_download_state()
+        
+        # 4. Новое содержимое - файл перезаписан
+        payload['body'], payload['etag'] = b'registry v2', '"v2"'
+        registry._conditional_download('mfo', url, target)
+        assert registry.download_changed['mfo'] is True
+        assert target.read_bytes() == b'registry v2'
+        
+        # 5. Без commit_download_state (сборка упала) файл не считается обработанным
+        assert registry.load_download_state()['mfo']['sha256'] == hashlib.sha256(b'registry v1').hexdigest()
+    
+    server.shutdown()
+    
+    old = {'1': {'название': 'А'}, '2': {'название': 'Б'}}
+    new = {'2': {'название': 'Б2'}, '3': {'название': 'В'}}
+    assert diff_registries(old, new) == {'added': ['3'], 'removed': ['1'], 'changed': ['2']}
+    
+    print(f"✅ Условное скачивание работает (запросов к серверу: {payload['requests']})")
+
+
 def test_download_and_parse():
     """Тест скачивания и парсинга справочников"""
     
@@ -616,6 +853,9 @@ if __name__ == "__main__":
         # Тест 4: Сравнение
         test_compare_with_current()
         
+        # Тест 5: Условное скачивание (локальный HTTP-сервер)
+        test_conditional_download()
+        
         print("\n" + "=" * 80)
         print("✅ Все тесты завершены")
         print("=" * 80)
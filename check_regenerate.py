@@ -0,0 +1,118 @@
+"""
+Проверка выборочной перегенерации документов после правки данных.
+
+Сценарий интерфейса: "Сохранить" (POST /save-data пишет правку в result.json),
+затем "Перегенерировать документы" (PUT /data с теми же данными). Правка уже
+в result.json, но документы, которые от неё зависят, должны перегенерироваться,
+а остальные - нет.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+import zipfile
+from pathlib import Path
+
+os.environ.setdefault('DATABASE_PATH', str(Path(tempfile.mkdtemp()) / 'check_regenerate.db'))
+
+import app as web
+from processor import OUTPUT_DIR
+
+LIST_DOC = 'Список кредиторов и должников.docx'
+DELAY_DOC = 'Ходатайство об отсрочке.docx'
+
+
+def wait_completed(conn, debtor_id, timeout=120):
+    """Дождаться окончания перегенерации (она идёт в фоновом потоке)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = conn.execute('SELECT status FROM debtors WHERE id = ?', (debtor_id,)).fetchone()[0]
+        if status == 'completed':
+            return
+        time.sleep(0.2)
+    raise AssertionError('Перегенерация не завершилась')
+
+
+def generated(conn, debtor_id):
+    """{имя файла: id строки} сгенерированных документов"""
+    rows = conn.execute(
+        'SELECT filename, id FROM documents WHERE debtor_id = ? AND is_generated = 1', (debtor_id,)
+    ).fetchall()
+    return dict(rows)
+
+
+def document_xml(debtor_id, filename):
+    with zipfile.ZipFile(OUTPUT_DIR / debtor_id / filename) as docx:
+        return docx.read('word/document.xml').decode('utf-8')
+
+
+def edit_and_regenerate(client, conn, debtor_id, changes):
+    """Как в интерфейсе: save-data, затем PUT с теми же данными"""
+    assert client.post(f'/api/debtors/{debtor_id}/save-data', json=changes).status_code == 200
+    conn.execute("UPDATE debtors SET status = 'processing' WHERE id = ?", (debtor_id,))
+    conn.commit()
+    assert client.put(f'/api/debtors/{debtor_id}/data', json=changes).status_code == 200
+    wait_completed(conn, debtor_id)
+
+
+def main():
+    print("=" * 80)
+    print("ПРОВЕРКА ВЫБОРОЧНОЙ ПЕРЕГЕНЕРАЦИИ (save-data -> PUT)")
+    print("=" * 80)
+
+    web.init_db()
+    debtor_id = f'check-{uuid.uuid4()}'
+    data_dir = web.app.config['OUTPUT_FOLDER'] / debtor_id
+    data_dir.mkdir(parents=True)
+    context = {'ФИО': 'Иванов Иван Иванович', 'ФИО_дп': 'Иванову Ивану Ивановичу', 'credits': [], 'taxes': []}
+    with open(data_dir / 'result.json', 'w', encoding='utf-8') as f:
+        json.dump(context, f, ensure_ascii=False)
+
+    conn = sqlite3.connect(web.app.config['DATABASE'], timeout=30.0)
+    conn.execute(
+        "INSERT INTO debtors (id, full_name, lawyer, status, date_added) VALUES (?, ?, 'urist1', 'completed', ?)",
+        (debtor_id, context['ФИО'], time.strftime('%Y-%m-%d %H:%M:%S')),
+    )
+    conn.commit()
+    client = web.app.test_client()
+    try:
+        # Первичная генерация всего комплекта
+        web.regenerate_documents(debtor_id)
+        initial = generated(conn, debtor_id)
+        assert LIST_DOC in initial and DELAY_DOC in initial, initial
+
+        # 1. Правка таблицы кредиторов - перегенерируется только список кредиторов
+        credits = [{'пп_кредит': '1.1', 'Кредитор': 'ООО «Проверка перегенерации»', 'is_first_contract': True}]
+        edit_and_regenerate(client, conn, debtor_id, {'credits': credits})
+        after_credits = generated(conn, debtor_id)
+        changed = {name for name in initial if after_credits.get(name) != initial[name]}
+        assert changed == {LIST_DOC}, changed
+        assert 'Проверка перегенерации' in document_xml(debtor_id, LIST_DOC)
+        print(f"✅ credits: перегенерирован только '{LIST_DOC}'")
+
+        # 2. Правка поля одного ходатайства
+        edit_and_regenerate(client, conn, debtor_id, {'ФИО_дп': 'Петрову Петру Петровичу'})
+        after_name = generated(conn, debtor_id)
+        changed = {name for name in after_credits if after_name.get(name) != after_credits[name]}
+        assert changed == {DELAY_DOC}, changed
+        assert 'Петрову Петру Петровичу' in document_xml(debtor_id, DELAY_DOC)
+        print(f"✅ ФИО_дп: перегенерирован только '{DELAY_DOC}'")
+
+        # 3. Повтор без изменений - ничего не перегенерируется
+        edit_and_regenerate(client, conn, debtor_id, {'ФИО_дп': 'Петрову Петру Петровичу'})
+        assert generated(conn, debtor_id) == after_name
+        print("✅ Без изменений: документы не перегенерированы")
+    finally:
+        conn.execute('DELETE FROM documents WHERE debtor_id = ?', (debtor_id,))
+        conn.execute('DELETE FROM debtors WHERE id = ?', (debtor_id,))
+        conn.commit()
+        conn.close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+        shutil.rmtree(OUTPUT_DIR / debtor_id, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Связывание записей о кредитах из разных источников (ОКБ, БКИ, НБКИ, справки
+о задолженности) в кластеры "один договор - один кластер".
+
+Раньше merge_credit_reports строил строковый ключ "кредитор|дата|сумма" и для
+±1 дня форматировал ещё три ключа. Здесь классическая схема record linkage:
+
+1. Блокировка: записи сравниваются только внутри блоков
+   (нормализованный кредитор / ИНН / ОГРН / номер договора) x месяц договора.
+   Соседние месяцы тоже попадают в блок, если дата в пределах допуска.
+2. Оценка пары: совпадение даты, первоначальной суммы, текущего долга и
+   номера договора дают баллы, явные противоречия (разные ИНН, разные
+   первоначальные суммы, даты дальше допуска) - запрет объединения.
+3. Кластеризация: union-find по парам с баллом >= MATCH_THRESHOLD, от лучших
+   пар к худшим; кластеры не объединяются, если между ними есть запрет.
+
+Каждое объединение сохраняется как MatchDecision с перечнем причин.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# Баллы за совпадения
+WEIGHT_CONTRACT_NUMBER = 5
+WEIGHT_ORIGINAL_AMOUNT = 3
+WEIGHT_DEBT = 3
+WEIGHT_DATE_EXACT = 2
+WEIGHT_DATE_NEAR = 1
+WEIGHT_NO_DATES = 1
+WEIGHT_STATEMENT_DATE = 2
+
+# Минимальный балл для объединения двух записей
+MATCH_THRESHOLD = 4
+
+# Допуск по дате договора (бюро иногда указывают соседние даты)
+DATE_TOLERANCE_DAYS = 1
+
+# Первоначальные суммы меньше этой не считаются заполненными
+MIN_ORIGINAL_AMOUNT = Decimal(100)
+AMOUNT_TOLERANCE = Decimal(1)
+DEBT_TOLERANCE = Decimal("0.01")
+
+
+@dataclass
+class CreditRecord:
+    """Одна запись о кредите из одного источника."""
+
+    source: str
+    creditor_key: str
+    name: str = ""
+    inn: str = ""
+    ogrn: str = ""
+    contract_date: Optional[date] = None
+    contract_number: str = ""
+    original_amount: Decimal = Decimal(0)
+    debt: Decimal = Decimal(0)
+    is_statement: bool = False
+    payload: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class MatchDecision:
+    """Объединение двух записей: индексы, балл и причины."""
+
+    left: int
+    right: int
+    score: int
+    reasons: Tuple[str, ...]
+
+    def explain(self) -> str:
+        return f"{'; '.join(self.reasons)} [балл {self.score}]"
+
+
+@dataclass
+class LinkageResult:
+    """Кластеры (списки индексов записей) и решения, по которым они собраны."""
+
+    clusters: List[List[int]]
+    decisions: List[MatchDecision]
+    comparisons: int
+
+
+def normalize_contract_number(number: Any) -> str:
+    """Номер договора без пробелов, "№" и регистра."""
+    text = str(number or "").upper().replace("№", "")
+    return "".join(ch for ch in text if ch.isalnum() or ch in "-/")
+
+
+def _months(record: CreditRecord) -> set:
+    if record.contract_date is None:
+        return {None}
+    tolerance = timedelta(days=DATE_TOLERANCE_DAYS)
+    return {
+        (day.year, day.month)
+        for day in (record.contract_date - tolerance, record.contract_date, record.contract_date + tolerance)
+    }
+
+
+def blocking_keys(record: CreditRecord) -> Iterator[tuple]:
+    """Ключи блоков, в которые попадает запись."""
+    if record.contract_number:
+        yield ("number", record.contract_number)
+    for month in _months(record):
+        if record.creditor_key:
+            yield ("name", record.creditor_key, month)
+        if record.inn:
+            yield ("inn", record.inn, month)
+        if record.ogrn:
+            yield ("ogrn", record.ogrn, month)
+
+
+def score_pair(a: CreditRecord, b: CreditRecord) -> Tuple[Optional[int], List[str]]:
+    """
+    Оценить пару записей.
+
+    Returns:
+        (балл, причины); балл None - записи точно относятся к разным договорам.
+    """
+    if a.inn and b.inn and a.inn != b.inn:
+        return None, [f"разные ИНН {a.inn} / {b.inn}"]
+    if a.ogrn and b.ogrn and a.ogrn != b.ogrn:
+        return None, [f"разные ОГРН {a.ogrn} / {b.ogrn}"]
+
+    reasons = []
+    if a.inn and a.inn == b.inn:
+        reasons.append(f"ИНН {a.inn}")
+    elif a.ogrn and a.ogrn == b.ogrn:
+        reasons.append(f"ОГРН {a.ogrn}")
+    elif a.creditor_key and a.creditor_key == b.creditor_key:
+        reasons.append(f"кредитор «{a.creditor_key}»")
+    else:
+        # Нет общего признака кредитора - не противоречие, но и не совпадение
+        return 0, ["нет общего признака кредитора"]
+
+    score = 0
+    same_number = bool(a.contract_number) and a.contract_number == b.contract_number
+    if a.contract_number and b.contract_number and not same_number:
+        return None, [f"разные номера договоров {a.contract_number} / {b.contract_number}"]
+    if same_number:
+        score += WEIGHT_CONTRACT_NUMBER
+        reasons.append(f"номер договора {a.contract_number}")
+
+    if a.contract_date and b.contract_date:
+        days = abs((a.contract_date - b.contract_date).days)
+        if days == 0:
+            score += WEIGHT_DATE_EXACT
+            reasons.append(f"дата {a.contract_date:%d.%m.%Y}")
+            if a.is_statement != b.is_statement:
+                score += WEIGHT_STATEMENT_DATE
+                reasons.append("справка кредитора по договору той же даты")
+        elif days <= DATE_TOLERANCE_DAYS:
+            score += WEIGHT_DATE_NEAR
+            reasons.append(f"даты {a.contract_date:%d.%m.%Y} / {b.contract_date:%d.%m.%Y} (±{days} дн.)")
+        elif not same_number:
+            return None, [f"даты договоров различаются на {days} дн."]
+    elif a.contract_date is None and b.contract_date is None:
+        score += WEIGHT_NO_DATES
+        reasons.append("дата не указана в обоих источниках")
+
+    if a.original_amount > MIN_ORIGINAL_AMOUNT and b.original_amount > MIN_ORIGINAL_AMOUNT:
+        if abs(a.original_amount - b.original_amount) <= AMOUNT_TOLERANCE:
+            score += WEIGHT_ORIGINAL_AMOUNT
+            reasons.append(f"первоначальная сумма {a.original_amount:.0f}")
+        elif not same_number:
+            return None, [f"первоначальные суммы {a.original_amount:.0f} / {b.original_amount:.0f}"]
+    elif a.debt > 0 and abs(a.debt - b.debt) < DEBT_TOLERANCE:
+        score += WEIGHT_DEBT
+        reasons.append(f"текущий долг {a.debt:.2f}")
+
+    return score, reasons
+
+
+class _DisjointSet:
+    """Union-find со списками членов (для проверки запретов между кластерами)."""
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+        self.members: List[List[int]] = [[index] for index in range(size)]
+
+    def find(self, item: int) -> int:
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, left: int, right: int) -> int:
+        if len(self.members[left]) < len(self.members[right]):
+            left, right = right, left
+        self.parent[right] = left
+        self.members[left].extend(self.members[right])
+        self.members[right] = []
+        return left
+
+
+def _conflicts(records: Sequence[CreditRecord], a: int, b: int, compared: set, vetoed: set) -> bool:
+    pair = (a, b) if a < b else (b, a)
+    if pair in compared:
+        return pair in vetoed
+    # Пара не попала в общий блок - проверяем только противоречия
+    return score_pair(records[a], records[b])[0] is None
+
+
+def link_credits(records: Sequence[CreditRecord], threshold: int = MATCH_THRESHOLD) -> LinkageResult:
+    """Сгруппировать записи о кредитах по договорам."""
+    blocks: Dict[tuple, List[int]] = defaultdict(list)
+    for index, record in enumerate(records):
+        for key in blocking_keys(record):
+            blocks[key].append(index)
+
+    compared = set()
+    vetoed = set()
+    candidates = []
+    for members in blocks.values():
+        for position, left in enumerate(members):
+            for right in members[position + 1:]:
+                pair = (left, right) if left < right else (right, left)
+                if pair in compared:
+                    continue
+                compared.add(pair)
+                score, reasons = score_pair(records[pair[0]], records[pair[1]])
+                if score is None:
+                    vetoed.add(pair)
+                elif score >= threshold:
+                    candidates.append((score, pair, reasons))
+
+    # Сначала самые надёжные пары; при равенстве - в порядке появления записей
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+    groups = _DisjointSet(len(records))
+    decisions = []
+    for score, (left, right), reasons in candidates:
+        left_root, right_root = groups.find(left), groups.find(right)
+        if left_root == right_root:
+            continue
+        if any(
+            _conflicts(records, a, b, compared, vetoed)
+            for a in groups.members[left_root]
+            for b in groups.members[right_root]
+        ):
+            continue
+        groups.union(left_root, right_root)
+        decisions.append(MatchDecision(left, right, score, tuple(reasons)))
+
+    clusters = sorted(
+        (sorted(members) for members in groups.members if members),
+        key=lambda members: members[0],
+    )
+    return LinkageResult(clusters=clusters, decisions=decisions, comparisons=len(compared))
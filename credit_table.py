@@ -0,0 +1,137 @@
+"""
+Колоночная таблица долгов должника (суммы - целые копейки).
+
+Строится один раз из результата merge_credit_reports, постановлений приставов
+и налоговых уведомлений. Из неё за один проход получаются строки таблицы
+"Список кредиторов", группировка по кредиторам и итоговая сумма долга -
+без форматирования сумм в строки и обратного разбора.
+
+Разделы:
+- SECTION_CREDIT: кредиты из отчётов БКИ и справок (раздел 1, группы по кредитору);
+- SECTION_OTHER: иные долги из постановлений ФССП (раздел 1, после кредитов);
+- SECTION_TAX: налоги и обязательные платежи (раздел 2).
+"""
+
+from array import array
+from dataclasses import dataclass, field
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+SECTION_CREDIT = "credit"
+SECTION_OTHER = "other"
+SECTION_TAX = "tax"
+
+
+def to_kopecks(value: Optional[Decimal]) -> int:
+    """Decimal (рубли) -> целые копейки."""
+    if not value:
+        return 0
+    return int((Decimal(value) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_kopecks(kopecks: int) -> Decimal:
+    """Целые копейки -> Decimal (рубли, 2 знака)."""
+    return Decimal(kopecks).scaleb(-2)
+
+
+def format_kopecks(kopecks: int) -> str:
+    """Копейки -> "1234.56" (формат сумм в таблице кредиторов)."""
+    sign = "-" if kopecks < 0 else ""
+    rubles, rest = divmod(abs(kopecks), 100)
+    return f"{sign}{rubles}.{rest:02d}"
+
+
+@dataclass
+class CreditTable:
+    """Долги по строкам, хранение по колонкам."""
+
+    section: List[str] = field(default_factory=list)
+    creditor: List[str] = field(default_factory=list)
+    group_key: List[str] = field(default_factory=list)
+    inn: List[str] = field(default_factory=list)
+    ogrn: List[str] = field(default_factory=list)
+    address: List[str] = field(default_factory=list)
+    kind: List[str] = field(default_factory=list)
+    contract: List[str] = field(default_factory=list)
+    source: List[str] = field(default_factory=list)
+    aliases: List[Tuple[str, ...]] = field(default_factory=list)
+    original_kop: array = field(default_factory=lambda: array("q"))
+    debt_kop: array = field(default_factory=lambda: array("q"))
+    penalties_kop: array = field(default_factory=lambda: array("q"))
+
+    def __len__(self) -> int:
+        return len(self.section)
+
+    def append(
+        self,
+        section: str,
+        creditor: str,
+        debt_kop: int,
+        group_key: str = "",
+        inn: str = "",
+        ogrn: str = "",
+        address: str = "",
+        kind: str = "",
+        contract: str = "",
+        source: str = "",
+        original_kop: int = 0,
+        penalties_kop: int = 0,
+        aliases: Iterable[str] = (),
+    ) -> int:
+        """Добавить строку, вернуть её номер."""
+        self.section.append(section)
+        self.creditor.append(creditor)
+        self.group_key.append(group_key or creditor)
+        self.inn.append(inn)
+        self.ogrn.append(ogrn)
+        self.address.append(address)
+        self.kind.append(kind)
+        self.contract.append(contract)
+        self.source.append(source)
+        self.aliases.append(tuple(aliases))
+        self.original_kop.append(original_kop)
+        self.debt_kop.append(debt_kop)
+        self.penalties_kop.append(penalties_kop)
+        return len(self.section) - 1
+
+    def rows(self, section: str) -> Iterator[int]:
+        """Номера строк раздела в порядке добавления."""
+        return (index for index, value in enumerate(self.section) if value == section)
+
+    def total_kop(self, section: Optional[str] = None) -> int:
+        """Долг + штрафы по разделу (или по всей таблице), в копейках."""
+        if section is None:
+            return sum(self.debt_kop) + sum(self.penalties_kop)
+        return sum(self.debt_kop[index] + self.penalties_kop[index] for index in self.rows(section))
+
+    def groups(self, section: str = SECTION_CREDIT) -> List[List[int]]:
+        """
+        Строки раздела, сгруппированные по group_key.
+
+        Группы - по убыванию суммарного долга, при равенстве - в порядке
+        первого появления; строки внутри группы - в порядке добавления.
+        """
+        groups: Dict[str, List[int]] = {}
+        totals: Dict[str, int] = {}
+        for index in self.rows(section):
+            key = self.group_key[index]
+            groups.setdefault(key, []).append(index)
+            totals[key] = totals.get(key, 0) + self.debt_kop[index]
+        return [groups[key] for key in sorted(groups, key=lambda key: -totals[key])]
+
+    def record(self, index: int) -> Dict[str, Any]:
+        """Строка таблицы как словарь (суммы - Decimal)."""
+        return {
+            "Раздел": self.section[index],
+            "Кредитор": self.creditor[index],
+            "ИНН_кредитора": self.inn[index] or None,
+            "ОГРН_кредитора": self.ogrn[index] or None,
+            "Адрес_кредитора": self.address[index],
+            "Вид": self.kind[index],
+            "Дата_договора": self.contract[index] or None,
+            "Источник": self.source[index],
+            "Сумма_обязательства": from_kopecks(self.original_kop[index]),
+            "Сумма_задолженности": from_kopecks(self.debt_kop[index]),
+            "Штрафы": from_kopecks(self.penalties_kop[index]),
+        }
@@ -0,0 +1,198 @@
+"""
+Словарь названий кредиторов, накопленный по всем должникам.
+
+Одни и те же строки из отчётов ("МТС-БАНК ПАО", "ООО «Да-кредит МКК»")
+раньше для каждого должника заново нормализовались и искались в реестрах.
+Таблица creditor_aliases хранит итог: исходная строка -> каноническое
+название, ИНН, ОГРН, адрес.
+
+- Заполняется автоматически после формирования таблицы кредиторов
+  (source = 'auto'): только каноническое название и ИНН/ОГРН из отчёта.
+  Такие записи служат лишь для сопоставления названий - адрес и ИНН
+  по-прежнему берутся из реестров. Автоматические записи не перезаписывают ручные.
+- Исправляется через /api/creditor-aliases (source = 'manual'): только
+  ручные записи подменяют адрес и ИНН из реестров.
+- Читается из словаря в памяти за O(1); изменения из других процессов
+  подхватываются не чаще раза в ALIAS_CHECK_SECONDS.
+"""
+
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+
+# Как часто проверять, не изменилась ли таблица в другом процессе
+ALIAS_CHECK_SECONDS = 5.0
+
+SOURCE_AUTO = "auto"
+SOURCE_MANUAL = "manual"
+
+_QUOTES = str.maketrans({ch: '"' for ch in "«»“”„'`"})
+
+
+def ensure_schema(cursor: sqlite3.Cursor) -> None:
+    """Создает таблицу словаря кредиторов (вызывается из init_db)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS creditor_aliases (
+            alias_key TEXT PRIMARY KEY,
+            alias TEXT NOT NULL,
+            normalized TEXT NOT NULL DEFAULT '',
+            canonical TEXT NOT NULL,
+            inn TEXT NOT NULL DEFAULT '',
+            ogrn TEXT NOT NULL DEFAULT '',
+            address TEXT NOT NULL DEFAULT '',
+            source TEXT NOT NULL DEFAULT 'auto',
+            updated_at TEXT NOT NULL
+        )
+    ''')
+
+
+def alias_key(name: str) -> str:
+    """Ключ строки кредитора: регистр, кавычки и пробелы не различаются."""
+    return " ".join(str(name or "").translate(_QUOTES).split()).casefold()
+
+
+@dataclass(frozen=True)
+class CreditorAlias:
+    alias: str
+    canonical: str
+    normalized: str = ""
+    inn: str = ""
+    ogrn: str = ""
+    address: str = ""
+    source: str = SOURCE_AUTO
+    updated_at: str = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class CreditorAliasStore:
+    """Таблица creditor_aliases + словарь в памяти для поиска за O(1)."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.aliases: Dict[str, CreditorAlias] = {}
+        self.version = 0
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30.0)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Перечитать таблицу, если она изменилась. True - словарь обновлён."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < ALIAS_CHECK_SECONDS:
+            return False
+        with self._lock:
+            self._checked_at = now
+            try:
+                conn = self._connect()
+                try:
+                    signature = conn.execute(
+                        'SELECT COUNT(*), MAX(updated_at) FROM creditor_aliases'
+                    ).fetchone()
+                    if signature == self._signature and not force:
+                        return False
+                    rows = conn.execute(
+                        'SELECT alias_key, alias, canonical, normalized, inn, ogrn, address, source, updated_at '
+                        'FROM creditor_aliases'
+                    ).fetchall()
+                finally:
+                    conn.close()
+            except sqlite3.OperationalError as e:
+                # Таблицы ещё нет (init_db не вызывался) - работаем без словаря
+                print(f"[ALIASES] Словарь кредиторов недоступен: {e}")
+                return False
+            self.aliases = {row[0]: CreditorAlias(*row[1:]) for row in rows}
+            self._signature = signature
+            self.version += 1
+            return True
+
+    def lookup(self, name: str) -> Optional[CreditorAlias]:
+        return self.aliases.get(alias_key(name))
+
+    def learn_many(self, entries: Iterable[CreditorAlias]) -> int:
+        """
+        Сохранить автоматически найденные соответствия одной транзакцией.
+
+        Ручные записи не перезаписываются; неизменившиеся не трогаются.
+        """
+        now = datetime.now().isoformat()
+        rows = []
+        for entry in entries:
+            key = alias_key(entry.alias)
+            if not key or not entry.canonical:
+                continue
+            current = self.aliases.get(key)
+            if current and (
+                current.source == SOURCE_MANUAL
+                or (current.canonical, current.normalized, current.inn, current.ogrn, current.address)
+                == (entry.canonical, entry.normalized, entry.inn, entry.ogrn, entry.address)
+            ):
+                continue
+            rows.append((key, entry.alias, entry.normalized, entry.canonical, entry.inn, entry.ogrn, entry.address, now))
+        if not rows:
+            return 0
+
+        conn = self._connect()
+        try:
+            conn.executemany('''
+                INSERT INTO creditor_aliases (alias_key, alias, normalized, canonical, inn, ogrn, address, source, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'auto', ?)
+                ON CONFLICT(alias_key) DO UPDATE SET
+                    alias = excluded.alias, normalized = excluded.normalized, canonical = excluded.canonical,
+                    inn = excluded.inn, ogrn = excluded.ogrn, address = excluded.address,
+                    updated_at = excluded.updated_at
+                WHERE creditor_aliases.source != 'manual'
+            ''', rows)
+            conn.commit()
+        finally:
+            conn.close()
+        self.refresh(force=True)
+        return len(rows)
+
+    def save_manual(self, alias: str, canonical: str, normalized: str = "", inn: str = "",
+                    ogrn: str = "", address: str = "") -> CreditorAlias:
+        """Добавить или исправить запись вручную (имеет приоритет над автоматическими)."""
+        key = alias_key(alias)
+        if not key or not canonical:
+            raise ValueError("alias и canonical обязательны")
+        conn = self._connect()
+        try:
+            conn.execute('''
+                INSERT OR REPLACE INTO creditor_aliases
+                    (alias_key, alias, normalized, canonical, inn, ogrn, address, source, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'manual', ?)
+            ''', (key, alias, normalized or "", canonical, inn or "", ogrn or "", address or "", datetime.now().isoformat()))
+            conn.commit()
+        finally:
+            conn.close()
+        self.refresh(force=True)
+        return self.aliases[key]
+
+    def delete(self, alias: str) -> bool:
+        conn = self._connect()
+        try:
+            deleted = conn.execute('DELETE FROM creditor_aliases WHERE alias_key = ?', (alias_key(alias),)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        self.refresh(force=True)
+        return bool(deleted)
+
+    def search(self, query: str = "", limit: int = 100) -> List[CreditorAlias]:
+        """Записи словаря для админки (подстрока в исходном или каноническом названии)."""
+        self.refresh()
+        needle = alias_key(query)
+        matches = [
+            entry for key, entry in self.aliases.items()
+            if not needle or needle in key or needle in alias_key(entry.canonical)
+        ]
+        matches.sort(key=lambda entry: entry.updated_at, reverse=True)
+        return matches[:limit]
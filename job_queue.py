@@ -0,0 +1,473 @@
+"""
+Служебные структуры очереди обработки должников.
+
+Чекпоинты документов: каждый обработанный PDF сохраняется в таблицу
+document_checkpoints сразу после завершения (ключ: задание + SHA-256 файла),
+а результаты отдельных батчей больших кредитных отчётов — в batch_checkpoints.
+Если worker упал посреди задания, после reset_orphaned_jobs задание
+продолжается с первого необработанного документа (или батча).
+
+Порядок очереди (order_queued_jobs): срочные задания идут первыми, остальные
+распределяются между юристами по кругу (round-robin), а внутри очереди
+юриста сначала берутся самые короткие задания по числу страниц.
+
+Прогноз времени (EtaPredictor): по истории замеров stage_timings считается
+скорость обработки (сек/стр.) для каждого типа документа и средняя длительность
+генерации; по ним оцениваются время старта и окончания заданий в очереди.
+
+События (publish_event): смены статусов заданий и прогресс обработки пишутся
+в таблицу job_events, откуда их читает SSE-поток /api/events. Таблица общая
+для всех процессов gunicorn; внутри процесса поток будится сразу через Condition.
+"""
+
+import hashlib
+import heapq
+import json
+import sqlite3
+import threading
+from collections import deque
+from dataclasses import asdict, is_dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+
+# Приоритет задания: 0 - обычное, 1 - срочное
+PRIORITY_NORMAL = 0
+PRIORITY_URGENT = 1
+
+# Задание, ожидающее дольше этого времени, обгоняет более короткие задания
+# того же юриста (защита от бесконечного ожидания больших отчётов)
+STARVATION_SECONDS = 2 * 60 * 60
+
+
+def ensure_schema(cursor: sqlite3.Cursor) -> None:
+    """Создает таблицы очереди (вызывается из init_db)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_checkpoints (
+            job_id INTEGER NOT NULL,
+            file_hash TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (job_id, file_hash),
+            FOREIGN KEY (job_id) REFERENCES processing_jobs (id) ON DELETE CASCADE
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS batch_checkpoints (
+            job_id INTEGER NOT NULL,
+            file_hash TEXT NOT NULL,
+            batch_key TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (job_id, file_hash, batch_key),
+            FOREIGN KEY (job_id) REFERENCES processing_jobs (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # История замеров не привязана к заданиям: она нужна и после удаления должника
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stage_timings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER,
+            stage TEXT NOT NULL,
+            doc_type TEXT,
+            pages INTEGER NOT NULL DEFAULT 0,
+            seconds REAL NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_stage_timings_stage ON stage_timings (stage, doc_type)')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event TEXT NOT NULL,
+            debtor_id TEXT,
+            payload TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+
+
+def file_sha256(path: Path) -> str:
+    """SHA-256 содержимого файла (читается блоками, без загрузки в память целиком)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BatchCheckpoint:
+    """Чекпоинты батчей одного документа (для кредитных отчётов, обрабатываемых частями)."""
+
+    def __init__(self, store: 'JobCheckpointStore', file_hash: str):
+        self.store = store
+        self.file_hash = file_hash
+
+    def load_batch(self, batch_key: str) -> Optional[List[Dict[str, Any]]]:
+        """Вернуть сохранённые кредиты батча или None, если батч ещё не обработан."""
+        conn = self.store._connect()
+        try:
+            row = conn.execute(
+                'SELECT payload FROM batch_checkpoints WHERE job_id = ? AND file_hash = ? AND batch_key = ?',
+                (self.store.job_id, self.file_hash, batch_key)
+            ).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+    def save_batch(self, batch_key: str, credits: List[Dict[str, Any]]) -> None:
+        conn = self.store._connect()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO batch_checkpoints (job_id, file_hash, batch_key, payload, created_at) VALUES (?, ?, ?, ?, ?)',
+                (self.store.job_id, self.file_hash, batch_key,
+                 json.dumps(credits, ensure_ascii=False), datetime.now().isoformat())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class JobCheckpointStore:
+    """Чекпоинты одного задания очереди.
+
+    Используется DocumentProcessor.process_batch: перед обработкой документа
+    проверяется load_document, после успешной обработки вызывается save_document.
+    """
+
+    def __init__(self, db_path: str, job_id: int):
+        self.db_path = db_path
+        self.job_id = job_id
+        self._hashes: Dict[str, str] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30.0)
+        conn.execute('PRAGMA foreign_keys = ON')
+        return conn
+
+    def file_hash(self, pdf_path: Path) -> str:
+        key = str(pdf_path)
+        if key not in self._hashes:
+            self._hashes[key] = file_sha256(pdf_path)
+        return self._hashes[key]
+
+    def load_document(self, pdf_path: Path) -> Optional[Dict[str, Any]]:
+        """Вернуть сохранённый DocumentOutput (в виде словаря) или None."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT result FROM document_checkpoints WHERE job_id = ? AND file_hash = ?',
+                (self.job_id, self.file_hash(pdf_path))
+            ).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+    def save_document(self, pdf_path: Path, result: Any) -> None:
+        """Сохранить результат обработки документа сразу после его завершения."""
+        payload = asdict(result) if is_dataclass(result) else dict(result)
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO document_checkpoints (job_id, file_hash, filename, result, created_at) VALUES (?, ?, ?, ?, ?)',
+                (self.job_id, self.file_hash(pdf_path), Path(pdf_path).name,
+                 json.dumps(payload, ensure_ascii=False, default=str), datetime.now().isoformat())
+            )
+            # Батчи документа больше не нужны - документ сохранён целиком
+            conn.execute(
+                'DELETE FROM batch_checkpoints WHERE job_id = ? AND file_hash = ?',
+                (self.job_id, self.file_hash(pdf_path))
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def for_document(self, pdf_path: Path) -> BatchCheckpoint:
+        return BatchCheckpoint(self, self.file_hash(pdf_path))
+
+    def completed_count(self) -> int:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT COUNT(*) FROM document_checkpoints WHERE job_id = ?', (self.job_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else 0
+
+    def clear(self) -> None:
+        """Удалить чекпоинты задания (задание завершено - успешно или с ошибкой)."""
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM batch_checkpoints WHERE job_id = ?', (self.job_id,))
+            conn.execute('DELETE FROM document_checkpoints WHERE job_id = ?', (self.job_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def prune_checkpoints(cursor: sqlite3.Cursor) -> int:
+    """Удалить чекпоинты заданий, которые уже не в очереди и не выполняются.
+
+    Продолжить с чекпоинта можно только задание, возвращённое в очередь
+    после падения процесса; чекпоинты остальных заданий никто не прочитает.
+    """
+    removed = 0
+    for table in ('batch_checkpoints', 'document_checkpoints'):
+        cursor.execute(f'''
+            DELETE FROM {table} WHERE job_id NOT IN (
+                SELECT id FROM processing_jobs WHERE status IN ('queued', 'processing')
+            )
+        ''')
+        removed += cursor.rowcount
+    return removed
+
+
+def pdf_page_count(pdf_path: Path) -> int:
+    """Число страниц PDF (0, если файл не удалось открыть)."""
+    import pypdfium2 as pdfium
+
+    try:
+        pdf = pdfium.PdfDocument(str(pdf_path))
+        pages = len(pdf)
+        pdf.close()
+        return pages
+    except Exception as e:
+        print(f"[QUEUE] Не удалось посчитать страницы {Path(pdf_path).name}: {e}")
+        return 0
+
+
+def _waited_seconds(job: Dict[str, Any], now: datetime) -> float:
+    try:
+        return (now - datetime.fromisoformat(job['created_at'])).total_seconds()
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+def order_queued_jobs(
+    jobs: List[Dict[str, Any]],
+    lawyer_last_started: Optional[Dict[str, str]] = None,
+    now: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """Вернуть задания в порядке, в котором их возьмёт worker.
+
+    jobs - словари с полями id, lawyer, priority, total_pages, created_at.
+    lawyer_last_started - время последнего запуска задания каждого юриста
+    (ISO-строка); юрист, дольше всех не получавший обработку, идёт первым.
+    """
+    now = now or datetime.now()
+
+    urgent = sorted(
+        (j for j in jobs if (j.get('priority') or 0) >= PRIORITY_URGENT),
+        key=lambda j: (j.get('created_at') or '', j['id'])
+    )
+
+    per_lawyer: Dict[str, List[Dict[str, Any]]] = {}
+    for job in jobs:
+        if (job.get('priority') or 0) >= PRIORITY_URGENT:
+            continue
+        per_lawyer.setdefault(job.get('lawyer') or 'urist1', []).append(job)
+
+    def job_key(job: Dict[str, Any]) -> tuple:
+        starving = _waited_seconds(job, now) >= STARVATION_SECONDS
+        # Долго ждущие - по времени постановки, остальные - кратчайшие первыми
+        if starving:
+            return (0, 0, job.get('created_at') or '', job['id'])
+        return (1, job.get('total_pages') or 0, job.get('created_at') or '', job['id'])
+
+    for lawyer_jobs in per_lawyer.values():
+        lawyer_jobs.sort(key=job_key)
+
+    last_started = lawyer_last_started or {}
+    turn = deque(sorted(
+        per_lawyer,
+        key=lambda lawyer: (
+            last_started.get(lawyer) or '',
+            min(j.get('created_at') or '' for j in per_lawyer[lawyer])
+        )
+    ))
+
+    ordered = list(urgent)
+    while turn:
+        lawyer = turn.popleft()
+        lawyer_jobs = per_lawyer[lawyer]
+        ordered.append(lawyer_jobs.pop(0))
+        if lawyer_jobs:
+            turn.append(lawyer)
+    return ordered
+
+
+def record_stage_timings(db_path: str, job_id: Optional[int], timings: List[Dict[str, Any]]) -> None:
+    """Сохранить замеры этапов обработки (DocumentProcessor.stage_timings)."""
+    if not timings:
+        return
+    now = datetime.now().isoformat()
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    try:
+        conn.executemany(
+            'INSERT INTO stage_timings (job_id, stage, doc_type, pages, seconds, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            [(job_id, t['stage'], t.get('doc_type'), t.get('pages') or 0, t['seconds'], now) for t in timings]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class EtaPredictor:
+    """Прогноз длительности заданий по истории замеров stage_timings."""
+
+    # Значения по умолчанию, пока истории нет
+    DEFAULT_SECONDS_PER_PAGE = 6.0
+    DEFAULT_RENDER_SECONDS = 15.0
+    # Сколько последних замеров каждого вида учитывать
+    HISTORY_SIZE = 200
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None,
+                 default_rate: Optional[float] = None,
+                 render_seconds: Optional[float] = None):
+        self.rates = rates or {}
+        self.default_rate = default_rate or self.DEFAULT_SECONDS_PER_PAGE
+        self.render_seconds = render_seconds or self.DEFAULT_RENDER_SECONDS
+
+    @classmethod
+    def from_db(cls, cursor: sqlite3.Cursor) -> 'EtaPredictor':
+        """Обучить прогноз на последних замерах."""
+        def rate_rows(stage: str) -> List[tuple]:
+            cursor.execute('''
+                SELECT doc_type, SUM(pages), SUM(seconds) FROM (
+                    SELECT doc_type, pages, seconds FROM stage_timings
+                    WHERE stage = ? AND pages > 0
+                    ORDER BY id DESC LIMIT ?
+                ) GROUP BY doc_type
+            ''', (stage, cls.HISTORY_SIZE))
+            return [tuple(row) for row in cursor.fetchall()]
+
+        rates: Dict[str, float] = {}
+        # Скорость GPT по батчам - запасной вариант для типов без полной истории документов
+        for doc_type, pages, seconds in rate_rows('llm_batch'):
+            if doc_type and pages:
+                rates[doc_type] = seconds / pages
+        total_pages = 0
+        total_seconds = 0.0
+        for doc_type, pages, seconds in rate_rows('document'):
+            if doc_type and pages:
+                rates[doc_type] = seconds / pages
+                total_pages += pages
+                total_seconds += seconds
+
+        cursor.execute('''
+            SELECT AVG(seconds) FROM (
+                SELECT seconds FROM stage_timings WHERE stage = 'render' ORDER BY id DESC LIMIT ?
+            )
+        ''', (cls.HISTORY_SIZE,))
+        row = cursor.fetchone()
+        render_seconds = row[0] if row and row[0] else None
+
+        default_rate = total_seconds / total_pages if total_pages else None
+        return cls(rates, default_rate, render_seconds)
+
+    def estimate_document(self, doc_type: Optional[str], pages: int) -> float:
+        rate = self.rates.get(doc_type or '', self.default_rate)
+        return max(pages, 1) * rate
+
+    def estimate_job(self, documents: Iterable[tuple]) -> float:
+        """Оценка длительности задания; documents - пары (тип документа, число страниц)."""
+        return sum(self.estimate_document(doc_type, pages) for doc_type, pages in documents) + self.render_seconds
+
+    def schedule(
+        self,
+        running: List[Dict[str, Any]],
+        queued: List[Dict[str, Any]],
+        concurrency: int = 1,
+        now: Optional[datetime] = None,
+    ) -> None:
+        """Проставить eta_start/eta_finish/remaining_seconds заданиям (на месте).
+
+        running - выполняющиеся задания (estimate_seconds, started_at),
+        queued - задания в эффективном порядке очереди (estimate_seconds).
+        concurrency - сколько заданий обрабатывается параллельно.
+        """
+        now = now or datetime.now()
+        free_at: List[float] = []
+
+        for job in running:
+            elapsed = 0.0
+            try:
+                elapsed = (now - datetime.fromisoformat(job['started_at'])).total_seconds()
+            except (KeyError, TypeError, ValueError):
+                pass
+            remaining = max(job['estimate_seconds'] - elapsed, 0.0)
+            job['remaining_seconds'] = round(remaining)
+            job['eta_finish'] = (now + timedelta(seconds=remaining)).isoformat(timespec='seconds')
+            free_at.append(remaining)
+
+        slots = max(concurrency, len(running), 1)
+        free_at.extend([0.0] * (slots - len(free_at)))
+        heapq.heapify(free_at)
+
+        for job in queued:
+            start = heapq.heappop(free_at)
+            finish = start + job['estimate_seconds']
+            job['eta_start'] = (now + timedelta(seconds=start)).isoformat(timespec='seconds')
+            job['eta_finish'] = (now + timedelta(seconds=finish)).isoformat(timespec='seconds')
+            job['remaining_seconds'] = round(finish)
+            heapq.heappush(free_at, finish)
+
+
+# === События для SSE ===
+# Сколько последних событий хранить (старые удаляются при записи новых)
+EVENTS_KEEP = 5000
+
+_event_condition = threading.Condition()
+
+
+def publish_event(db_path: str, event: str, data: Dict[str, Any]) -> Optional[int]:
+    """Записать событие в job_events и разбудить SSE-потоки текущего процесса."""
+    try:
+        conn = sqlite3.connect(db_path, timeout=30.0)
+        try:
+            cursor = conn.execute(
+                'INSERT INTO job_events (event, debtor_id, payload, created_at) VALUES (?, ?, ?, ?)',
+                (event, data.get('debtor_id'), json.dumps(data, ensure_ascii=False, default=str),
+                 datetime.now().isoformat())
+            )
+            event_id = cursor.lastrowid
+            if event_id % 500 == 0:
+                conn.execute('DELETE FROM job_events WHERE id <= ?', (event_id - EVENTS_KEEP,))
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        # События - вспомогательный канал, обработка не должна из-за них падать
+        print(f"[EVENTS] Не удалось записать событие {event}: {e}")
+        return None
+
+    with _event_condition:
+        _event_condition.notify_all()
+    return event_id
+
+
+def wait_for_events(timeout: float) -> None:
+    """Подождать новое событие этого процесса (события других процессов видны по таймауту)."""
+    with _event_condition:
+        _event_condition.wait(timeout)
+
+
+def latest_event_id(conn: sqlite3.Connection) -> int:
+    row = conn.execute('SELECT MAX(id) FROM job_events').fetchone()
+    return (row[0] or 0) if row else 0
+
+
+def fetch_events(conn: sqlite3.Connection, after_id: int, limit: int = 200) -> List[tuple]:
+    """События с id > after_id: список (id, event, payload)."""
+    return [
+        tuple(row) for row in conn.execute(
+            'SELECT id, event, payload FROM job_events WHERE id > ? ORDER BY id LIMIT ?',
+            (after_id, limit)
+        ).fetchall()
+    ]
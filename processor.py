@@ -4,16 +4,22 @@ from __future__ import annotations
 
 import base64
 import json
+import multiprocessing
 import os
 import re
+import sqlite3
 import tempfile
+import threading
 import time
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
 from datetime import date, datetime
 from decimal import Decimal, InvalidOperation
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
 
 from openai import OpenAI
 import pypdfium2 as pdfium
@@ -21,6 +27,20 @@ from PIL import Image
 from dotenv import load_dotenv
 from docxtpl import DocxTemplate, RichText  # Для динамических таблиц
 
+from credit_linkage import CreditRecord, link_credits, normalize_contract_number
+from creditor_aliases import SOURCE_MANUAL, CreditorAlias, CreditorAliasStore
+from credit_table import SECTION_CREDIT, SECTION_OTHER, SECTION_TAX, CreditTable, format_kopecks, from_kopecks, to_kopecks
+from registry_index import (
+    IdentifierIndex,
+    get_identifier_index,
+    get_registry_index,
+    get_trigram_index,
+    normalize_org_name,
+    split_identifiers,
+)
+from registry_store import RegistrySnapshot, RegistrySnapshots, build_registry_store, open_registry_store
+from template_cache import PLACEHOLDER_RE, placeholder_key, render_template
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -29,6 +49,202 @@ GPT_MODEL = "gpt-5-mini"  # Using GPT-5-mini with vision capabilities
 TEMPLATE_DOCX = Path("templ") / "Заявление на банкротство.docx"
 FILLED_TEMPLATE_SUFFIX = " (заполненное)"
 OUTPUT_DIR = Path("resultdoc")  # Папка для всех готовых документов
+# Процессов для параллельного рендера комплекта документов (1 - последовательно)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", min(5, os.cpu_count() or 1)))
+
+# === Нормализация названий кредиторов ===
+NAME_CACHE_SIZE = 4096  # Кэш нормализованных названий (ключ - исходная строка)
+
+# Словарь канонических названий известных банков/МФО
+CANONICAL_NAMES = {
+    "СБЕРБАНК": "ПАО «Сбербанк»",
+    "СБЕР": "ПАО «Сбербанк»",
+    "СБЕР РОССИИ": "ПАО «Сбербанк»",
+    "РОССИИ": "ПАО «Сбербанк»",  # Для "Сбербанк России" после удаления "БАНК"
+    "ВТБ": "ПАО «ВТБ»",
+    "АЛЬФА БАНК": "АО «Альфа-Банк»",
+    "АЛЬФА": "АО «Альфа-Банк»",
+    "ТИНЬКОФФ": "АО «Тинькофф Банк»",
+    "ТИНЬКОФФ БАНК": "АО «Тинькофф Банк»",
+    "ТИНКОВ": "АО «Тинькофф Банк»",
+    "РОССЕЛЬХОЗБАНК": "АО «Россельхозбанк»",
+    "РОССЕЛЬХОЗ": "АО «Россельхозбанк»",
+    "ГАЗПРОМБАНК": "АО «ГПБ»",
+    "ГАЗПРОМ": "АО «ГПБ»",
+    "МТС БАНК": "ПАО «МТС-Банк»",
+    "МТС": "ПАО «МТС-Банк»",
+    "РАЙФФАЙЗЕНБАНК": "АО «Райффайзенбанк»",
+    "РАЙФФАЙЗЕН": "АО «Райффайзенбанк»",
+    "РОСБАНК": "ПАО «РОСБАНК»",
+    "РОС": "ПАО «РОСБАНК»",
+    "ХОУМ КРЕДИТ": "АО «Т-Банк»",  # Хоум Кредит продан Тинькофф и переименован в Т-Банк
+    "ХОУМ КРЕДИТ ЭНД ФИНАНС": "АО «Т-Банк»",
+    "HOME CREDIT": "АО «Т-Банк»",
+    "Т БАНК": "АО «Т-Банк»",
+    "T BANK": "АО «Т-Банк»",
+    "TBANK": "АО «Т-Банк»",
+    "РУСФИНАНС БАНК": "ООО КБ «Русфинанс Банк»",
+    "РУСФИНАНС": "ООО КБ «Русфинанс Банк»",
+    "СОВКОМБАНК": "ПАО «Совкомбанк»",
+    "СОВКОМ": "ПАО «Совкомбанк»",
+    "ОТКРЫТИЕ": "ПАО Банк «ФК Открытие»",
+    "ПОЧТА БАНК": "ПАО «Почта Банк»",
+    "ПОЧТА": "ПАО «Почта Банк»",
+    "УРАЛСИБ": "ПАО «БАНК УРАЛСИБ»",
+    "УРАЛ СИБ": "ПАО «БАНК УРАЛСИБ»",
+    "ПРОМСВЯЗЬБАНК": "ПАО «Промсвязьбанк»",
+    "ПРОМСВЯЗЬ": "ПАО «Промсвязьбанк»",
+    "ОТП БАНК": "АО «ОТП Банк»",
+    "ОТП": "АО «ОТП Банк»",
+    "РЕНЕССАНС КРЕДИТ": "ООО КБ «Ренессанс Кредит»",
+    "РЕНЕССАНС": "ООО КБ «Ренессанс Кредит»",
+    "РУССКИЙ СТАНДАРТ": "АО «Банк Русский Стандарт»",
+
+    # МФО/МФК/МКК
+    "ЗАЙМЕР": "ООО МФК «Займер»",
+    "ЗАЙМ ЭР": "ООО МФК «Займер»",
+    "ВЭББАНКИР": "ООО МКК «ВэбБанкир»",
+    "ВЕББАНКИР": "ООО МКК «ВэбБанкир»",
+    "ВЭЗББАНКИР": "ООО МКК «ВэбБанкир»",
+    "ВЭЗБАНКИР": "ООО МКК «ВэбБанкир»",
+    "ВЭБ ИР": "ООО МКК «ВэбБанкир»",
+    "ВЭЗБ ИР": "ООО МКК «ВэбБанкир»",
+    "WEBBANKIR": "ООО МКК «ВэбБанкир»",
+    "ТУРБОЗАЙМ": "ООО МКК «ТурбоЗайм»",
+    "ТУРБО ЗАЙМ": "ООО МКК «ТурбоЗайм»",
+    "ТУРБО": "ООО МКК «ТурбоЗайм»",
+    "TURBOZAIM": "ООО МКК «ТурбоЗайм»",
+    "МОНЕЙМЕН": "ООО МФК «МаниМен»",
+    "МАНИ МЕН": "ООО МФК «МаниМен»",
+    "MONEYMAN": "ООО МФК «МаниМен»",
+    "MONEY MAN": "ООО МФК «МаниМен»",
+    "МИГКРЕДИТ": "ООО МФК «МигКредит»",
+    "МИГ КРЕДИТ": "ООО МФК «МигКредит»",
+    "МИГ": "ООО МФК «МигКредит»",
+    "MIGCREDIT": "ООО МФК «МигКредит»",
+    "MIGKREDIT": "ООО МФК «МигКредит»",
+    "ДЕНЬГИ СРАЗУ": "ООО МКК «Деньги сразу»",
+    "DENGISRAZY": "ООО МКК «Деньги сразу»",
+    "DENGI SRAZY": "ООО МКК «Деньги сразу»",
+    "ЕKAPУСТА": "ООО МКК «Екапуста»",
+    "Е КАПУСТА": "ООО МКК «Екапуста»",
+    "EKAPUSTA": "ООО МКК «Екапуста»",
+    "E KAPUSTA": "ООО МКК «Екапуста»",
+    "ЛАЙМ ЗАЙМ": "ООО МФК «Лайм-Займ»",
+    "ЛАЙМ": "ООО МФК «Лайм-Займ»",
+    "LIME ZAIM": "ООО МФК «Лайм-Займ»",
+    "LIMEZAIM": "ООО МФК «Лайм-Займ»",
+    "СРОЧНОДЕНЬГИ": "ООО МФК «СрочноДеньги»",
+    "СРОЧНО ДЕНЬГИ": "ООО МФК «СрочноДеньги»",
+    "SROCHNODENGІ": "ООО МФК «СрочноДеньги»",
+    "БЫСТРОДЕНЬГИ": "ООО МКК «БыстроДеньги»",
+    "БЫСТРО ДЕНЬГИ": "ООО МКК «БыстроДеньги»",
+    "BISTRODENGI": "ООО МКК «БыстроДеньги»",
+    "МИКРОЗАЙМ": "ООО МФК «МикроЗайм»",
+    "МИКРО ЗАЙМ": "ООО МФК «МикроЗайм»",
+    "MICROZAIM": "ООО МФК «МикроЗайм»",
+    "ЗАЙМОГРАД": "ООО МКК «ЗаймоГрад»",
+    "ZAIMO GRAD": "ООО МКК «ЗаймоГрад»",
+    "ZAIMOGRAD": "ООО МКК «ЗаймоГрад»",
+}
+
+# Для частичного совпадения: самые длинные ключи первыми (как сортировка matches раньше)
+_CANONICAL_BY_LENGTH = sorted(
+    ((len(key), key, value) for key, value in CANONICAL_NAMES.items()),
+    reverse=True,
+)
+
+# Организационно-правовые формы, которые убираются из ключа сравнения
+_OPF_PATTERNS = (
+    "ПУБЛИЧНОЕ АКЦИОНЕРНОЕ ОБЩЕСТВО",
+    "АКЦИОНЕРНОЕ ОБЩЕСТВО",
+    "ОБЩЕСТВО С ОГРАНИЧЕННОЙ ОТВЕТСТВЕННОСТЬЮ",
+    "КОММЕРЧЕСКИЙ БАНК",
+    "МИКРОФИНАНСОВАЯ КОМПАНИЯ",
+    "МИКРОКРЕДИТНАЯ КОМПАНИЯ",
+    "МИКРОФИНАНСОВАЯ ОРГАНИЗАЦИЯ",
+    "ПАО", "АО", "ООО", "ОАО", "ЗАО",
+    "МФК", "МКК", "МФО",
+    "КБ", "БАНК",
+)
+
+_CREDITOR_PREFIXES = ("МФО:", "Мфо:", "МФО :", "Мфо :", "Банк: ", "БАНК: ", "Банк :", "БАНК :")
+_RENAMED_RE = re.compile(r'\s*\(ранее[^)]*\)\s*', re.IGNORECASE)
+_QUOTE_PATTERNS = (
+    (re.compile(r"''([^']+)''"), r'«\1»'),
+    (re.compile(r'""([^"]+)""'), r'«\1»'),
+    (re.compile(r'"([^"]+)"'), r'«\1»'),
+    (re.compile(r"'([^']+)'"), r'«\1»'),
+)
+_LEGAL_ABBREVIATION_RE = re.compile(r'\b(мкк|мфк|мфо|ооо|пао|ао)\b', re.IGNORECASE)
+_MFO_STRUCTURE_PATTERNS = (
+    # МКК/МФК в конце названия в кавычках
+    (re.compile(r'ООО\s+«([^»]+?)\s+(МКК|МФК|МФО)»', re.IGNORECASE), r'ООО \2 «\1»'),
+    # МКК/МФК в начале названия в кавычках: ООО «МКК Название» → ООО МКК «Название»
+    (re.compile(r'ООО\s+«(МКК|МФК|МФО)\s+([^»]+)»', re.IGNORECASE), r'ООО \1 «\2»'),
+    (re.compile(r'Общество с ограниченной ответственностью\s+«([^»]+?)\s+(МКК|МФК|МФО)»', re.IGNORECASE), r'ООО \2 «\1»'),
+    (re.compile(r'ООО\s+([^\s«]+)\s+(МКК|МФК|МФО)', re.IGNORECASE), r'ООО \2 «\1»'),  # Без кавычек
+)
+
+# === Разбор денежных сумм ===
+AMOUNT_CACHE_SIZE = 8192  # Кэш разобранных строк сумм
+
+# "1 234 567,89", "-1.234,56", "1,234.56 руб.", "1 234 руб. 56 коп.", "₽"
+_AMOUNT_RE = re.compile(
+    r"([-−–])?\s*(\d[\d\s'.,]*\d|\d)[\s.,]*"
+    r"(?:(?:руб(?:л[а-я]*)?|р)\.?|₽)?"
+    r"(?:\s*(\d{1,2})\s*коп[а-я]*\.?)?",
+    re.IGNORECASE,
+)
+_PLAIN_AMOUNT_RE = re.compile(r"-?\d+(?:[.,]\d+)?")
+# "1.500" / "1,500" перед копейками - разделитель тысяч, а не дробная часть
+_THOUSANDS_ONLY_RE = re.compile(r"\d{1,3}[.,]\d{3}")
+_AMOUNT_NOISE = ("\xa0", " ", "руб.", "руб", "р.", "р", "₽")
+
+
+@lru_cache(maxsize=AMOUNT_CACHE_SIZE)
+def _parse_amount_text(text: str) -> Optional[Decimal]:
+    """Строка суммы -> Decimal за один проход регулярного выражения."""
+    text = text.strip()
+    if _PLAIN_AMOUNT_RE.fullmatch(text):
+        return Decimal(text.replace(",", "."))
+    match = _AMOUNT_RE.fullmatch(text)
+    if not match:
+        # Произвольный текст вокруг числа: прежний разбор (только цифры, точка и минус)
+        cleaned = text
+        for token in _AMOUNT_NOISE:
+            cleaned = cleaned.replace(token, "")
+        normalized = "".join(ch for ch in cleaned.replace(",", ".") if ch in "0123456789.-")
+        if not normalized or normalized in {"-", ".", "-."}:
+            return None
+        try:
+            return Decimal(normalized)
+        except InvalidOperation:
+            return None
+
+    sign, number, kopecks = match.groups()
+    number = "".join(number.split()).replace("'", "")
+    dots, commas = number.count("."), number.count(",")
+    if dots and commas:
+        # Десятичный разделитель - последний, другой - разделитель тысяч
+        decimal_sep, thousands_sep = (",", ".") if number.rfind(",") > number.rfind(".") else (".", ",")
+        if number.count(decimal_sep) > 1:
+            return None
+        number = number.replace(thousands_sep, "").replace(decimal_sep, ".")
+    elif dots > 1 or commas > 1 or (kopecks and _THOUSANDS_ONLY_RE.fullmatch(number)):
+        # "1.234.567" / "1,234,567" / "1.500 руб. 50 коп." - только разделители тысяч
+        number = number.replace(".", "").replace(",", "")
+    else:
+        number = number.replace(",", ".")
+
+    try:
+        amount = Decimal(number)
+    except InvalidOperation:
+        return None
+    if kopecks:
+        amount += Decimal(kopecks) / 100
+    return -amount if sign else amount
+
 
 # Initialize OpenAI client
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
@@ -47,15 +263,231 @@ class DocumentOutput:
     extracted_text: Optional[str] = None
 
 
+# === Простая подстановка в DOCX ===
+# Плейсхолдеры {{ключ}}: PLACEHOLDER_RE и placeholder_key из template_cache
+# (по ним же template_cache определяет поля шаблона для перегенерации)
+# {{LINE_BREAK}} -> перенос строки внутри параграфа (форматирование параграфа сохраняется)
+_LINE_BREAK_XML = '</w:t><w:br/><w:t xml:space="preserve">'
+
+
+@dataclass
+class RenderResult:
+    template_path: Path
+    output_path: Path
+    saved_seconds: float = 0.0
+    error: Optional[BaseException] = None
+
+
+# === Параллельный рендер документов ===
+# Пул создаётся один раз на процесс. Контекст spawn: процесс gunicorn
+# многопоточный, fork из него может унаследовать захваченные блокировки.
+# Кэш шаблонов (template_cache) живёт в каждом процессе пула.
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_pool_lock = threading.Lock()
+
+
+def _get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _render_pool
+
+
+def _reset_render_pool(pool: ProcessPoolExecutor) -> None:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _render_document(template_path: Path, output_path: Path, context: Dict[str, Any]) -> float:
+    """Задача пула: один шаблон -> один документ."""
+    return DocumentProcessor.fill_template(template_path, output_path, context)
+
+
+def render_document_set(jobs: Sequence[Tuple[Path, Path]], context: Dict[str, Any]) -> List[RenderResult]:
+    """
+    Отрендерить комплект документов: одна задача пула на шаблон.
+
+    Args:
+        jobs: пары (шаблон, итоговый файл)
+        context: общий контекст шаблонов
+
+    Returns:
+        Результаты в порядке jobs (ошибки - в RenderResult.error, не исключениями)
+    """
+    results = [RenderResult(Path(template), Path(output)) for template, output in jobs]
+    pending = list(results)
+
+    if RENDER_WORKERS > 1 and len(jobs) > 1:
+        pool = _get_render_pool()
+        try:
+            futures = [
+                pool.submit(_render_document, result.template_path, result.output_path, context)
+                for result in results
+            ]
+        except (BrokenProcessPool, RuntimeError) as e:
+            print(f"      WARNING - Render pool unavailable ({e}), rendering sequentially")
+            _reset_render_pool(pool)
+            futures = []
+        if futures:
+            pending = []
+            for result, future in zip(results, futures):
+                try:
+                    result.saved_seconds = future.result()
+                except BrokenProcessPool:
+                    # Процесс пула упал - этот шаблон рендерим здесь
+                    pending.append(result)
+                except Exception as e:
+                    result.error = e
+            if pending:
+                print(f"      WARNING - Render pool crashed, rendering {len(pending)} document(s) sequentially")
+                _reset_render_pool(pool)
+
+    for result in pending:
+        try:
+            result.saved_seconds = _render_document(result.template_path, result.output_path, context)
+        except Exception as e:
+            result.error = e
+    return results
+
+
 class DocumentProcessor:
     """Processes PDF documents and aggregates structured data."""
 
-    def __init__(self) -> None:
-        pass
+    def __init__(self, progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> None:
+        # Замеры этапов обработки (документ, батч GPT, генерация) для прогноза времени очереди
+        self.stage_timings: List[Dict[str, Any]] = []
+        # Получает словари прогресса: текущий файл, номер батча и т.п.
+        self.progress_callback = progress_callback
 
-    # Registries populated at startup by app.py or scheduler
+    def _emit_progress(self, **progress: Any) -> None:
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(progress)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[PROGRESS] Ошибка обработчика прогресса: {exc}")
+
+    def _record_stage(self, stage: str, doc_type: Optional[str], pages: int, seconds: float) -> None:
+        self.stage_timings.append({
+            "stage": stage,
+            "doc_type": doc_type,
+            "pages": pages,
+            "seconds": round(seconds, 3),
+        })
+
+    # Registries populated at startup by app.py or scheduler.
+    # BANK_REGISTRY/MFO_REGISTRY mirror the latest snapshot; lookups go through
+    # registries() so that a job sees one consistent version (see registry_store).
     BANK_REGISTRY: Dict[str, Any] = {}
     MFO_REGISTRY: Dict[str, Any] = {}
+    REGISTRY_SNAPSHOTS = RegistrySnapshots()
+    # Словарь названий кредиторов (creditor_aliases), подключается в app.init_db
+    CREDITOR_ALIASES: Optional[CreditorAliasStore] = None
+
+    @classmethod
+    def registries(cls) -> RegistrySnapshot:
+        """Снимок реестров для поиска: закреплённый за задачей или последний."""
+        snapshot = cls.REGISTRY_SNAPSHOTS.current()
+        latest = cls.REGISTRY_SNAPSHOTS.latest
+        if cls.BANK_REGISTRY is not latest.bank or cls.MFO_REGISTRY is not latest.mfo:
+            # Другой процесс собрал новое поколение - обновляем и атрибуты класса
+            cls.BANK_REGISTRY, cls.MFO_REGISTRY = latest.bank, latest.mfo
+        return snapshot
+
+    @classmethod
+    def pinned_registries(cls):
+        """Контекст: все поиски по реестрам внутри видят одну версию."""
+        return cls.REGISTRY_SNAPSHOTS.pinned()
+
+    @classmethod
+    def set_registries(cls, bank_registry: Optional[Mapping] = None, mfo_registry: Optional[Mapping] = None) -> None:
+        """Заменить реестры и сразу построить поисковые индексы для новой версии.
+
+        Реестры из registry_store (ленивые отображения поверх SQLite) ищут по
+        своим индексам на диске, поэтому для них в памяти ничего не строится.
+        """
+        bank = cls.BANK_REGISTRY if bank_registry is None else bank_registry
+        mfo = cls.MFO_REGISTRY if mfo_registry is None else mfo_registry
+        # Индексы строятся до подмены, чтобы первый поиск по новой версии не ждал
+        for registry in (bank, mfo):
+            if isinstance(registry, dict):
+                get_registry_index(registry)
+                get_trigram_index(registry)
+        get_identifier_index(bank, mfo)
+
+        generation = getattr(getattr(bank, "store", None), "generation", None)
+        cls.REGISTRY_SNAPSHOTS.publish(bank, mfo, generation)
+        cls.BANK_REGISTRY, cls.MFO_REGISTRY = bank, mfo
+
+    @classmethod
+    def set_creditor_aliases(cls, store: Optional[CreditorAliasStore]) -> None:
+        """Подключить словарь названий кредиторов (None - отключить)."""
+        if store is not None:
+            store.refresh(force=True)
+        cls.CREDITOR_ALIASES = store
+
+    @staticmethod
+    def creditor_alias(name: str, inn: Optional[str] = None) -> Optional[CreditorAlias]:
+        """Запись словаря кредиторов для исходной строки (O(1)) или None.
+
+        Запись с другим ИНН, чем пришёл из отчёта, не используется.
+        """
+        store = DocumentProcessor.CREDITOR_ALIASES
+        if store is None or not name:
+            return None
+        store.refresh()
+        alias = store.lookup(name)
+        if alias and inn and alias.inn:
+            reported_inn, _ = split_identifiers(inn)
+            if reported_inn and reported_inn != alias.inn:
+                return None
+        return alias
+
+    @staticmethod
+    def learn_creditor_aliases(entries: Iterable[CreditorAlias]) -> None:
+        """Сохранить найденные соответствия названий кредиторов (ошибки БД не прерывают обработку)."""
+        store = DocumentProcessor.CREDITOR_ALIASES
+        if store is None:
+            return
+        try:
+            learned = store.learn_many(entries)
+        except sqlite3.Error as e:
+            print(f"[ALIASES] Не удалось сохранить словарь кредиторов: {e}")
+            return
+        if learned:
+            print(f"[ALIASES] Запомнено названий кредиторов: {learned}")
+
+    @staticmethod
+    def fuzzy_registry_candidates(name: str, k: int = 5) -> List[tuple]:
+        """Нечёткий поиск по названиям в обоих реестрах (триграммы).
+
+        Returns:
+            До k кандидатов (сходство, реестр "bank"/"mfo", ключ, данные) по убыванию сходства
+        """
+        registries = DocumentProcessor.registries()
+        candidates = []
+        for source, registry in (("bank", registries.bank), ("mfo", registries.mfo)):
+            if not registry:
+                continue
+            for key, score in get_trigram_index(registry).search(name, k=k):
+                candidates.append((score, source, key, registry[key]))
+        candidates.sort(key=lambda item: -item[0])
+        return candidates[:k]
+
+    @staticmethod
+    def find_registry_entry_by_id(inn: Optional[str] = None, ogrn: Optional[str] = None) -> Optional[tuple]:
+        """Точный поиск записи реестра по ИНН/ОГРН: (реестр, ключ, данные) или None."""
+        if not inn and not ogrn:
+            return None
+        registries = DocumentProcessor.registries()
+        return get_identifier_index(registries.bank, registries.mfo).lookup(inn=inn, ogrn=ogrn)
 
     @classmethod
     def initialize_bank_registry(cls) -> None:
@@ -67,6 +499,16 @@ class DocumentProcessor:
         bank_file = Path("cbr_data") / "bank_registry.json"
         mfo_file = Path("cbr_data") / "mfo_registry.json"
 
+        # Актуальное SQLite-хранилище открываем лениво, без загрузки JSON
+        store = open_registry_store([bank_file, mfo_file])
+        if store is not None:
+            try:
+                cls.set_registries(store.mapping("bank"), store.mapping("mfo"))
+                print(f"Initialized BANK_REGISTRY: {len(cls.BANK_REGISTRY)} banks, MFO_REGISTRY: {len(cls.MFO_REGISTRY)} MFOs (registry.sqlite)")
+                return
+            except sqlite3.Error as e:
+                print(f"[WARN] Failed to open registry store: {e}")
+
         if bank_file.exists():
             try:
                 with open(bank_file, "r", encoding="utf-8") as f:
@@ -87,8 +529,17 @@ class DocumentProcessor:
         else:
             cls.MFO_REGISTRY = {}
 
+        cls.set_registries(cls.BANK_REGISTRY, cls.MFO_REGISTRY)
         print(f"Initialized BANK_REGISTRY: {len(cls.BANK_REGISTRY)} banks, MFO_REGISTRY: {len(cls.MFO_REGISTRY)} MFOs")
 
+        # Собираем хранилище, чтобы следующие процессы стартовали без JSON
+        if cls.BANK_REGISTRY or cls.MFO_REGISTRY:
+            try:
+                # Несколько процессов стартуют одновременно - собирает только первый
+                build_registry_store(cls.BANK_REGISTRY, cls.MFO_REGISTRY, source_files=[bank_file, mfo_file])
+            except (OSError, sqlite3.Error) as e:
+                print(f"[WARN] Failed to build registry store: {e}")
+
     # === Prompt configuration ===
     DOCUMENT_TYPES: Dict[str, Dict[str, Any]] = {
         "паспорт": {
@@ -1430,20 +1881,18 @@ JSON:
 
     @staticmethod
     def parse_decimal(value: Optional[str]) -> Optional[Decimal]:
+        """Сумма из поля отчёта/анкеты: число, Decimal или строка ("1 234,56 руб.").
+
+        Поддерживает разделители тысяч (пробел, точка, запятая), десятичную
+        запятую, минус и формы "руб./коп."; строки кэшируются.
+        """
         if not value:
             return None
-        cleaned = str(value)
-        for token in ("\xa0", " ", "руб.", "руб", "р.", "р", "₽"):
-            cleaned = cleaned.replace(token, "")
-        cleaned = cleaned.replace(",", ".")
-        allowed = "0123456789.-"
-        normalized = "".join(ch for ch in cleaned if ch in allowed)
-        if not normalized or normalized in {"-", ".", "-."}:
-            return None
-        try:
-            return Decimal(normalized)
-        except InvalidOperation:
-            return None
+        if isinstance(value, Decimal):
+            return value
+        if isinstance(value, int) and not isinstance(value, bool):
+            return Decimal(value)
+        return _parse_amount_text(str(value))
 
     @staticmethod
     def format_decimal(value: Decimal) -> str:
@@ -1452,8 +1901,11 @@ JSON:
         return formatted.replace(".", ",")
 
     @staticmethod
+    @lru_cache(maxsize=NAME_CACHE_SIZE)
     def normalize_creditor_name(name: str) -> str:
         """Нормализует название кредитора (банка/МФО/МКК).
+
+        Результат кэшируется по исходной строке (NAME_CACHE_SIZE записей).
         
         Args:
             name: Исходное название
@@ -1466,25 +1918,17 @@ JSON:
         
         # 1. Убираем префикс "МФО: " и похожие
         result = name.strip()
-        for prefix in ["МФО:", "Мфо:", "МФО :", "Мфо :", "Банк: ", "БАНК: ", "Банк :", "БАНК :"]:
+        for prefix in _CREDITOR_PREFIXES:
             if result.startswith(prefix):
                 result = result[len(prefix):].strip()
         
         # 2. Убираем историю переименований в скобках (ранее - ...)
-        # Ищем последнюю открывающую скобку с текстом "ранее"
-        import re
-        result = re.sub(r'\s*\(ранее[^)]*\)\s*', ' ', result, flags=re.IGNORECASE)
+        result = _RENAMED_RE.sub(' ', result)
         
         # 3. Нормализуем кавычки: '' "" → «»
-        # СНАЧАЛА обрабатываем парные кавычки с помощью regex
-        # Паттерн: ''текст'' → «текст»
-        result = re.sub(r"''([^']+)''", r'«\1»', result)
-        # Паттерн: ""текст"" → «текст»
-        result = re.sub(r'""([^"]+)""', r'«\1»', result)
-        # Паттерн: "текст" → «текст»
-        result = re.sub(r'"([^"]+)"', r'«\1»', result)
-        # Паттерн: 'текст' → «текст»
-        result = re.sub(r"'([^']+)'", r'«\1»', result)
+        # СНАЧАЛА обрабатываем парные кавычки: ''текст'', ""текст"", "текст", 'текст' → «текст»
+        for pattern, replacement in _QUOTE_PATTERNS:
+            result = pattern.sub(replacement, result)
         
         # ПОТОМ заменяем умные кавычки (которые остались)
         result = result.replace('"', '«').replace('"', '»')  # Умные английские кавычки
@@ -1494,21 +1938,11 @@ JSON:
         result = result.replace('««', '«').replace('»»', '»')
         
         # 4. Нормализуем аббревиатуры (МКК/МФК в верхний регистр) ПЕРЕД перестановкой структуры
-        result = re.sub(r'\b(мкк|мфк|мфо|ооо|пао|ао)\b', lambda m: m.group(1).upper(), result, flags=re.IGNORECASE)
+        result = _LEGAL_ABBREVIATION_RE.sub(lambda m: m.group(1).upper(), result)
         
         # 5. Нормализуем структуру: ООО «Да-кредит МКК» → ООО МКК «Да-кредит»
-        # Паттерн: ООО «[название] МКК/МФК» → ООО МКК/МФК «[название]»
-        patterns = [
-            # МКК/МФК в конце названия в кавычках
-            (r'ООО\s+«([^»]+?)\s+(МКК|МФК|МФО)»', r'ООО \2 «\1»'),
-            # МКК/МФК в начале названия в кавычках: ООО «МКК Название» → ООО МКК «Название»
-            (r'ООО\s+«(МКК|МФК|МФО)\s+([^»]+)»', r'ООО \1 «\2»'),
-            (r'Общество с ограниченной ответственностью\s+«([^»]+?)\s+(МКК|МФК|МФО)»', r'ООО \2 «\1»'),
-            (r'ООО\s+([^\s«]+)\s+(МКК|МФК|МФО)', r'ООО \2 «\1»'),  # Без кавычек
-        ]
-        
-        for pattern, replacement in patterns:
-            result = re.sub(pattern, replacement, result, flags=re.IGNORECASE)
+        for pattern, replacement in _MFO_STRUCTURE_PATTERNS:
+            result = pattern.sub(replacement, result)
         
         # 6. Убираем лишние пробелы
         result = ' '.join(result.split())
@@ -1545,64 +1979,82 @@ JSON:
         return words
 
     @staticmethod
-    def get_bank_address(bank_name: str) -> str:
+    def get_bank_address(bank_name: str, inn: Optional[str] = None, ogrn: Optional[str] = None) -> str:
         """Возвращает юридический адрес банка/МФО из реестров ЦБ РФ.
 
         Args:
             bank_name: Название банка/МФО (нормализованное или каноническое)
+            inn: ИНН кредитора из отчёта (если есть - ищем сначала по нему)
+            ogrn: ОГРН кредитора из отчёта
 
         Returns:
             Полный адрес из реестра или фоллбэк из словаря
         """
+        # Ручное исправление в словаре кредиторов важнее реестров
+        alias = DocumentProcessor.creditor_alias(bank_name, inn)
+        if alias and alias.source == SOURCE_MANUAL and alias.address:
+            return alias.address
+
+        # Точный поиск по идентификатору; по названию - только если его нет в реестрах
+        match = DocumentProcessor.find_registry_entry_by_id(inn, ogrn)
+        if match and match[2].get("адрес"):
+            return match[2]["адрес"]
+
+        # Автоматическая запись словаря - только каноническое название для поиска
+        if alias:
+            bank_name = alias.canonical
+
         # Извлекаем ключевые слова для поиска
         keywords = DocumentProcessor.extract_search_keywords(bank_name)
+        registries = DocumentProcessor.registries()
         
         # Определяем тип организации по названию
         name_upper = bank_name.upper()
         is_mfo = any(marker in name_upper for marker in ["МКК", "МФК", "МФО", "МИКРОКРЕДИТНАЯ", "МИКРОФИНАНСОВАЯ"])
         is_bank = any(marker in name_upper for marker in ["БАНК", "ПАО", "АО"])
         
-        # Функция поиска в реестре
+        # Функция поиска в реестре (индекс по ключевым словам, порог 70%, лучшее совпадение)
         def search_in_registry(registry, keywords):
             if not registry or not keywords:
                 return None
-            for key, data in registry.items():
-                name_lower = data.get("название", "").lower()
-                matches = sum(1 for kw in keywords if kw in name_lower)
-                if matches >= len(keywords) * 0.7:  # 70% порог
-                    address = data.get("адрес", "")
-                    if address:
-                        return address
-            return None
+            match = get_registry_index(registry).best_keyword_match(
+                keywords, predicate=lambda data: data.get("адрес")
+            )
+            return match[1]["адрес"] if match else None
         
         # Приоритет 1: Если это МФО/МКК - сначала ищем в MFO_REGISTRY
         if is_mfo and not is_bank:
-            address = search_in_registry(DocumentProcessor.MFO_REGISTRY, keywords)
+            address = search_in_registry(registries.mfo, keywords)
             if address:
                 return address
             # Если не нашли - пробуем в BANK_REGISTRY
-            address = search_in_registry(DocumentProcessor.BANK_REGISTRY, keywords)
+            address = search_in_registry(registries.bank, keywords)
             if address:
                 return address
         
         # Приоритет 2: Если это банк - сначала ищем в BANK_REGISTRY
         elif is_bank:
-            address = search_in_registry(DocumentProcessor.BANK_REGISTRY, keywords)
+            address = search_in_registry(registries.bank, keywords)
             if address:
                 return address
             # Если не нашли - пробуем в MFO_REGISTRY
-            address = search_in_registry(DocumentProcessor.MFO_REGISTRY, keywords)
+            address = search_in_registry(registries.mfo, keywords)
             if address:
                 return address
         
         # Приоритет 3: Если тип неизвестен - ищем в обоих реестрах
         else:
-            address = search_in_registry(DocumentProcessor.MFO_REGISTRY, keywords)
+            address = search_in_registry(registries.mfo, keywords)
             if address:
                 return address
-            address = search_in_registry(DocumentProcessor.BANK_REGISTRY, keywords)
+            address = search_in_registry(registries.bank, keywords)
             if address:
                 return address
+
+        # Нечёткий поиск по триграммам (опечатки OCR, другой порядок слов)
+        for _, _, _, data in DocumentProcessor.fuzzy_registry_candidates(bank_name):
+            if data.get("адрес"):
+                return data["адрес"]
         
         # 3. FALLBACK: словарь адресов банков и МФО (данные на 03.11.2025)
         BANK_ADDRESSES = {
@@ -1740,17 +2192,40 @@ JSON:
         return ""
 
     @staticmethod
-    def get_bank_inn(bank_name: str) -> str:
+    def get_bank_inn(bank_name: str, inn: Optional[str] = None, ogrn: Optional[str] = None) -> str:
         """Возвращает ИНН банка/МФО из реестров ЦБ РФ.
 
         Args:
             bank_name: Название банка/МФО (нормализованное или каноническое)
+            inn: ИНН из отчёта (может содержать мусор, например "ОГРН ИНН")
+            ogrn: ОГРН кредитора из отчёта
 
         Returns:
             ИНН из реестра или фоллбэк из словаря
         """
+        # Ручное исправление в словаре кредиторов важнее реестров
+        alias = DocumentProcessor.creditor_alias(bank_name, inn)
+        if alias and alias.source == SOURCE_MANUAL and alias.inn:
+            return alias.inn
+
+        # Точный поиск по идентификатору
+        match = DocumentProcessor.find_registry_entry_by_id(inn, ogrn)
+        if match:
+            registry_inn = IdentifierIndex.entry_inn(match)
+            if registry_inn:
+                return registry_inn
+        # Корректный ИНН из отчёта надёжнее поиска по названию
+        reported_inn, _ = split_identifiers(inn)
+        if reported_inn:
+            return reported_inn
+
+        # Автоматическая запись словаря - только каноническое название для поиска
+        if alias:
+            bank_name = alias.canonical
+
         # Извлекаем ключевые слова для поиска
         keywords = DocumentProcessor.extract_search_keywords(bank_name)
+        registries = DocumentProcessor.registries()
         
         # Определяем тип организации по названию
         name_upper = bank_name.upper()
@@ -1759,27 +2234,19 @@ JSON:
         
         # Функция поиска ИНН в реестре МФО (ключ = ИНН)
         def search_inn_in_mfo(keywords):
-            if not DocumentProcessor.MFO_REGISTRY or not keywords:
+            if not registries.mfo or not keywords:
                 return None
-            for inn, mfo_data in DocumentProcessor.MFO_REGISTRY.items():
-                mfo_name_lower = mfo_data.get("название", "").lower()
-                matches = sum(1 for kw in keywords if kw in mfo_name_lower)
-                if matches >= len(keywords) * 0.7:  # 70% порог
-                    return inn  # Ключ словаря - это ИНН!
-            return None
+            match = get_registry_index(registries.mfo).best_keyword_match(keywords)
+            return match[0] if match else None  # Ключ словаря - это ИНН!
         
         # Функция поиска ИНН в реестре банков (поле "инн")
         def search_inn_in_bank(keywords):
-            if not DocumentProcessor.BANK_REGISTRY or not keywords:
+            if not registries.bank or not keywords:
                 return None
-            for ogrn, bank_data in DocumentProcessor.BANK_REGISTRY.items():
-                bank_name_lower = bank_data.get("название", "").lower()
-                matches = sum(1 for kw in keywords if kw in bank_name_lower)
-                if matches >= len(keywords) * 0.7:  # 70% порог
-                    inn = bank_data.get("инн", "")
-                    if inn:
-                        return inn
-            return None
+            match = get_registry_index(registries.bank).best_keyword_match(
+                keywords, predicate=lambda data: data.get("инн")
+            )
+            return match[1]["инн"] if match else None
         
         # Приоритет 1: Если это МФО/МКК - сначала ищем в MFO_REGISTRY
         if is_mfo and not is_bank:
@@ -1807,6 +2274,13 @@ JSON:
             inn = search_inn_in_bank(keywords)
             if inn:
                 return inn
+
+        # Нечёткий поиск по триграммам (опечатки OCR, другой порядок слов)
+        for _, source, key, data in DocumentProcessor.fuzzy_registry_candidates(bank_name):
+            if source == "mfo":
+                return key
+            if data.get("инн"):
+                return data["инн"]
         
         # 2. FALLBACK: словарь ИНН банков (данные на 03.11.2025)
         BANK_INN = {
@@ -1883,6 +2357,20 @@ JSON:
     def normalize_bank_name(name: str) -> tuple[str, str]:
         """Нормализует название банка для объединения дубликатов.
 
+        Сначала словарь кредиторов (creditor_aliases), затем правила
+        (_normalize_bank_name_by_rules, с кэшем по исходной строке).
+        """
+        alias = DocumentProcessor.creditor_alias(name)
+        if alias:
+            normalized = alias.normalized or DocumentProcessor._normalize_bank_name_by_rules(alias.canonical)[0]
+            return (normalized, alias.canonical)
+        return DocumentProcessor._normalize_bank_name_by_rules(name)
+
+    @staticmethod
+    @lru_cache(maxsize=NAME_CACHE_SIZE)
+    def _normalize_bank_name_by_rules(name: str) -> tuple[str, str]:
+        """Нормализует название банка по правилам и словарю CANONICAL_NAMES.
+
         Возвращает кортеж: (нормализованное_название, каноническое_название)
         - нормализованное_название - для сравнения и группировки
         - каноническое_название - правильный формат для отображения
@@ -1900,99 +2388,6 @@ JSON:
         # СНАЧАЛА применяем нормализацию МФО/МКК (убираем "МФО:", историю, кавычки)
         canonical_name = DocumentProcessor.normalize_creditor_name(original)
 
-        # Словарь канонических названий известных банков/МФО
-        CANONICAL_NAMES = {
-            "СБЕРБАНК": "ПАО «Сбербанк»",
-            "СБЕР": "ПАО «Сбербанк»",
-            "СБЕР РОССИИ": "ПАО «Сбербанк»",
-            "РОССИИ": "ПАО «Сбербанк»",  # Для "Сбербанк России" после удаления "БАНК"
-            "ВТБ": "ПАО «ВТБ»",
-            "АЛЬФА БАНК": "АО «Альфа-Банк»",
-            "АЛЬФА": "АО «Альфа-Банк»",
-            "ТИНЬКОФФ": "АО «Тинькофф Банк»",
-            "ТИНЬКОФФ БАНК": "АО «Тинькофф Банк»",
-            "ТИНКОВ": "АО «Тинькофф Банк»",
-            "РОССЕЛЬХОЗБАНК": "АО «Россельхозбанк»",
-            "РОССЕЛЬХОЗ": "АО «Россельхозбанк»",
-            "ГАЗПРОМБАНК": "АО «ГПБ»",
-            "ГАЗПРОМ": "АО «ГПБ»",
-            "МТС БАНК": "ПАО «МТС-Банк»",
-            "МТС": "ПАО «МТС-Банк»",
-            "РАЙФФАЙЗЕНБАНК": "АО «Райффайзенбанк»",
-            "РАЙФФАЙЗЕН": "АО «Райффайзенбанк»",
-            "РОСБАНК": "ПАО «РОСБАНК»",
-            "РОС": "ПАО «РОСБАНК»",
-            "ХОУМ КРЕДИТ": "АО «Т-Банк»",  # Хоум Кредит продан Тинькофф и переименован в Т-Банк
-            "ХОУМ КРЕДИТ ЭНД ФИНАНС": "АО «Т-Банк»",
-            "HOME CREDIT": "АО «Т-Банк»",
-            "Т БАНК": "АО «Т-Банк»",
-            "T BANK": "АО «Т-Банк»",
-            "TBANK": "АО «Т-Банк»",
-            "РУСФИНАНС БАНК": "ООО КБ «Русфинанс Банк»",
-            "РУСФИНАНС": "ООО КБ «Русфинанс Банк»",
-            "СОВКОМБАНК": "ПАО «Совкомбанк»",
-            "СОВКОМ": "ПАО «Совкомбанк»",
-            "ОТКРЫТИЕ": "ПАО Банк «ФК Открытие»",
-            "ПОЧТА БАНК": "ПАО «Почта Банк»",
-            "ПОЧТА": "ПАО «Почта Банк»",
-            "УРАЛСИБ": "ПАО «БАНК УРАЛСИБ»",
-            "УРАЛ СИБ": "ПАО «БАНК УРАЛСИБ»",
-            "ПРОМСВЯЗЬБАНК": "ПАО «Промсвязьбанк»",
-            "ПРОМСВЯЗЬ": "ПАО «Промсвязьбанк»",
-            "ОТП БАНК": "АО «ОТП Банк»",
-            "ОТП": "АО «ОТП Банк»",
-            "РЕНЕССАНС КРЕДИТ": "ООО КБ «Ренессанс Кредит»",
-            "РЕНЕССАНС": "ООО КБ «Ренессанс Кредит»",
-            "РУССКИЙ СТАНДАРТ": "АО «Банк Русский Стандарт»",
-
-            # МФО/МФК/МКК
-            "ЗАЙМЕР": "ООО МФК «Займер»",
-            "ЗАЙМ ЭР": "ООО МФК «Займер»",
-            "ВЭББАНКИР": "ООО МКК «ВэбБанкир»",
-            "ВЕББАНКИР": "ООО МКК «ВэбБанкир»",
-            "ВЭЗББАНКИР": "ООО МКК «ВэбБанкир»",
-            "ВЭЗБАНКИР": "ООО МКК «ВэбБанкир»",
-            "ВЭБ ИР": "ООО МКК «ВэбБанкир»",
-            "ВЭЗБ ИР": "ООО МКК «ВэбБанкир»",
-            "WEBBANKIR": "ООО МКК «ВэбБанкир»",
-            "ТУРБОЗАЙМ": "ООО МКК «ТурбоЗайм»",
-            "ТУРБО ЗАЙМ": "ООО МКК «ТурбоЗайм»",
-            "ТУРБО": "ООО МКК «ТурбоЗайм»",
-            "TURBOZAIM": "ООО МКК «ТурбоЗайм»",
-            "МОНЕЙМЕН": "ООО МФК «МаниМен»",
-            "МАНИ МЕН": "ООО МФК «МаниМен»",
-            "MONEYMAN": "ООО МФК «МаниМен»",
-            "MONEY MAN": "ООО МФК «МаниМен»",
-            "МИГКРЕДИТ": "ООО МФК «МигКредит»",
-            "МИГ КРЕДИТ": "ООО МФК «МигКредит»",
-            "МИГ": "ООО МФК «МигКредит»",
-            "MIGCREDIT": "ООО МФК «МигКредит»",
-            "MIGKREDIT": "ООО МФК «МигКредит»",
-            "ДЕНЬГИ СРАЗУ": "ООО МКК «Деньги сразу»",
-            "DENGISRAZY": "ООО МКК «Деньги сразу»",
-            "DENGI SRAZY": "ООО МКК «Деньги сразу»",
-            "ЕKAPУСТА": "ООО МКК «Екапуста»",
-            "Е КАПУСТА": "ООО МКК «Екапуста»",
-            "EKAPUSTA": "ООО МКК «Екапуста»",
-            "E KAPUSTA": "ООО МКК «Екапуста»",
-            "ЛАЙМ ЗАЙМ": "ООО МФК «Лайм-Займ»",
-            "ЛАЙМ": "ООО МФК «Лайм-Займ»",
-            "LIME ZAIM": "ООО МФК «Лайм-Займ»",
-            "LIMEZAIM": "ООО МФК «Лайм-Займ»",
-            "СРОЧНОДЕНЬГИ": "ООО МФК «СрочноДеньги»",
-            "СРОЧНО ДЕНЬГИ": "ООО МФК «СрочноДеньги»",
-            "SROCHNODENGІ": "ООО МФК «СрочноДеньги»",
-            "БЫСТРОДЕНЬГИ": "ООО МКК «БыстроДеньги»",
-            "БЫСТРО ДЕНЬГИ": "ООО МКК «БыстроДеньги»",
-            "BISTRODENGI": "ООО МКК «БыстроДеньги»",
-            "МИКРОЗАЙМ": "ООО МФК «МикроЗайм»",
-            "МИКРО ЗАЙМ": "ООО МФК «МикроЗайм»",
-            "MICROZAIM": "ООО МФК «МикроЗайм»",
-            "ЗАЙМОГРАД": "ООО МКК «ЗаймоГрад»",
-            "ZAIMO GRAD": "ООО МКК «ЗаймоГрад»",
-            "ZAIMOGRAD": "ООО МКК «ЗаймоГрад»",
-        }
-
         # Шаг 1: Убираем организационно-правовые формы и знаки (используем нормализованное название)
         normalized = canonical_name.upper()
 
@@ -2000,20 +2395,8 @@ JSON:
         normalized = normalized.replace('"', '').replace("'", '').replace('«', '').replace('»', '')
 
         # Убираем организационно-правовые формы
-        opf_patterns = [
-            "ПУБЛИЧНОЕ АКЦИОНЕРНОЕ ОБЩЕСТВО",
-            "АКЦИОНЕРНОЕ ОБЩЕСТВО",
-            "ОБЩЕСТВО С ОГРАНИЧЕННОЙ ОТВЕТСТВЕННОСТЬЮ",
-            "КОММЕРЧЕСКИЙ БАНК",
-            "МИКРОФИНАНСОВАЯ КОМПАНИЯ",
-            "МИКРОКРЕДИТНАЯ КОМПАНИЯ",
-            "МИКРОФИНАНСОВАЯ ОРГАНИЗАЦИЯ",
-            "ПАО", "АО", "ООО", "ОАО", "ЗАО",
-            "МФК", "МКК", "МФО",
-            "КБ", "БАНК",
-        ]
 
-        for pattern in opf_patterns:
+        for pattern in _OPF_PATTERNS:
             normalized = normalized.replace(pattern, " ")
 
         # Убираем скобки и дефисы
@@ -2027,26 +2410,12 @@ JSON:
 
         # Если не нашли точное совпадение, ищем частичное
         if not canonical:
-            # Сначала ищем полное вхождение нормализованного в ключи
-            for key, value in CANONICAL_NAMES.items():
-                if normalized == key:
-                    canonical = value
-                    break
-
-            # Затем ищем частичное совпадение (приоритет длинным совпадениям)
+            # Затем ищем частичное совпадение (вхождение в обе стороны, приоритет длинным)
             if not canonical:
-                matches = []
-                for key, value in CANONICAL_NAMES.items():
-                    # Проверяем вхождение в обе стороны
-                    if key in normalized:
-                        matches.append((len(key), key, value))
-                    elif normalized in key:
-                        matches.append((len(key), key, value))
-
-                # Берем самое длинное совпадение
-                if matches:
-                    matches.sort(reverse=True)  # Сортируем по длине
-                    _, normalized, canonical = matches[0]
+                for _, key, value in _CANONICAL_BY_LENGTH:
+                    if key in normalized or normalized in key:
+                        normalized, canonical = key, value
+                        break
 
         # Если не нашли в словаре, используем нормализованное название
         if not canonical:
@@ -2903,7 +3272,7 @@ JSON:
         return (latest_amount / months) if months else None
 
     @staticmethod
-    def format_creditors_table(data_map: Dict[str, List[Dict[str, Any]]], debtor_fio: str = "", debtor_inn: str = "", debtor_snils: str = "", debtor_address: str = "") -> Dict[str, str]:
+    def format_creditors_table(data_map: Dict[str, List[Dict[str, Any]]], debtor_fio: str = "", debtor_inn: str = "", debtor_snils: str = "", debtor_address: str = "", credit_table: Optional[CreditTable] = None) -> Dict[str, str]:
         """Генерирует данные для таблицы 'Список кредиторов и должников гражданина'.
 
         Возвращает словарь с ключами для подстановки в шаблон Word.
@@ -2917,101 +3286,39 @@ JSON:
             debtor_inn: ИНН должника
             debtor_snils: СНИЛС должника
             debtor_address: Адрес регистрации должника
+            credit_table: готовая таблица долгов (build_credit_table), чтобы не строить её повторно
         """
-        from collections import defaultdict
+        if credit_table is None:
+            credit_table = DocumentProcessor.build_credit_table(data_map)
 
-        # ИСПОЛЬЗУЕМ merge_credit_reports для получения объединенного списка с учетом справок
-        merged_credits = DocumentProcessor.merge_credit_reports(data_map)
-        
-        # Конвертируем объединенные кредиты в формат для таблицы
-        all_credits_list = []
-        
-        for entry in merged_credits:
-            if not isinstance(entry, dict):
-                continue
-
-            кредитор = entry.get("Кредитор", "").strip()
-            if not кредитор:
-                continue
-
-            # Данные уже обработаны в merge_credit_reports
-            сумма = entry.get("Сумма_задолженности", Decimal(0))
-            if сумма <= 0:
-                continue
-
-            # Нормализация имени
-            кредитор_normalized, кредитор_canonical = DocumentProcessor.normalize_bank_name(кредитор)
-
-            # Получаем данные (уже обработанные в merge_credit_reports)
-            инн_кредитора = entry.get("ИНН_кредитора") or ""
-            огрн_кредитора = entry.get("ОГРН_кредитора") or ""
-            
-            # Если ИНН нет, пробуем получить из реестра ЦБ РФ
-            if not инн_кредитора:
-                инн_кредитора = DocumentProcessor.get_bank_inn(кредитор_canonical)
-
-            # Получаем адрес
-            адрес_из_документа = entry.get("Адрес") or entry.get("Адрес_кредитора") or ""
-            адрес_из_реестра = DocumentProcessor.get_bank_address(кредитор_canonical)
-            адрес_банка = адрес_из_документа or адрес_из_реестра
-
-            тип_кредита = entry.get("Вид") or entry.get("Тип_кредита") or "Потребительский кредит"
-            дата_договора = entry.get("Дата_договора") or ""
-            сумма_обязательства = entry.get("Сумма_обязательства") or Decimal(0)
-            текущая = entry.get("Текущая_задолженность") or Decimal(0)
-            просрочка = entry.get("Просрочка") or entry.get("Текущая_просрочка") or Decimal(0)
-
-            all_credits_list.append({
-                "Кредитор": кредитор,
-                "Кредитор_canonical": кредитор_canonical,
-                "Кредитор_normalized": кредитор_normalized,
-                "ИНН_кредитора": инн_кредитора,
-                "ОГРН_кредитора": огрн_кредитора,
-                "Тип_кредита": тип_кредита,
-                "Дата_договора": дата_договора,
-                "Сумма_обязательства": сумма_обязательства,
-                "Адрес_кредитора": адрес_банка,
-                "Текущая_задолженность": текущая,
-                "Просрочка": просрочка,
-                "Сумма": сумма,
-                "Штрафы_пени": просрочка,
-            })
-
-        # merge_credit_reports уже сделал дедупликацию, НЕ делаем её повторно!
-        # Используем credit напрямую без дополнительной дедупликации
-        # (дедупликация уже сделана в merge_credit_reports с учётом первоначальной суммы)
-        unique_credits = {
-            f"{credit['Кредитор_normalized']}|{credit['Дата_договора']}|{credit.get('Сумма_обязательства', 0)}": credit
-            for credit in all_credits_list
-        }
-
-        # Группируем уникальные кредиты по нормализованному имени кредитора
-        credits_by_creditor = defaultdict(list)
-        for credit in unique_credits.values():
-            кредитор_normalized = credit["Кредитор_normalized"]
-            credits_by_creditor[кредитор_normalized].append(credit)
-
-        # Сортируем кредиторов по общей сумме всех их кредитов (убывание)
-        sorted_creditors = sorted(
-            credits_by_creditor.items(),
-            key=lambda x: sum(c["Сумма"] for c in x[1]),
-            reverse=True
-        )
+        fio_parts = debtor_fio.split() if debtor_fio else []
+        фамилия = fio_parts[0] if len(fio_parts) > 0 else ""
+        имя = fio_parts[1] if len(fio_parts) > 1 else ""
+        отчество = fio_parts[2] if len(fio_parts) > 2 else ""
 
         # Генерируем строки таблицы - ГРУППИРУЕМ ПО БАНКАМ
+        # (группы по убыванию общей суммы кредитов, дедупликация уже сделана в merge_credit_reports)
         table_rows = []
+        learned_aliases = []
         counter = 1
 
-        for кредитор_normalized, credits_list in sorted_creditors:
-            # Каждый договор = отдельная строка в таблице
-            первый_кредит = credits_list[0]
-            
+        for group in credit_table.groups(SECTION_CREDIT):
+            первый = group[0]
+
             # ИСПОЛЬЗУЕМ КАНОНИЧЕСКОЕ НАЗВАНИЕ (правильное форматирование)
-            кредитор_display = первый_кредит["Кредитор_canonical"]
+            кредитор_display = credit_table.creditor[первый]
+            огрн_кредитора = credit_table.ogrn[первый]
 
-            # Адрес: приоритет полному адресу из реестра ЦБ РФ
-            адрес_из_реестра = DocumentProcessor.get_bank_address(кредитор_display)
-            адрес_из_документа = первый_кредит["Адрес_кредитора"]
+            # Если ИНН нет, пробуем получить из реестра ЦБ РФ (по ОГРН или названию)
+            инн_кредитора = credit_table.inn[первый] or DocumentProcessor.get_bank_inn(
+                кредитор_display, ogrn=огрн_кредитора
+            )
+
+            # Адрес: приоритет полному адресу из реестра ЦБ РФ (сначала по ИНН/ОГРН, потом по названию)
+            адрес_из_реестра = DocumentProcessor.get_bank_address(
+                кредитор_display, inn=инн_кредитора, ogrn=огрн_кредитора
+            )
+            адрес_из_документа = credit_table.address[первый]
 
             # Если адрес из реестра длиннее (полный), используем его
             if адрес_из_реестра and len(адрес_из_реестра) > 20:
@@ -3019,38 +3326,48 @@ JSON:
             else:
                 адрес = адрес_из_документа or адрес_из_реестра
 
-            # ИНН кредитора
-            инн_display = первый_кредит.get("ИНН_кредитора") or DocumentProcessor.get_bank_inn(кредитор_display)
+            # Запоминаем, как все написания этого кредитора разрешились в этом деле:
+            # только название и идентификаторы из отчёта. Найденные ИНН и адрес
+            # берутся из реестров заново (их обновления должны доходить до документов)
+            отчётный_инн, _ = split_identifiers(credit_table.inn[первый])
+            for alias in dict.fromkeys(name for index in group for name in (*credit_table.aliases[index], кредитор_display)):
+                learned_aliases.append(CreditorAlias(
+                    alias=alias,
+                    canonical=кредитор_display,
+                    normalized=credit_table.group_key[первый],
+                    inn=отчётный_инн,
+                    ogrn=огрн_кредитора,
+                ))
+
             # Добавляем префикс "ИНН " если ИНН найден
-            if инн_display:
-                инн_display = f"ИНН {инн_display}"
+            инн_display = f"ИНН {инн_кредитора}" if инн_кредитора else ""
 
             # Создаем отдельную строку для каждого договора
-            for contract_idx, credit in enumerate(credits_list):
+            for contract_idx, index in enumerate(group):
                 is_first_contract = (contract_idx == 0)
                 
-                тип_кредита = credit["Тип_кредита"]
-                дата_текст = f"Договор от {credit['Дата_договора']}" if credit['Дата_договора'] else ""
-                сумма_текст = f"{credit['Сумма']:.2f}"
+                дата_договора = credit_table.contract[index]
+                дата_текст = f"Договор от {дата_договора}" if дата_договора else ""
+                сумма_текст = format_kopecks(credit_table.debt_kop[index])
                 
                 пп = f"1.{counter}" if is_first_contract else ""
                 
                 table_rows.append({
                     "пп_кредит": пп,
-                    "Тип_кредита": тип_кредита,
+                    "Тип_кредита": credit_table.kind[index],
                     "Кредитор": кредитор_display if is_first_contract else "",
                     "ИНН_кредитора": инн_display if is_first_contract else "",
                     "Адрес_кредитора": адрес if is_first_contract else "",
                     "Дата_договора": дата_текст,
                     "Полная_сумма_обязательства": сумма_текст,
                     "Задолженность_в_том_числе": сумма_текст,
-                    "Штрафы_пени_и_другое": "0.00",
+                    "Штрафы_пени_и_другое": format_kopecks(credit_table.penalties_kop[index]),
                     # Флаг для объединения ячеек
                     "is_first_contract": is_first_contract,
                     # Данные должника
-                    "Фамилия": debtor_fio.split()[0] if debtor_fio and len(debtor_fio.split()) > 0 else "",
-                    "Имя": debtor_fio.split()[1] if debtor_fio and len(debtor_fio.split()) > 1 else "",
-                    "Отчество": debtor_fio.split()[2] if debtor_fio and len(debtor_fio.split()) > 2 else "",
+                    "Фамилия": фамилия,
+                    "Имя": имя,
+                    "Отчество": отчество,
                     "ИНН": debtor_inn,
                     "Снилs": debtor_snils,
                     "Адрес_регистрации_должника": debtor_address,
@@ -3058,140 +3375,41 @@ JSON:
             
             counter += 1
 
-        # Обязательные платежи (налоги, сборы из постановлений и налоговых уведомлений)
-        # ВАЖНО: Налоги идут в разделе 2 (2.1, 2.2, 2.3...)
-        tax_rows = []
-        tax_counter = 1
-
-        # Другие долги из постановлений (не налоги, не банки)
-        # Идут в разделе 1 после банков (1.X, 1.X+1, ...)
-        other_debts = []
-
-        # 1. Извлекаем ВСЕ постановления пристава
-        for постановление in data_map.get("постановление_пристава", []):
-            взыскатель = (постановление.get("Взыскатель") or "").strip()
-            взыскатель_lower = взыскатель.lower()
-
-            сумма_str = постановление.get("Итого_взыскание") or постановление.get("Сумма_долга") or ""
-            сумма = DocumentProcessor.parse_decimal(сумма_str) or Decimal(0)
-
-            if сумма <= 0:
-                continue
-
-            # Разделяем: налоги в раздел 2, остальные долги в раздел 1
-            if any(kw in взыскатель_lower for kw in ["налог", "ифнс", "фнс", "инспекция федеральной налоговой службы"]):
-                # Это налог - в раздел 2
-                tax_rows.append({
-                    "пп_обяз_платеж": f"2.{tax_counter}",
-                    "Налог_сбор_или_иной_обяз_платеж": взыскатель,
-                    "Сумма_обяз_платежа": f"{сумма:.2f}",
-                    "Штрафы_пени_и_другое_обяз_платежа": "0.00",
-                })
-                tax_counter += 1
-            else:
-                # Это другой долг (не налог, не банк) - в раздел 1
-                # Получаем дополнительные данные
-                номер_ип = постановление.get("Номер_ИП") or постановление.get("Номер") or ""
-                дата_ип = постановление.get("Дата_постановления") or постановление.get("Дата_возбуждения") or постановление.get("Дата") or ""
-                
-                # Предмет исполнения (тип долга)
-                предмет = постановление.get("Предмет_исполнения") or "Взыскание по постановлению ФССП"
-                
-                # Адрес взыскателя
-                адрес_взыскателя = постановление.get("Адрес_взыскателя") or ""
-                # Очищаем лишние запятые и пробелы
-                if адрес_взыскателя:
-                    адрес_взыскателя = ", ".join(filter(None, [x.strip() for x in адрес_взыскателя.split(",")]))
-                
-                # Информация об органе, выдавшем документ + номер дела
-                орган = постановление.get("Орган_выдавший") or ""
-                адрес_органа = постановление.get("Адрес_органа") or ""
-                номер_дела = постановление.get("Номер_дела") or ""
-                
-                # Формируем информацию для поля "Дата_договора"
-                дата_display = []
-                if орган:
-                    орган_clean = ", ".join(filter(None, [x.strip() for x in орган.split(",")]))
-                    дата_display.append(орган_clean)
-                if адрес_органа:
-                    адрес_органа_clean = ", ".join(filter(None, [x.strip() for x in адрес_органа.split(",")]))
-                    дата_display.append(f"Адрес: {адрес_органа_clean}")
-                if номер_дела:
-                    дата_display.append(f"по делу № {номер_дела}")
-                
-                дата_договора_text = " ".join(дата_display) if дата_display else дата_ип
-
-                # Нормализуем название взыскателя для группировки
-                взыскатель_normalized = (
-                    взыскатель
-                    .replace("Общество с ограниченной ответственностью", "ООО")
-                    .replace("ОБЩЕСТВО С ОГРАНИЧЕННОЙ ОТВЕТСТВЕННОСТЬЮ", "ООО")
-                    .replace("Публичное акционерное общество", "ПАО")
-                    .replace("ПУБЛИЧНОЕ АКЦИОНЕРНОЕ ОБЩЕСТВО", "ПАО")
-                    .replace("Акционерное общество", "АО")
-                    .replace("АКЦИОНЕРНОЕ ОБЩЕСТВО", "АО")
-                    .replace('"', '')
-                    .strip()
-                )
+        DocumentProcessor.learn_creditor_aliases(learned_aliases)
 
-                other_debts.append({
-                    "Кредитор": взыскатель_normalized,
-                    "Адрес_кредитора": адрес_взыскателя,
-                    "Тип_кредита": предмет,
-                    "Дата_договора": дата_договора_text,
-                    "Номер_ИП": номер_ип,
-                    "Сумма": сумма,
-                })
-
-        # 2. Извлекаем налоги из налоговых уведомлений
-        for уведомление in data_map.get("налоговое_уведомление", []):
-            налоги = уведомление.get("Налоги", [])
-            for налог in налоги:
-                if not isinstance(налог, dict):
-                    continue
-
-                сумма = DocumentProcessor.parse_decimal(налог.get("Сумма")) or Decimal(0)
-                if сумма <= 0:
-                    continue
-
-                вид = налог.get("Вид", "Налог")
-                период = налог.get("Период", "")
-
-                # Формируем название
-                if период:
-                    название = f"{вид} за {период} г."
-                else:
-                    название = вид
-
-                tax_rows.append({
-                    "пп_обяз_платеж": f"2.{tax_counter}",
-                    "Налог_сбор_или_иной_обяз_платеж": название,
-                    "Сумма_обяз_платежа": f"{сумма:.2f}",
-                    "Штрафы_пени_и_другое_обяз_платежа": "0.00",
-                })
-                tax_counter += 1
-
-        # 3. Добавляем другие долги (из постановлений, не налоги) в раздел 1 ПОСЛЕ банков
-        for debt in other_debts:
+        # Другие долги из постановлений (не налоги, не банки) - в разделе 1 ПОСЛЕ банков
+        for index in credit_table.rows(SECTION_OTHER):
+            сумма_текст = format_kopecks(credit_table.debt_kop[index])
             table_rows.append({
                 "пп_кредит": f"1.{counter}",
-                "Тип_кредита": debt["Тип_кредита"],
-                "Кредитор": debt["Кредитор"],
-                "Адрес_кредитора": debt["Адрес_кредитора"],
-                "Дата_договора": debt["Дата_договора"],
-                "Полная_сумма_обязательства": f"{debt['Сумма']:.2f}",
-                "Задолженность_в_том_числе": f"{debt['Сумма']:.2f}",
-                "Штрафы_пени_и_другое": "0.00",
+                "Тип_кредита": credit_table.kind[index],
+                "Кредитор": credit_table.creditor[index],
+                "Адрес_кредитора": credit_table.address[index],
+                "Дата_договора": credit_table.contract[index],
+                "Полная_сумма_обязательства": сумма_текст,
+                "Задолженность_в_том_числе": сумма_текст,
+                "Штрафы_пени_и_другое": format_kopecks(credit_table.penalties_kop[index]),
                 # Данные должника
-                "Фамилия": debtor_fio.split()[0] if debtor_fio and len(debtor_fio.split()) > 0 else "",
-                "Имя": debtor_fio.split()[1] if debtor_fio and len(debtor_fio.split()) > 1 else "",
-                "Отчество": debtor_fio.split()[2] if debtor_fio and len(debtor_fio.split()) > 2 else "",
+                "Фамилия": фамилия,
+                "Имя": имя,
+                "Отчество": отчество,
                 "ИНН": debtor_inn,
                 "Снилс": debtor_snils,
                 "Адрес_регистрации_должника": debtor_address,
             })
             counter += 1
 
+        # Обязательные платежи (налоги, сборы) - в разделе 2 (2.1, 2.2, 2.3...)
+        tax_rows = [
+            {
+                "пп_обяз_платеж": f"2.{tax_counter}",
+                "Налог_сбор_или_иной_обяз_платеж": credit_table.creditor[index],
+                "Сумма_обяз_платежа": format_kopecks(credit_table.debt_kop[index]),
+                "Штрафы_пени_и_другое_обяз_платежа": format_kopecks(credit_table.penalties_kop[index]),
+            }
+            for tax_counter, index in enumerate(credit_table.rows(SECTION_TAX), start=1)
+        ]
+
         # Формируем результат
         result = {}
 
@@ -3560,15 +3778,31 @@ JSON:
         
         return normalized.strip()
     
+    @staticmethod
+    def _parse_contract_date(дата_договора: str) -> Optional[date]:
+        try:
+            return datetime.strptime(дата_договора, "%d.%m.%Y").date()
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _creditor_type(кредитор: str) -> str:
+        кредитор_lower = кредитор.lower()
+        if any(word in кредитор_lower for word in ["мфо", "мкк", "мфк", "микрофинанс", "микрокредит"]):
+            return "МФО"
+        return "БАНК"
+
     @staticmethod
     def merge_credit_reports(data_map: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
-        """Объединяет кредиты из ОКБ, БКИ, НБКИ отчетов, убирает дубликаты.
+        """Объединяет кредиты из ОКБ, БКИ, НБКИ отчетов и справок, убирает дубликаты.
 
-        Дедупликация по ИНН/ОГРН + дата договора (не только по названию кредитора).
+        Дубликаты ищет credit_linkage: блоки по кредитору/ИНН/ОГРН и месяцу
+        договора, оценка по дате, первоначальной сумме, долгу и номеру договора.
+        Из кластера берётся запись отчёта с большей суммой (более актуальные
+        данные), справка кредитора перекрывает сумму, если она больше.
         Возвращает список уникальных кредитов для таблицы "Список кредиторов".
         """
-        all_credits = {}  # {ключ_дедупликации: данные_кредита}
-        seen_keys = set()  # для отладки
+        records: List[CreditRecord] = []
 
         print("\n" + "="*80)
         print("ДЕДУПЛИКАЦИЯ КРЕДИТОВ")
@@ -3577,7 +3811,7 @@ JSON:
         for key in ("отчет_окб", "отчет_бки", "отчет_нбки"):
             reports_count = len(data_map.get(key, []))
             if reports_count > 0:
-                print(f"\n📄 Обработка отчета: {key.upper()} ({reports_count} шт.)")
+                print(f"📄 Обработка отчета: {key.upper()} ({reports_count} шт.)")
             
             for report in data_map.get(key, []):
                 collection = (
@@ -3593,19 +3827,9 @@ JSON:
                     кредитор = (entry.get("Кредитор") or "").strip()
                     if not кредитор:
                         continue
-                    
-                    print(f"\n   → Извлечен: {кредитор}")
 
-                    # УЛУЧШЕННАЯ НОРМАЛИЗАЦИЯ: используем новую функцию
                     кредитор_normalized, кредитор_canonical = DocumentProcessor.normalize_bank_name(кредитор)
 
-                    # Определяем тип кредитора
-                    кредитор_lower = кредитор.lower()
-                    if any(word in кредитор_lower for word in ["мфо", "мкк", "мфк", "микрофинанс", "микрокредит"]):
-                        тип_кредитора = "МФО"
-                    else:
-                        тип_кредитора = "БАНК"
-
                     # Вычисляем сумму долга
                     основной = DocumentProcessor.parse_decimal(entry.get("Основной_долг"))
                     проценты = DocumentProcessor.parse_decimal(entry.get("Проценты"))
@@ -3629,101 +3853,34 @@ JSON:
                     if сумма <= 0:
                         continue
 
-                    # === ЛОГИКА ДЕДУПЛИКАЦИИ: НАЗВАНИЕ + ДАТА ДОГОВОРА + ПЕРВОНАЧАЛЬНАЯ СУММА ===
-                    # Извлекаем дату договора из разных полей
-                    дата_договора_raw = (entry.get("Дата_сделки") or entry.get("Дата_начала_договора") or entry.get("Дата_договора") or "").strip()
-                    
                     # НОРМАЛИЗУЕМ ДАТУ: 09-09-2009 → 09.09.2009
+                    дата_договора_raw = (entry.get("Дата_сделки") or entry.get("Дата_начала_договора") or entry.get("Дата_договора") or "").strip()
                     дата_договора = DocumentProcessor.normalize_date(дата_договора_raw)
                     
-                    # Извлекаем ИНН/ОГРН для сохранения (но не для дедупликации)
                     инн = (entry.get("ИНН_кредитора") or entry.get("ИНН") or "").strip()
                     огрн = (entry.get("ОГРН_кредитора") or entry.get("ОГРН") or "").strip()
                     
                     # Первоначальная сумма кредита (сколько взяли изначально)
                     сумма_обязательства = DocumentProcessor.parse_decimal(entry.get("Сумма_обязательства")) or Decimal(0)
-                    
-                    print(f"      • Дата договора: {дата_договора or 'НЕТ'} (исходная: {дата_договора_raw})")
-                    print(f"      • Сумма обязательства: {сумма_обязательства if сумма_обязательства > 0 else 'НЕТ'}")
-                    print(f"      • Текущий долг: {сумма}")
-
-                    # Формируем ключ дедупликации:
-                    # КЛЮЧ: кредитор + дата + первоначальная сумма (БЕЗ текущей суммы долга!)
-                    # Текущая сумма долга может отличаться в ОКБ и БКИ, поэтому не используем её в ключе
-                    if сумма_обязательства > 100:
-                        сумма_для_ключа = int(сумма_обязательства)
-                        dedup_key = f"{кредитор_normalized}|{дата_договора}|{сумма_для_ключа}"
-                    else:
-                        # Нет первоначальной суммы - используем текущий долг для различения
-                        текущая_сумма_для_ключа = f"{сумма:.2f}"
-                        dedup_key = f"{кредитор_normalized}|{дата_договора}|NO_INIT|{текущая_сумма_для_ключа}"
-                    
-                    # Проверяем дубликаты с учётом погрешности дат (±1 день)
-                    # Это нужно для случаев когда ОКБ и БКИ указывают разные даты для одного договора
-                    found_similar = False
-                    similar_key = None
-                    
-                    if дата_договора and сумма_обязательства > 100:
-                        from datetime import datetime, timedelta
-                        try:
-                            base_date = datetime.strptime(дата_договора, "%d.%m.%Y")
-                            # Проверяем ±1 день по кредитору + дата + первоначальная сумма
-                            for delta in [-1, 0, 1]:
-                                check_date = (base_date + timedelta(days=delta)).strftime("%d.%m.%Y")
-                                check_key = f"{кредитор_normalized}|{check_date}|{сумма_для_ключа}"
-                                if check_key in all_credits and check_key != dedup_key:
-                                    found_similar = True
-                                    similar_key = check_key
-                                    break
-                        except:
-                            pass
-
-                    # Проверяем, встречался ли уже такой кредит (точное совпадение или с погрешностью ±1 день)
-                    target_key = similar_key if found_similar else dedup_key
-                    
-                    if target_key in all_credits:
-                        # Дубликат найден — берём запись с большей суммой (более актуальные данные)
-                        existing_sum = all_credits[target_key].get("Сумма_задолженности", Decimal(0))
-                        if сумма > existing_sum:
-                            if found_similar and target_key != dedup_key:
-                                print(f"      ✓ ДУБЛИКАТ ±1день (обновлён): {existing_sum} → {сумма}")
-                            else:
-                                print(f"      ✓ ДУБЛИКАТ (обновлён): {existing_sum} → {сумма}")
-                            print(f"      Ключ: {target_key}")
-                            all_credits[target_key] = {
-                                "Кредитор": кредитор_canonical,
-                                "ИНН_кредитора": инн or None,
-                                "ОГРН_кредитора": огрн or None,
-                                "Дата_договора": дата_договора or None,
-                                "Сумма_обязательства": сумма_обязательства,
-                                "Сумма_задолженности": сумма,
-                                "Тип_кредитора": тип_кредитора,
-                                "Текущая_задолженность": текущая,
-                                "Текущая_просрочка": просрочка,
-                                "Основной_долг": основной,
-                                "Проценты": проценты,
-                                "Штрафы": штрафы,
-                                "Просрочка": просрочка,
-                                "Источник": key,
-                            }
-                        else:
-                            if found_similar and target_key != dedup_key:
-                                print(f"      ✓ ДУБЛИКАТ ±1день (пропущен): {сумма} <= {existing_sum}")
-                            else:
-                                print(f"      ✓ ДУБЛИКАТ (пропущен): {сумма} <= {existing_sum}")
-                            print(f"      Ключ: {target_key}")
-                    else:
-                        # Новый кредит — добавляем
-                        print(f"      ✓ НОВЫЙ кредит добавлен")
-                        print(f"      Ключ: {dedup_key}")
-                        all_credits[dedup_key] = {
+
+                    records.append(CreditRecord(
+                        source=key,
+                        creditor_key=normalize_org_name(кредитор_canonical) or кредитор_normalized,
+                        name=кредитор,
+                        inn=инн,
+                        ogrn=огрн,
+                        contract_date=DocumentProcessor._parse_contract_date(дата_договора),
+                        contract_number=normalize_contract_number(entry.get("Номер_договора")),
+                        original_amount=сумма_обязательства,
+                        debt=сумма,
+                        payload={
                             "Кредитор": кредитор_canonical,
                             "ИНН_кредитора": инн or None,
                             "ОГРН_кредитора": огрн or None,
                             "Дата_договора": дата_договора or None,
                             "Сумма_обязательства": сумма_обязательства,
                             "Сумма_задолженности": сумма,
-                            "Тип_кредитора": тип_кредитора,
+                            "Тип_кредитора": DocumentProcessor._creditor_type(кредитор),
                             "Текущая_задолженность": текущая,
                             "Текущая_просрочка": просрочка,
                             "Основной_долг": основной,
@@ -3731,9 +3888,10 @@ JSON:
                             "Штрафы": штрафы,
                             "Просрочка": просрочка,
                             "Источник": key,
-                        }
+                        },
+                    ))
 
-        # === ДОБАВЛЯЕМ СПРАВКИ О ЗАДОЛЖЕННОСТИ ===
+        # === СПРАВКИ О ЗАДОЛЖЕННОСТИ ===
         # Справки - это официальные документы от кредиторов с актуальной суммой долга
         for справка in data_map.get("справка_о_задолженности", []):
             кредитор = (справка.get("Кредитор") or "").strip()
@@ -3756,33 +3914,29 @@ JSON:
             if сумма <= 0:
                 continue
 
-            # Определяем тип кредитора
-            кредитор_lower = кредитор.lower()
-            if any(word in кредитор_lower for word in ["мфо", "мкк", "мфк", "микрофинанс", "микрокредит"]):
-                тип_кредитора = "МФО"
-            else:
-                тип_кредитора = "БАНК"
-
-            дата_договора = (справка.get("Дата_договора") or справка.get("Дата") or "").strip()
+            дата_договора = DocumentProcessor.normalize_date(
+                (справка.get("Дата_договора") or справка.get("Дата") or справка.get("Дата_возникновения") or "").strip()
+            )
             инн = (справка.get("ИНН") or "").strip()
             огрн = (справка.get("ОГРН") or "").strip()
-            
-            # Для справок используем текущую сумму долга в ключе
-            сумма_для_ключа = int(сумма) if сумма else 0
 
-            # Ключ дедупликации: название + дата + текущая сумма
-            dedup_key = f"{кредитор_normalized}|{дата_договора}|{сумма_для_ключа}"
-
-            # Справки имеют приоритет - они содержат актуальные данные от кредитора
-            if dedup_key not in all_credits:
-                print(f"      [СПРАВКА] Добавлен {кредитор_canonical}: {сумма} руб. (дата: {дата_договора})")
-                all_credits[dedup_key] = {
+            records.append(CreditRecord(
+                source="справка_о_задолженности",
+                creditor_key=normalize_org_name(кредитор_canonical) or кредитор_normalized,
+                name=кредитор,
+                inn=инн,
+                ogrn=огрн,
+                contract_date=DocumentProcessor._parse_contract_date(дата_договора),
+                contract_number=normalize_contract_number(справка.get("Номер_договора")),
+                debt=сумма,
+                is_statement=True,
+                payload={
                     "Кредитор": кредитор_canonical,
                     "ИНН_кредитора": инн or None,
                     "ОГРН_кредитора": огрн or None,
                     "Дата_договора": дата_договора or None,
                     "Сумма_задолженности": сумма,
-                    "Тип_кредитора": тип_кредитора,
+                    "Тип_кредитора": DocumentProcessor._creditor_type(кредитор),
                     "Текущая_задолженность": DocumentProcessor.parse_decimal(справка.get("Основной_долг")),
                     "Текущая_просрочка": None,
                     "Основной_долг": DocumentProcessor.parse_decimal(справка.get("Основной_долг")),
@@ -3790,26 +3944,148 @@ JSON:
                     "Штрафы": DocumentProcessor.parse_decimal(справка.get("Штрафы")),
                     "Просрочка": None,
                     "Источник": "справка_о_задолженности",
-                }
-            else:
-                # Если уже есть в отчетах, обновляем если сумма больше (справка актуальнее)
-                existing_sum = all_credits[dedup_key].get("Сумма_задолженности", Decimal(0))
-                if сумма > existing_sum:
-                    print(f"      [СПРАВКА] Обновление {кредитор_canonical}: {existing_sum} → {сумма} руб.")
-                    all_credits[dedup_key]["Сумма_задолженности"] = сумма
-                    all_credits[dedup_key]["Источник"] = "справка_о_задолженности"
+                },
+            ))
+
+        linkage = link_credits(records)
+        for decision in linkage.decisions:
+            left, right = records[decision.left], records[decision.right]
+            print(f"   ✓ ДУБЛИКАТ: {left.payload['Кредитор']} ({left.source}, {left.debt}) = "
+                  f"{right.payload['Кредитор']} ({right.source}, {right.debt}): {decision.explain()}")
+
+        merged = []
+        for cluster in linkage.clusters:
+            members = [records[index] for index in cluster]
+            reports = [record for record in members if not record.is_statement] or members
+            # Запись отчёта с большей суммой (при равенстве - первая)
+            best = max(reports, key=lambda record: record.debt)
+            credit = dict(best.payload)
+            # Исходные написания кредитора (для словаря названий кредиторов)
+            credit["Исходные_названия"] = list(dict.fromkeys(record.name for record in members))
+            # Реквизиты, которых нет в выбранной записи, берём из дубликатов
+            for field_name in ("ИНН_кредитора", "ОГРН_кредитора", "Дата_договора"):
+                if not credit.get(field_name):
+                    credit[field_name] = next((r.payload[field_name] for r in members if r.payload.get(field_name)), None)
+            # Справка кредитора актуальнее отчёта, если в ней сумма больше
+            for record in members:
+                if record.is_statement and record is not best and record.debt > credit["Сумма_задолженности"]:
+                    credit["Сумма_задолженности"] = record.debt
+                    credit["Источник"] = record.source
+            merged.append(credit)
 
         # Сортируем по убыванию суммы
-        result = sorted(all_credits.values(), key=lambda x: x["Сумма_задолженности"], reverse=True)
+        result = sorted(merged, key=lambda x: x["Сумма_задолженности"], reverse=True)
         
-        print("\n" + "="*80)
-        print(f"ИТОГО УНИКАЛЬНЫХ КРЕДИТОВ: {len(result)}")
+        print("="*80)
+        print(f"ИТОГО УНИКАЛЬНЫХ КРЕДИТОВ: {len(result)} из {len(records)} записей "
+              f"(сравнений: {linkage.comparisons})")
         print("="*80)
         
         return result
 
     @staticmethod
-    def calculate_total_debt(data_map: Dict[str, List[Dict[str, Any]]]) -> Optional[Decimal]:
+    def build_credit_table(data_map: Dict[str, List[Dict[str, Any]]]) -> CreditTable:
+        """Таблица всех долгов должника (суммы в копейках), строится один раз на дело.
+
+        1. Кредиты из отчётов и справок после дедупликации (merge_credit_reports)
+        2. Постановления приставов: налоги - в раздел 2, остальные долги - в раздел 1
+        3. Налоги из налоговых уведомлений
+        """
+        table = CreditTable()
+
+        for credit in DocumentProcessor.merge_credit_reports(data_map):
+            кредитор_normalized, кредитор_canonical = DocumentProcessor.normalize_bank_name(credit["Кредитор"])
+            table.append(
+                SECTION_CREDIT,
+                кредитор_canonical,
+                to_kopecks(credit["Сумма_задолженности"]),
+                group_key=кредитор_normalized,
+                inn=credit.get("ИНН_кредитора") or "",
+                ogrn=credit.get("ОГРН_кредитора") or "",
+                address=credit.get("Адрес") or credit.get("Адрес_кредитора") or "",
+                kind=credit.get("Вид") or credit.get("Тип_кредита") or "Потребительский кредит",
+                contract=credit.get("Дата_договора") or "",
+                source=credit.get("Источник") or "",
+                original_kop=to_kopecks(credit.get("Сумма_обязательства")),
+                aliases=credit.get("Исходные_названия") or (),
+            )
+
+        for постановление in data_map.get("постановление_пристава", []):
+            взыскатель = (постановление.get("Взыскатель") or "").strip()
+            взыскатель_lower = взыскатель.lower()
+
+            сумма_str = постановление.get("Итого_взыскание") or постановление.get("Сумма_долга") or ""
+            сумма = DocumentProcessor.parse_decimal(сумма_str) or Decimal(0)
+            if сумма <= 0:
+                continue
+
+            if any(kw in взыскатель_lower for kw in ["налог", "ифнс", "фнс", "инспекция федеральной налоговой службы"]):
+                table.append(SECTION_TAX, взыскатель, to_kopecks(сумма), source="постановление_пристава")
+                continue
+
+            # Предмет исполнения (тип долга)
+            предмет = постановление.get("Предмет_исполнения") or "Взыскание по постановлению ФССП"
+            дата_ип = постановление.get("Дата_постановления") or постановление.get("Дата_возбуждения") or постановление.get("Дата") or ""
+
+            # Адрес взыскателя: очищаем лишние запятые и пробелы
+            адрес_взыскателя = постановление.get("Адрес_взыскателя") or ""
+            if адрес_взыскателя:
+                адрес_взыскателя = ", ".join(filter(None, [x.strip() for x in адрес_взыскателя.split(",")]))
+
+            # Информация об органе, выдавшем документ + номер дела (в поле "Дата_договора")
+            орган = постановление.get("Орган_выдавший") or ""
+            адрес_органа = постановление.get("Адрес_органа") or ""
+            номер_дела = постановление.get("Номер_дела") or ""
+            дата_display = []
+            if орган:
+                дата_display.append(", ".join(filter(None, [x.strip() for x in орган.split(",")])))
+            if адрес_органа:
+                адрес_органа_clean = ", ".join(filter(None, [x.strip() for x in адрес_органа.split(",")]))
+                дата_display.append(f"Адрес: {адрес_органа_clean}")
+            if номер_дела:
+                дата_display.append(f"по делу № {номер_дела}")
+
+            # Нормализуем название взыскателя
+            взыскатель_normalized = (
+                взыскатель
+                .replace("Общество с ограниченной ответственностью", "ООО")
+                .replace("ОБЩЕСТВО С ОГРАНИЧЕННОЙ ОТВЕТСТВЕННОСТЬЮ", "ООО")
+                .replace("Публичное акционерное общество", "ПАО")
+                .replace("ПУБЛИЧНОЕ АКЦИОНЕРНОЕ ОБЩЕСТВО", "ПАО")
+                .replace("Акционерное общество", "АО")
+                .replace("АКЦИОНЕРНОЕ ОБЩЕСТВО", "АО")
+                .replace('"', '')
+                .strip()
+            )
+
+            table.append(
+                SECTION_OTHER,
+                взыскатель_normalized,
+                to_kopecks(сумма),
+                address=адрес_взыскателя,
+                kind=предмет,
+                contract=" ".join(дата_display) if дата_display else дата_ип,
+                source="постановление_пристава",
+            )
+
+        for уведомление in data_map.get("налоговое_уведомление", []):
+            for налог in уведомление.get("Налоги", []):
+                if not isinstance(налог, dict):
+                    continue
+
+                сумма = DocumentProcessor.parse_decimal(налог.get("Сумма")) or Decimal(0)
+                if сумма <= 0:
+                    continue
+
+                вид = налог.get("Вид", "Налог")
+                период = налог.get("Период", "")
+                название = f"{вид} за {период} г." if период else вид
+                table.append(SECTION_TAX, название, to_kopecks(сумма), kind=вид, source="налоговое_уведомление")
+
+        return table
+
+    @staticmethod
+    def calculate_total_debt(data_map: Dict[str, List[Dict[str, Any]]], credit_table: Optional[CreditTable] = None) -> Optional[Decimal]:
         """Рассчитывает общую сумму долга из ВСЕХ источников.
 
         Источники задолженности:
@@ -3824,29 +4100,19 @@ JSON:
         total = Decimal(0)
         has_value = False
 
-        # === 1. КРЕДИТНЫЕ ОТЧЕТЫ (ОКБ + БКИ) ===
-        # Объединяем все уникальные кредиты из обоих отчетов
-        merged_credits = DocumentProcessor.merge_credit_reports(data_map)
+        if credit_table is None:
+            credit_table = DocumentProcessor.build_credit_table(data_map)
 
-        if merged_credits:
-            # Суммируем все уникальные кредиты
-            credits_total = sum(
-                credit.get("Сумма_задолженности", Decimal(0)) 
-                for credit in merged_credits
-            )
-            if credits_total > 0:
-                total += credits_total
-                has_value = True
-
-        # === 2. ПОСТАНОВЛЕНИЯ ПРИСТАВОВ ===
-        for постановление in data_map.get("постановление_пристава", []):
-            # Берем итоговую сумму взыскания
-            взыскание = постановление.get("Итого_взыскание") or постановление.get("Сумма_долга")
-            if взыскание:
-                parsed = DocumentProcessor.parse_decimal(взыскание)
-                if parsed and parsed > 0:
-                    total += parsed
-                    has_value = True
+        # === 1. КРЕДИТНЫЕ ОТЧЕТЫ (ОКБ + БКИ) и 2. ПОСТАНОВЛЕНИЯ ПРИСТАВОВ ===
+        # Уникальные кредиты после дедупликации и все взыскания по постановлениям
+        kopecks = sum(
+            credit_table.debt_kop[index]
+            for index in range(len(credit_table))
+            if credit_table.section[index] != SECTION_TAX or credit_table.source[index] == "постановление_пристава"
+        )
+        if kopecks > 0:
+            total += from_kopecks(kopecks)
+            has_value = True
 
         # === 3. НАЛОГОВЫЕ УВЕДОМЛЕНИЯ ===
         for уведомление in data_map.get("налоговое_уведомление", []):
@@ -4440,42 +4706,21 @@ JSON:
         if not адрес_прописки and credit_history:
             адрес_прописки = credit_history.get("Адрес_регистрации", "") or ""
 
+        # Таблица всех долгов: строится один раз, из неё строки таблицы кредиторов и общая сумма
+        credit_table = DocumentProcessor.build_credit_table(data_map)
+
         # Таблица кредиторов (передаем ФИО, ИНН, СНИЛС, адрес)
-        # ВАЖНО: формируем таблицу ПЕРЕД расчетом общей суммы долга
         creditors_table_data = DocumentProcessor.format_creditors_table(
             data_map, 
             debtor_fio=owner_fio,
             debtor_inn=inn_number,
             debtor_snils=snils_number,
-            debtor_address=адрес_прописки
+            debtor_address=адрес_прописки,
+            credit_table=credit_table,
         )
 
-        # НОВОЕ: Рассчитываем общую сумму долга из таблиц кредиторов и налогов
-        total_debt = Decimal(0)
-
-        # Суммируем долги из таблицы кредиторов (credits)
-        for credit in creditors_table_data.get("credits", []):
-            # Берем "Задолженность_в_том_числе" (текущая задолженность)
-            debt_str = credit.get("Задолженность_в_том_числе", "0")
-            debt_amount = DocumentProcessor.parse_decimal(debt_str) or Decimal(0)
-            total_debt += debt_amount
-
-            # Добавляем штрафы и пени
-            penalties_str = credit.get("Штрафы_пени_и_другое", "0")
-            penalties_amount = DocumentProcessor.parse_decimal(penalties_str) or Decimal(0)
-            total_debt += penalties_amount
-
-        # Суммируем долги из таблицы налогов (taxes)
-        for tax in creditors_table_data.get("taxes", []):
-            # Берем сумму обязательного платежа
-            tax_str = tax.get("Сумма_обяз_платежа", "0")
-            tax_amount = DocumentProcessor.parse_decimal(tax_str) or Decimal(0)
-            total_debt += tax_amount
-
-            # Добавляем штрафы и пени по налогам
-            tax_penalties_str = tax.get("Штрафы_пени_и_другое_обяз_платежа", "0")
-            tax_penalties_amount = DocumentProcessor.parse_decimal(tax_penalties_str) or Decimal(0)
-            total_debt += tax_penalties_amount
+        # Общая сумма долга: кредиты, иные долги и налоги (долг + штрафы), без разбора строк таблицы
+        total_debt = from_kopecks(credit_table.total_kop())
 
         # === ПАСПОРТНЫЕ ДАННЫЕ (с fallback на ОКБ) ===
         # Приоритет: паспорт > ОКБ
@@ -4706,145 +4951,117 @@ JSON:
             return obj
 
     @staticmethod
-    def merge_table_cells_for_creditors(doc_path: Path, credits_data: List[Dict]) -> None:
-        """Объединяет ячейки в таблице кредиторов для одного кредитора с несколькими договорами."""
-        from docx import Document
-        from docx.oxml import parse_xml
-        from docx.oxml.ns import nsdecls
-        
-        doc = Document(doc_path)
-        
+    def merge_table_cells_for_creditors(doc, credits_data: List[Dict]) -> int:
+        """Объединяет ячейки в таблице кредиторов для одного кредитора с несколькими договорами.
+
+        Работает с документом в памяти (python-docx Document, например
+        DocxTemplate.docx после render) до его сохранения - файл не
+        открывается и не пересохраняется повторно.
+
+        Returns:
+            Количество объединённых групп строк
+        """
         # Ищем таблицу кредиторов — 9 столбцов и есть "Кредитор" в первых 4 строках
         target_table = None
         for table_idx, table in enumerate(doc.tables):
-            if len(table.rows) > 2 and len(table.columns) == 9:
-                # Проверяем первые 4 строки на наличие "Кредитор"
-                found_kreditor = False
-                for row_idx in range(min(4, len(table.rows))):
-                    row_text = ' '.join(cell.text for cell in table.rows[row_idx].cells)
-                    if "Кредитор" in row_text:
-                        found_kreditor = True
-                        break
-                
-                if found_kreditor:
+            rows = table.rows
+            if len(rows) > 2 and len(table.columns) == 9:
+                if any("Кредитор" in ' '.join(cell.text for cell in rows[row_idx].cells)
+                       for row_idx in range(min(4, len(rows)))):
                     target_table = table
-                    print(f"      [MERGE] Найдена таблица кредиторов: таблица #{table_idx}, строк: {len(table.rows)}, столбцов: {len(table.columns)}")
                     break
-        
+
         if not target_table:
             print(f"      [MERGE] Таблица кредиторов не найдена")
-            return
-        
+            return 0
+
+        # Ячейки и тексты строк - один проход по таблице
+        row_cells = [row.cells for row in target_table.rows]
+        row_texts = [[cell.text for cell in cells] for cells in row_cells]
+
         # Находим первую строку данных (пропускаем заголовки)
         data_start_row = 0
-        data_end_row = len(target_table.rows) - 1
-        
-        for row_idx, row in enumerate(target_table.rows):
+        data_end_row = len(row_cells) - 1
+
+        for row_idx, texts in enumerate(row_texts):
             # Ищем первую строку где есть № п/п но это не заголовок
-            if row_idx > 0 and row.cells[0].text.strip() and row.cells[0].text.strip() != '№ п/п' and row.cells[0].text.strip() != '№\nп/п':
+            first = texts[0].strip()
+            if row_idx > 0 and first and first != '№ п/п' and first != '№\nп/п':
                 # Проверяем, есть ли "1.1" или похожее в столбце 0
-                if '.' in row.cells[0].text or row.cells[0].text.strip() == '':
+                if '.' in texts[0]:
                     data_start_row = row_idx
                     break
-        
+
         # Находим конец раздела кредиторов (до начала "Обязательные платежи")
-        for row_idx in range(data_start_row, len(target_table.rows)):
-            row_text = ' '.join(cell.text for cell in target_table.rows[row_idx].cells).lower()
+        for row_idx in range(data_start_row, len(row_texts)):
+            row_text = ' '.join(row_texts[row_idx]).lower()
             if 'обязательные платежи' in row_text or 'налог' in row_text:
                 data_end_row = row_idx - 1
                 break
-        
+
         if data_start_row == 0:
-            return
-        
-        # Строим группы: для каждого кредитора находим строки в таблице с его договорами
-        # Группируем по № п/п в столбце 0 (например "1.1", "1.2" и т.д.)
+            return 0
+
+        # Группируем по № п/п в столбце 0 (например "1.1", "1.2"): строки с пустым
+        # № п/п продолжают группу предыдущего кредитора
         creditor_groups = []  # [(first_row, last_row), ...]
-        current_pp = None
         first_row_of_group = None
-        
-        print(f"      [MERGE] Анализ строк от {data_start_row} до {data_end_row}...")
-        
         for row_idx in range(data_start_row, data_end_row + 1):
-            pp_text = target_table.rows[row_idx].cells[0].text.strip()
-            print(f"      [MERGE]   Строка {row_idx}: № п/п = '{pp_text}'")
-            
-            # Если это новый № п/п (не пустой)
+            pp_text = row_texts[row_idx][0].strip()
             if pp_text and '.' in pp_text:
-                # Закрываем предыдущую группу
-                if current_pp is not None and first_row_of_group is not None:
-                    if row_idx - first_row_of_group > 1:  # Группа больше 1 строки
-                        creditor_groups.append((first_row_of_group, row_idx - 1))
-                        print(f"      [MERGE]     → Сохранена группа '{current_pp}': строки {first_row_of_group} - {row_idx - 1}")
-                
-                # Начинаем новую группу
-                current_pp = pp_text
+                if first_row_of_group is not None and row_idx - first_row_of_group > 1:
+                    creditor_groups.append((first_row_of_group, row_idx - 1))
                 first_row_of_group = row_idx
-            
-            # Если это пустой № п/п, продолжаем текущую группу
-            elif not pp_text and current_pp is not None:
-                pass  # Группа продолжается
-        
-        # Закрываем последнюю группу
-        if current_pp is not None and first_row_of_group is not None:
-            if data_end_row - first_row_of_group >= 1:  # Группа больше 1 строки
-                creditor_groups.append((first_row_of_group, data_end_row))
-                print(f"      [MERGE]     → Сохранена последняя группа '{current_pp}': строки {first_row_of_group} - {data_end_row}")
-        
-        print(f"      [MERGE] Найдено групп для объединения: {len(creditor_groups)}")
-        
-        # Объединяем ячейки для каждой группы
+        if first_row_of_group is not None and data_end_row - first_row_of_group >= 1:
+            creditor_groups.append((first_row_of_group, data_end_row))
+
         # Столбцы для объединения: 0 (№ п/п), 2 (Кредитор), 3-4 (Адрес - два столбца)
         columns_to_merge = [0, 2, 3, 4]
-        
+
         for first_row_idx, last_row_idx in creditor_groups:
-            print(f"      [MERGE] Объединяем группу: строки {first_row_idx} - {last_row_idx}")
-            
-            for col_idx in columns_to_merge:
-                if col_idx >= len(target_table.columns):
-                    continue
-                
-                try:
-                    # Устанавливаем vMerge для первой ячейки
-                    first_cell = target_table.rows[first_row_idx].cells[col_idx]
-                    first_cell_xml = first_cell._element.get_or_add_tcPr()
-                    vmerge = parse_xml(f'<w:vMerge {nsdecls("w")} w:val="restart"/>')
-                    first_cell_xml.append(vmerge)
-                    
-                    # Устанавливаем vMerge для остальных ячеек группы
-                    for row_idx in range(first_row_idx + 1, last_row_idx + 1):
-                        if row_idx >= len(target_table.rows):
-                            break
-                        cell = target_table.rows[row_idx].cells[col_idx]
-                        cell_xml = cell._element.get_or_add_tcPr()
-                        vmerge_continue = parse_xml(f'<w:vMerge {nsdecls("w")}/>')
-                        cell_xml.append(vmerge_continue)
-                except Exception as e:
-                    print(f"          [DEBUG] Ошибка объединения столбца {col_idx}: {e}")
-        
-        doc.save(doc_path)
+            for row_idx in range(first_row_idx, last_row_idx + 1):
+                # Столбцы 3-4 могут быть одной ячейкой с gridSpan - vMerge ей нужен один
+                cells = {}
+                for col_idx in columns_to_merge:
+                    if col_idx < len(row_cells[row_idx]):
+                        cell = row_cells[row_idx][col_idx]
+                        cells.setdefault(id(cell._element), cell)
+                # Сеттер python-docx ставит w:vMerge на место по схеме (до tcBorders/vAlign)
+                for cell in cells.values():
+                    cell._element.vMerge = 'restart' if row_idx == first_row_idx else 'continue'
+
+        print(f"      [MERGE] Таблица кредиторов: строки {data_start_row}-{data_end_row}, "
+              f"объединено групп: {len(creditor_groups)} {creditor_groups}")
+        return len(creditor_groups)
 
     @staticmethod
-    def fill_docx_template_dynamic(template_path: Path, output_path: Path, context: Dict[str, Any]) -> None:
-        """Заполняет Word шаблон с поддержкой динамических таблиц (Jinja2)."""
-        doc = DocxTemplate(template_path)
+    def fill_docx_template_dynamic(template_path: Path, output_path: Path, context: Dict[str, Any]) -> float:
+        """Заполняет Word шаблон с поддержкой динамических таблиц (Jinja2).
 
-        # Рендерим шаблон с контекстом
-        doc.render(context)
+        Шаблон берётся из кэша процесса (template_cache): разбор docx, patch_xml
+        и компиляция Jinja выполняются один раз на версию файла.
 
-        # Создаем папку если нужно
-        output_path.parent.mkdir(parents=True, exist_ok=True)
+        Returns:
+            Оценка времени, сэкономленного кэшем шаблонов (секунды)
+        """
+        # Рендерим шаблон с контекстом
+        doc, saved_seconds = render_template(template_path, context)
 
-        # Сохраняем результат
-        doc.save(output_path)
-        
-        # Если это список кредиторов, объединяем ячейки
+        # Если это список кредиторов, объединяем ячейки до сохранения
         if "Список кредиторов" in str(template_path) and "credits" in context:
             try:
-                DocumentProcessor.merge_table_cells_for_creditors(output_path, context["credits"])
+                DocumentProcessor.merge_table_cells_for_creditors(doc.docx, context["credits"])
             except Exception as e:
                 print(f"      [WARNING] Не удалось объединить ячейки: {e}")
 
+        # Создаем папку если нужно
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Сохраняем результат (один раз)
+        doc.save(output_path)
+
+        return saved_seconds
+
     @staticmethod
     def fill_docx_template(template_path: Path, output_path: Path, context: Dict[str, str]) -> None:
         """Старая функция для простых шаблонов без динамических таблиц."""
@@ -4854,71 +5071,53 @@ JSON:
             if not isinstance(v, (list, dict)) or k in []
         }
 
-        with zipfile.ZipFile(template_path, "r") as template_zip:
-            xml = template_zip.read("word/document.xml").decode("utf-8")
-
-        # Нормализуем XML: убираем разрывы внутри фигурных скобок {{...}}
-        # Word может разбить {{Ключ}} на несколько тегов, что ломает замену
-        import re
+        # Значения в XML; {{LINE_BREAK}} внутри значений тоже становится переносом строки
+        replacements = {
+            key: (str(value) if value is not None else "").replace("{{LINE_BREAK}}", _LINE_BREAK_XML)
+            for key, value in filtered_context.items()
+        }
 
-        # Паттерн для поиска {{ключ}}, разбитых на части
-        # Находим {, затем любые символы и теги до }
-        pattern = r'\{\{([^}]*)\}\}'
-
-        def normalize_key(match):
-            # Извлекаем всё между {{ и }}
-            inner = match.group(1)
-            # Удаляем все XML теги внутри
-            clean = re.sub(r'<[^>]+>', '', inner)
-            # Убираем неразрывные пробелы и лишние пробелы по бокам
-            clean = clean.replace('\u00A0', ' ').strip()
-            # Возвращаем нормализованный ключ
-            return f"{{{{{clean}}}}}"
-
-        xml = re.sub(pattern, normalize_key, xml, flags=re.DOTALL)
-
-        # Теперь делаем замену (используем отфильтрованный контекст)
-        for key, value in filtered_context.items():
-            # Приводим значение к строке, чтобы корректно вставлять в XML
-            replacement = str(value) if value is not None else ""
-            xml = xml.replace(f"{{{{{key}}}}}", replacement)
-
-        # Заменяем {{LINE_BREAK}} на простой перенос строки в Word
-        # Используем <w:br/> для переноса строки внутри одного параграфа
-        # Это сохраняет ВСЕ форматирование параграфа (шрифт, размер, интервалы, отступы)
-        line_break_xml = '</w:t><w:br/><w:t xml:space="preserve">'
-        xml = xml.replace("{{LINE_BREAK}}", line_break_xml)
+        def substitute(match):
+            # Word может разбить {{Ключ}} на несколько тегов: убираем теги и
+            # неразрывные пробелы, затем один поиск в словаре
+            key = placeholder_key(match.group(1))
+            if key in replacements:
+                return replacements[key]
+            if key == "LINE_BREAK":
+                return _LINE_BREAK_XML
+            return f"{{{{{key}}}}}"
 
         output_path.parent.mkdir(parents=True, exist_ok=True)
         with zipfile.ZipFile(template_path, "r") as template_zip, zipfile.ZipFile(
             output_path, "w"
         ) as output_zip:
             for item in template_zip.infolist():
-                data = template_zip.read(item.filename)
+                data = template_zip.read(item)
                 if item.filename == "word/document.xml":
-                    data = xml.encode("utf-8")
+                    # Один проход по документу вместо replace на каждый ключ
+                    data = PLACEHOLDER_RE.sub(substitute, data.decode("utf-8")).encode("utf-8")
                 output_zip.writestr(item, data)
 
     @staticmethod
-    def fill_template(template_path: Path, output_path: Path, context: Dict[str, Any]) -> None:
+    def fill_template(template_path: Path, output_path: Path, context: Dict[str, Any]) -> float:
         """Compatibility wrapper used by `app.py`.
 
         Tries to render the template as a dynamic Jinja2/DocxTemplate first,
         and falls back to the older XML-replacement implementation if needed.
+        Returns the render time saved by the template cache (seconds).
         """
         # Ensure context has no None values to avoid literal 'None' in documents
         safe_context = DocumentProcessor.replace_none_with_empty(context)
 
         # First try dynamic rendering
         try:
-            DocumentProcessor.fill_docx_template_dynamic(template_path, output_path, safe_context)
-            return
+            return DocumentProcessor.fill_docx_template_dynamic(template_path, output_path, safe_context)
         except Exception as e_dynamic:
             # Fallback to simple XML replacement
             try:
                 print(f"      INFO - Dynamic render failed for {template_path.name}: {e_dynamic}. Falling back to simple replacement.")
                 DocumentProcessor.fill_docx_template(template_path, output_path, safe_context)
-                return
+                return 0.0
             except Exception as e_simple:
                 # Re-raise a combined error to help debugging
                 raise RuntimeError(f"Both dynamic and simple template rendering failed for {template_path}: dynamic_error={e_dynamic}, simple_error={e_simple}")
@@ -4951,6 +5150,7 @@ JSON:
             
         output_dir.mkdir(parents=True, exist_ok=True)
         generated_files = []
+        saved_seconds = 0.0
 
         templates = [
             {
@@ -4993,6 +5193,8 @@ JSON:
             "Опись имущества.docx",
         ]
 
+        jobs = []
+        names = []
         for idx, item in enumerate(templates):
             # Resolve template path: prefer templ/<lawyer>/<filename> if lawyer provided
             filename = template_filenames[idx]
@@ -5006,8 +5208,6 @@ JSON:
                 if p.exists():
                     template_path = p
                     break
-            output_path = item["output"]
-            is_dynamic = item.get("dynamic", False)
 
             if not template_path or not template_path.exists():
                 # No template found for this item (neither lawyer-specific nor default)
@@ -5017,21 +5217,24 @@ JSON:
                 continue
             else:
                 print(f"      INFO - Using template for '{item['name']}': {template_path}")
+            jobs.append((template_path, item["output"]))
+            names.append(item["name"])
+
+        # Use compatibility wrapper that first tries DocxTemplate (dynamic rendering)
+        # and falls back to simple XML replacement. This handles placeholders
+        # that Word splits across multiple runs. Templates render in parallel
+        # (RENDER_WORKERS processes), results come back in template order.
+        for name, result in zip(names, render_document_set(jobs, context)):
+            if isinstance(result.error, PermissionError):
+                print(f"      WARNING - File is open: {result.output_path.name}")
+            elif result.error is not None:
+                print(f"      ERROR generating {name}: {result.error}")
+            else:
+                saved_seconds += result.saved_seconds
+                generated_files.append(result.output_path)
 
-            try:
-                # Use compatibility wrapper that first tries DocxTemplate (dynamic rendering)
-                # and falls back to simple XML replacement. This handles placeholders
-                # that Word splits across multiple runs.
-                DocumentProcessor.fill_template(template_path, output_path, context)
-
-                generated_files.append(output_path)
-            except PermissionError:
-                print(f"      WARNING - File is open: {output_path.name}")
-                continue
-            except Exception as e:
-                print(f"      ERROR generating {item['name']}: {e}")
-                continue
-
+        if saved_seconds:
+            print(f"      INFO - Template cache saved ~{saved_seconds * 1000:.0f} ms of rendering")
         return generated_files
 
     @staticmethod
@@ -5224,8 +5427,12 @@ JSON:
         except Exception as exc:
             return {"error": str(exc)}, str(exc)
 
-    def process_pdf(self, pdf_path: Path) -> DocumentOutput:
-        """Process PDF document with all pages at once using GPT-5 Vision."""
+    def process_pdf(self, pdf_path: Path, checkpoint: Optional[Any] = None) -> DocumentOutput:
+        """Process PDF document with all pages at once using GPT-5 Vision.
+
+        checkpoint - необязательный BatchCheckpoint (job_queue): уже обработанные
+        батчи кредитного отчёта берутся из него, новые сохраняются сразу после ответа GPT.
+        """
         pdf_path = pdf_path.resolve()
 
         # Сначала пробуем определить тип по имени файла
@@ -5292,6 +5499,7 @@ JSON:
                 all_credits = []
                 batch_num = 0
                 retry_smaller = False
+                total_batches = (len(page_images) + batch_size - 1) // batch_size
                 
                 for start_idx in range(0, len(page_images), batch_size):
                     end_idx = min(start_idx + batch_size, len(page_images))
@@ -5306,6 +5514,19 @@ JSON:
                         actual_start = start_idx + 1
                     
                     batch_num += 1
+                    batch_key = f"{actual_start}-{end_idx}"
+                    self._emit_progress(
+                        stage="batch", file=pdf_path.name, doc_type=doc_type,
+                        batch=batch_num, batches=max(total_batches, batch_num),
+                    )
+
+                    # Батч уже обработан до перезапуска задания - берём результат из чекпоинта
+                    if checkpoint is not None:
+                        cached_credits = checkpoint.load_batch(batch_key)
+                        if cached_credits is not None:
+                            all_credits.extend(cached_credits)
+                            print(f"         Батч {batch_num} ({batch_key})... CHECKPOINT ({len(cached_credits)} кредитов)")
+                            continue
                     
                     # Специальные промпты для разных типов отчетов
                     if doc_type == "отчет_окб":
@@ -5440,7 +5661,9 @@ JSON (СТРОГО этот формат):
                         else:
                             print(f"         Батч {batch_num} ({actual_start}-{end_idx})...", end=" ", flush=True)
                         
+                        batch_started = time.time()
                         response_text, error_code = self.process_images_with_gpt(batch_pages, batch_prompt)
+                        self._record_stage("llm_batch", doc_type, len(batch_pages), time.time() - batch_started)
                         
                         # Проверяем ошибки 400/500 - запрос слишком большой
                         if error_code in [400, 500]:
@@ -5481,6 +5704,8 @@ JSON (СТРОГО этот формат):
                                 batch_credits = batch_data["Кредиты"]
                                 all_credits.extend(batch_credits)
                                 print(f"OK ({len(batch_credits)} кредитов)")
+                                if checkpoint is not None:
+                                    checkpoint.save_batch(batch_key, batch_credits)
                                 
                                 # Логирование извлечённых кредитов
                                 if batch_credits:
@@ -5493,6 +5718,8 @@ JSON (СТРОГО этот формат):
                                         print(f"           {idx}. {creditor} | Дата: {date} | Начальная: {initial} | Долг: {debt}")
                             else:
                                 print("OK (0 кредитов)")
+                                if checkpoint is not None:
+                                    checkpoint.save_batch(batch_key, [])
                         except json.JSONDecodeError as json_err:
                             print(f"SKIP (JSON parse failed - likely no credits on these pages)")
                             print(f"         [DEBUG] Ответ GPT (первые 300 символов):")
@@ -5877,16 +6104,18 @@ JSON (СТРОГО этот формат):
             extracted_text=None,
         )
 
-    def process_batch(
+    def extract_documents(
         self,
         pdf_paths: Iterable[Path],
-        output_json: Optional[Path] = None,
-        debtor_id: Optional[str] = None,
-        lawyer: Optional[str] = None,
-    ) -> tuple[List[DocumentOutput], Dict[str, List[Dict[str, Any]]], List[Path]]:
+        checkpoints: Optional[Any] = None,
+    ) -> tuple[List[DocumentOutput], Dict[str, List[Dict[str, Any]]]]:
+        """Извлекает данные из PDF и группирует их по типу документа (без заполнения шаблонов).
+
+        checkpoints - необязательный JobCheckpointStore (job_queue): документы,
+        уже обработанные в прерванном запуске задания, не извлекаются повторно.
+        """
         results: List[DocumentOutput] = []
         aggregated: Dict[str, List[Dict[str, Any]]] = {}
-        pdf_list = list(pdf_paths)  # Конвертируем в список для повторного использования
 
         # Сортируем файлы: паспорт обрабатываем первым, потом остальные
         def sort_key(path: Path) -> tuple[int, str]:
@@ -5898,11 +6127,27 @@ JSON (СТРОГО этот формат):
             else:
                 return (1, path.name)  # остальные документы
 
-        sorted_pdf_list = sorted(pdf_list, key=sort_key)
-
-        for pdf in sorted_pdf_list:
+        sorted_pdf_list = sorted(pdf_paths, key=sort_key)
+
+        for file_index, pdf in enumerate(sorted_pdf_list, start=1):
+            self._emit_progress(stage="document", file=pdf.name, index=file_index, total=len(sorted_pdf_list))
+            if checkpoints is not None:
+                cached = checkpoints.load_document(pdf)
+                if cached is not None:
+                    result = DocumentOutput(**cached)
+                    print(f"   > {pdf.name}")
+                    print(f"      [CHECKPOINT] Уже обработан ранее, пропускаю ({result.document_type})")
+                    results.append(result)
+                    if not result.error and isinstance(result.data, dict) and "raw_output" not in result.data:
+                        aggregated.setdefault(result.document_type, []).append(result.data)
+                    continue
             try:
-                result = self.process_pdf(pdf)
+                if checkpoints is not None:
+                    result = self.process_pdf(pdf, checkpoint=checkpoints.for_document(pdf))
+                else:
+                    result = self.process_pdf(pdf)
+                if not result.error:
+                    self._record_stage("document", result.document_type, result.pages, result.processing_time_seconds)
             except Exception as exc:  # noqa: BLE001
                 result = DocumentOutput(
                     file=pdf.name,
@@ -5912,10 +6157,27 @@ JSON (СТРОГО этот формат):
                     data={},
                     error=str(exc),
                 )
+            # Чекпоинт сохраняем только для успешно обработанных документов,
+            # документы с ошибкой при перезапуске будут извлечены заново
+            if checkpoints is not None and not result.error:
+                checkpoints.save_document(pdf, result)
             results.append(result)
             if not result.error and isinstance(result.data, dict) and "raw_output" not in result.data:
                 aggregated.setdefault(result.document_type, []).append(result.data)
 
+        return results, aggregated
+
+    def render_documents(
+        self,
+        aggregated: Dict[str, List[Dict[str, Any]]],
+        pdf_list: List[Path],
+        output_json: Optional[Path] = None,
+        debtor_id: Optional[str] = None,
+        lawyer: Optional[str] = None,
+    ) -> List[Path]:
+        """Строит контекст шаблонов из aggregated, заполняет документы и сохраняет result.json."""
+        render_started = time.time()
+        self._emit_progress(stage="render")
         # Передаем список файлов для формирования приложений (используем исходный порядок для приложений)
         template_context = self.prepare_template_context(aggregated, pdf_list)
         filled_templates = self.generate_all_documents(template_context, debtor_id=debtor_id, lawyer=lawyer)
@@ -5927,8 +6189,57 @@ JSON (СТРОГО этот формат):
             serializable_context = self._make_json_serializable(normalized_context)
             with open(output_json, "w", encoding="utf-8") as handle:
                 json.dump(serializable_context, handle, ensure_ascii=False, indent=2)
+        self._record_stage("render", None, 0, time.time() - render_started)
+        return filled_templates
+
+    def process_batch(
+        self,
+        pdf_paths: Iterable[Path],
+        output_json: Optional[Path] = None,
+        debtor_id: Optional[str] = None,
+        lawyer: Optional[str] = None,
+        checkpoints: Optional[Any] = None,
+    ) -> tuple[List[DocumentOutput], Dict[str, List[Dict[str, Any]]], List[Path]]:
+        """Обрабатывает PDF и заполняет шаблоны (extract_documents + render_documents)."""
+        pdf_list = list(pdf_paths)  # Конвертируем в список для повторного использования
+        # Обновление реестров во время задачи не должно менять её результат на полпути
+        with DocumentProcessor.pinned_registries():
+            results, aggregated = self.extract_documents(pdf_list, checkpoints=checkpoints)
+            filled_templates = self.render_documents(
+                aggregated, pdf_list, output_json=output_json, debtor_id=debtor_id, lawyer=lawyer
+            )
         return results, aggregated, filled_templates
 
+    def process_additional_documents(
+        self,
+        new_pdf_paths: Iterable[Path],
+        aggregated: Dict[str, List[Dict[str, Any]]],
+        all_pdf_paths: Iterable[Path],
+        output_json: Optional[Path] = None,
+        debtor_id: Optional[str] = None,
+        lawyer: Optional[str] = None,
+        checkpoints: Optional[Any] = None,
+    ) -> tuple[List[DocumentOutput], Dict[str, List[Dict[str, Any]]], List[Path]]:
+        """Дозагрузка документов: извлекает данные только из новых файлов.
+
+        Результаты добавляются к ранее сохранённому aggregated (debtors.raw_data),
+        после чего контекст и все документы строятся заново по полному набору данных.
+        """
+        with DocumentProcessor.pinned_registries():
+            results, new_aggregated = self.extract_documents(list(new_pdf_paths), checkpoints=checkpoints)
+
+            merged: Dict[str, List[Dict[str, Any]]] = {
+                doc_type: list(items) for doc_type, items in (aggregated or {}).items()
+            }
+            for doc_type, items in new_aggregated.items():
+                merged.setdefault(doc_type, []).extend(items)
+            print(f"[APPEND] Новые данные: {list(new_aggregated.keys())}, итоговые типы: {list(merged.keys())}")
+
+            filled_templates = self.render_documents(
+                merged, list(all_pdf_paths), output_json=output_json, debtor_id=debtor_id, lawyer=lawyer
+            )
+        return results, merged, filled_templates
+
     @staticmethod
     def _make_json_serializable(obj: Any) -> Any:
         """Конвертирует RichText объекты и другие несериализуемые типы в строки."""
@@ -0,0 +1,360 @@
+"""
+Индексы для поиска по реестрам банков и МФО (BANK_REGISTRY / MFO_REGISTRY).
+
+Раньше get_bank_address / get_bank_inn для каждого кредитора перебирали весь
+реестр и проверяли вхождение каждого ключевого слова в название. Индекс
+строится один раз на версию реестра и даёт тот же результат отбора
+(ключевое слово - подстрока названия, порог 70% слов), но без полного перебора:
+
+- словарь токенов названий (по пробелам) -> записи реестра;
+- триграммы токенов -> токены, чтобы быстро найти токены, содержащие слово.
+
+Кандидаты ранжируются по доле совпавших слов, а при равенстве - по тому,
+какую часть названия покрывают найденные слова (более точное совпадение первым).
+
+IdentifierIndex - точный поиск по ИНН/ОГРН сразу в обоих реестрах
+(BANK_REGISTRY: ключ - ОГРН, ИНН в поле "инн"; MFO_REGISTRY: ключ - ИНН).
+
+TrigramIndex - нечёткий поиск по нормализованным названиям (коэффициент Дайса
+по символьным триграммам): устойчив к опечаткам OCR и не даёт коротким
+названиям совпадать с любым длинным, в которое они входят подстрокой.
+"""
+
+import heapq
+import re
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# Порог совпадения ключевых слов (как в исходном поиске по реестрам)
+KEYWORD_THRESHOLD = 0.7
+
+# Максимум закэшированных ключевых слов на индекс
+KEYWORD_CACHE_SIZE = 4096
+
+
+def _trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class RegistryIndex:
+    """Инвертированный индекс по названиям одного реестра."""
+
+    def __init__(self, registry: Dict[str, Dict[str, Any]]):
+        self.keys: List[str] = []
+        self.entries: List[Dict[str, Any]] = []
+        self.name_lengths: List[int] = []
+
+        token_ids: Dict[str, int] = {}
+        self.tokens: List[str] = []
+        self.token_entries: List[set] = []
+
+        for key, data in registry.items():
+            entry_id = len(self.keys)
+            self.keys.append(key)
+            self.entries.append(data)
+            name_tokens = str(data.get("название", "")).lower().split()
+            self.name_lengths.append(sum(len(token) for token in name_tokens))
+            for token in name_tokens:
+                token_id = token_ids.get(token)
+                if token_id is None:
+                    token_id = len(self.tokens)
+                    token_ids[token] = token_id
+                    self.tokens.append(token)
+                    self.token_entries.append(set())
+                self.token_entries[token_id].add(entry_id)
+
+        self._build_trigrams()
+        self._keyword_cache: Dict[str, frozenset] = {}
+
+    def _build_trigrams(self) -> None:
+        """Триграммы токенов -> токены (по уже заполненному self.tokens)."""
+        self.trigram_tokens: Dict[str, set] = {}
+        for token_id, token in enumerate(self.tokens):
+            for gram in _trigrams(token):
+                self.trigram_tokens.setdefault(gram, set()).add(token_id)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def entries_containing(self, keyword: str) -> frozenset:
+        """Записи, в названии которых keyword встречается как подстрока."""
+        cached = self._keyword_cache.get(keyword)
+        if cached is not None:
+            return cached
+
+        frozen = self._lookup_keyword(keyword)
+        if len(self._keyword_cache) >= KEYWORD_CACHE_SIZE:
+            self._keyword_cache.clear()
+        self._keyword_cache[keyword] = frozen
+        return frozen
+
+    def _lookup_keyword(self, keyword: str) -> frozenset:
+        if len(keyword) >= 3:
+            gram_sets = [self.trigram_tokens.get(gram) for gram in _trigrams(keyword)]
+            if any(gram_set is None for gram_set in gram_sets):
+                candidate_tokens: set = set()
+            else:
+                gram_sets.sort(key=len)
+                candidate_tokens = set(gram_sets[0]).intersection(*gram_sets[1:])
+        else:
+            candidate_tokens = set(range(len(self.tokens)))
+
+        result: set = set()
+        for token_id in candidate_tokens:
+            if keyword in self.tokens[token_id]:
+                result |= self.token_entries[token_id]
+        return frozenset(result)
+
+    def _name_length(self, entry_id: int) -> int:
+        return self.name_lengths[entry_id]
+
+    def _entry(self, entry_id: int) -> Tuple[str, Dict[str, Any]]:
+        return self.keys[entry_id], self.entries[entry_id]
+
+    def keyword_candidates(self, keywords: List[str], threshold: float = KEYWORD_THRESHOLD) -> List[Tuple[float, float, int]]:
+        """Записи, прошедшие порог, по убыванию качества: (доля слов, покрытие названия, id записи)."""
+        if not keywords:
+            return []
+
+        counts: Dict[int, int] = {}
+        covered: Dict[int, int] = {}
+        for keyword in keywords:
+            for entry_id in self.entries_containing(keyword):
+                counts[entry_id] = counts.get(entry_id, 0) + 1
+                covered[entry_id] = covered.get(entry_id, 0) + len(keyword)
+
+        required = len(keywords) * threshold
+        ranked = []
+        for entry_id, matches in counts.items():
+            if matches >= required:
+                name_length = self._name_length(entry_id)
+                coverage = min(covered[entry_id] / name_length, 1.0) if name_length else 0.0
+                ranked.append((matches / len(keywords), coverage, entry_id))
+        # Лучшие первыми; при полном равенстве - порядок записей в реестре
+        ranked.sort(key=lambda item: (-item[0], -item[1], item[2]))
+        return ranked
+
+    def best_keyword_match(
+        self,
+        keywords: List[str],
+        threshold: float = KEYWORD_THRESHOLD,
+        predicate: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    ) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Лучшая запись (ключ, данные), удовлетворяющая predicate (например, есть адрес)."""
+        for _, _, entry_id in self.keyword_candidates(keywords, threshold):
+            key, data = self._entry(entry_id)
+            if predicate is None or predicate(data):
+                return key, data
+        return None
+
+
+# Индексы строятся один раз на версию реестра: при замене словаря
+# (новый объект) или изменении его размера индекс перестраивается
+_index_cache: Dict[int, Tuple[Dict[str, Any], int, RegistryIndex]] = {}
+
+
+def get_registry_index(registry: Dict[str, Dict[str, Any]]) -> RegistryIndex:
+    """Индекс для реестра (кэшируется по объекту реестра)."""
+    # Реестр из registry_store ищет по своим индексам в SQLite
+    if hasattr(registry, "keyword_index"):
+        return registry.keyword_index()
+
+    cached = _index_cache.get(id(registry))
+    if cached is not None and cached[0] is registry and cached[1] == len(registry):
+        return cached[2]
+
+    index = RegistryIndex(registry)
+    # Держим только актуальные индексы (старые версии реестров не нужны)
+    if len(_index_cache) > 8:
+        _index_cache.clear()
+    _index_cache[id(registry)] = (registry, len(registry), index)
+    return index
+
+
+_DIGIT_GROUPS = re.compile(r"\d+")
+
+
+def split_identifiers(*values: Optional[str]) -> Tuple[str, str]:
+    """Выделить (ИНН, ОГРН) из строк вида "7744000912", "ИНН³ 7744000912",
+    "1027739019142 7744000912" (столбец ОГРН/ИНН в НБКИ).
+
+    ИНН - 10 цифр (организация) или 12 (ИП), ОГРН - 13 цифр или 15 (ОГРНИП).
+    """
+    inn = ""
+    ogrn = ""
+    for value in values:
+        if not value:
+            continue
+        for digits in _DIGIT_GROUPS.findall(str(value)):
+            if len(digits) in (10, 12) and not inn:
+                inn = digits
+            elif len(digits) in (13, 15) and not ogrn:
+                ogrn = digits
+    return inn, ogrn
+
+
+class IdentifierIndex:
+    """Хэш-индексы ИНН -> запись и ОГРН -> запись по обоим реестрам."""
+
+    def __init__(self, bank_registry: Dict[str, Dict[str, Any]], mfo_registry: Dict[str, Dict[str, Any]]):
+        # Значения: (реестр "bank"/"mfo", ключ записи, данные записи)
+        self.by_inn: Dict[str, Tuple[str, str, Dict[str, Any]]] = {}
+        self.by_ogrn: Dict[str, Tuple[str, str, Dict[str, Any]]] = {}
+
+        for ogrn, data in bank_registry.items():
+            self.by_ogrn.setdefault(ogrn, ("bank", ogrn, data))
+            inn = str(data.get("инн") or "").strip()
+            if inn:
+                self.by_inn.setdefault(inn, ("bank", ogrn, data))
+
+        for inn, data in mfo_registry.items():
+            self.by_inn.setdefault(inn, ("mfo", inn, data))
+            ogrn = str(data.get("огрн") or "").strip()
+            if ogrn:
+                self.by_ogrn.setdefault(ogrn, ("mfo", inn, data))
+
+    def lookup(self, inn: Optional[str] = None, ogrn: Optional[str] = None) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        """Найти запись по ИНН и/или ОГРН (ОГРН проверяется первым - он уникальнее)."""
+        inn, ogrn = split_identifiers(inn, ogrn)
+        if ogrn and ogrn in self.by_ogrn:
+            return self.by_ogrn[ogrn]
+        if inn and inn in self.by_inn:
+            return self.by_inn[inn]
+        return None
+
+    @staticmethod
+    def entry_inn(match: Tuple[str, str, Dict[str, Any]]) -> str:
+        """ИНН найденной записи (для МФО это ключ реестра)."""
+        source, key, data = match
+        if source == "mfo":
+            return key
+        return str(data.get("инн") or "").strip()
+
+
+_identifier_cache: Optional[Tuple[Dict[str, Any], int, Dict[str, Any], int, IdentifierIndex]] = None
+
+
+def get_identifier_index(bank_registry: Dict[str, Dict[str, Any]], mfo_registry: Dict[str, Dict[str, Any]]) -> Any:
+    """Индекс ИНН/ОГРН для текущей пары реестров (перестраивается при их замене)."""
+    global _identifier_cache
+    # Оба реестра из одного registry_store: поиск по индексам SQLite
+    store = getattr(bank_registry, "store", None)
+    if store is not None and getattr(mfo_registry, "store", None) is store:
+        return store
+
+    cached = _identifier_cache
+    if (cached is not None and cached[0] is bank_registry and cached[1] == len(bank_registry)
+            and cached[2] is mfo_registry and cached[3] == len(mfo_registry)):
+        return cached[4]
+
+    index = IdentifierIndex(bank_registry, mfo_registry)
+    _identifier_cache = (bank_registry, len(bank_registry), mfo_registry, len(mfo_registry), index)
+    return index
+
+
+# Организационно-правовые формы и служебные слова, не влияющие на сравнение названий
+_LEGAL_FORMS = (
+    "публичное акционерное общество", "акционерное общество", "открытое акционерное общество",
+    "закрытое акционерное общество", "общество с ограниченной ответственностью",
+    "микрофинансовая компания", "микрокредитная компания", "микрофинансовая организация",
+    "некоммерческая организация", "небанковская кредитная организация",
+    "коммерческий банк", "акционерный коммерческий банк",
+)
+_LEGAL_FORMS_RE = re.compile(r"\b(?:" + "|".join(re.escape(form) for form in _LEGAL_FORMS) + r")\b")
+_LEGAL_ABBR_RE = re.compile(r"\b(?:пао|оао|зао|ао|ооо|нко|мфк|мкк|мфо|кб|акб|рнко)\b")
+_NON_WORD_RE = re.compile(r"[^0-9a-zа-я]+")
+
+# Порог сходства по умолчанию для нечёткого поиска (ниже - много ложных
+# совпадений вида "Совкомбанк" ~ "Соцкомбанк")
+FUZZY_THRESHOLD = 0.75
+
+
+def normalize_org_name(name: str) -> str:
+    """Название организации без ОПФ, кавычек и пунктуации, в нижнем регистре.
+
+    "ПАО «Сбербанк России»" -> "сбербанк россии", "Банк ВТБ (ПАО)" -> "банк втб".
+    """
+    text = str(name or "").lower().replace("ё", "е")
+    text = _NON_WORD_RE.sub(" ", text)
+    text = _LEGAL_FORMS_RE.sub(" ", text)
+    text = _LEGAL_ABBR_RE.sub(" ", text)
+    return " ".join(text.split())
+
+
+def _name_trigrams(normalized: str) -> set:
+    """Триграммы названия с пробелами по краям (учитывают начало и конец слов)."""
+    return _trigrams(f"  {normalized} ")
+
+
+class TrigramIndex:
+    """Нечёткий поиск по названиям: триграмма -> id записей, ранжирование по Дайсу."""
+
+    def __init__(self, items: List[Tuple[Any, str]]):
+        self.keys: List[Any] = []
+        self.names: List[str] = []
+        self.gram_counts: List[int] = []
+        self.postings: Dict[str, List[int]] = {}
+
+        for key, name in items:
+            normalized = normalize_org_name(name)
+            if not normalized:
+                continue
+            entry_id = len(self.keys)
+            grams = _name_trigrams(normalized)
+            self.keys.append(key)
+            self.names.append(normalized)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(entry_id)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(self, query: str, k: int = 5, threshold: float = FUZZY_THRESHOLD) -> List[Tuple[Any, float]]:
+        """До k лучших записей (ключ, сходство 0..1) со сходством не ниже threshold."""
+        normalized = normalize_org_name(query)
+        if not normalized:
+            return []
+
+        query_grams = _name_trigrams(normalized)
+        counts: Dict[int, int] = {}
+        for gram in query_grams:
+            for entry_id in self.postings.get(gram, ()):
+                counts[entry_id] = counts.get(entry_id, 0) + 1
+
+        query_size = len(query_grams)
+        scored = []
+        for entry_id, common in counts.items():
+            score = 2.0 * common / (query_size + self.gram_counts[entry_id])
+            if score >= threshold:
+                scored.append((score, -entry_id))
+        best = heapq.nlargest(k, scored)
+        return [(self.keys[-neg_id], score) for score, neg_id in best]
+
+    def best(self, query: str, threshold: float = FUZZY_THRESHOLD) -> Optional[Tuple[Any, float]]:
+        """Лучшее совпадение (ключ, сходство) или None."""
+        found = self.search(query, k=1, threshold=threshold)
+        return found[0] if found else None
+
+
+_trigram_cache: Dict[Tuple[int, str], Tuple[Any, int, TrigramIndex]] = {}
+
+
+def get_trigram_index(source: Any, name_field: str = "название") -> TrigramIndex:
+    """Триграммный индекс для реестра (dict: ключ -> запись) или списка записей
+    (ключ - позиция в списке). Кэшируется по объекту, как get_registry_index."""
+    cache_key = (id(source), name_field)
+    cached = _trigram_cache.get(cache_key)
+    if cached is not None and cached[0] is source and cached[1] == len(source):
+        return cached[2]
+
+    if isinstance(source, Mapping):
+        items = [(key, data.get(name_field, "")) for key, data in source.items()]
+    else:
+        items = [(position, data.get(name_field, "")) for position, data in enumerate(source)]
+    index = TrigramIndex(items)
+    if len(_trigram_cache) > 8:
+        _trigram_cache.clear()
+    _trigram_cache[cache_key] = (source, len(source), index)
+    return index
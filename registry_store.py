@@ -0,0 +1,502 @@
+"""
+Компактное хранилище реестров банков и МФО в SQLite (cbr_data/registry-<N>.sqlite).
+
+JSON-файлы реестров (bank_registry.json / mfo_registry.json) остаются
+исходными данными, но при старте каждый процесс больше не загружает их
+целиком: реестры открываются лениво как отображения поверх SQLite, а поиск
+выполняется запросами к индексам на месте:
+
+- entries: запись реестра (kind = "bank"/"mfo", ключ, данные в компактном JSON),
+  индексы по ИНН и ОГРН;
+- tokens: слова названий в нижнем регистре -> позиция записи (из них при
+  первом поиске по ключевым словам строится индекс слов и триграмм в памяти,
+  как в registry_index.RegistryIndex).
+
+Версии хранилища: каждая сборка пишет новый файл registry-<поколение>.sqlite
+и затем атомарно (os.replace) переключает указатель registry_version.json.
+Сборки из разных процессов выполняются по очереди (registry_build.lock).
+Файлы версий не перезаписываются, поэтому читатели никогда не видят
+частично записанное хранилище, а открытые соединения старой версии продолжают
+работать (в том числе на Windows, где открытый файл нельзя заменить).
+
+RegistrySnapshots - текущая пара реестров процесса: любой gunicorn-воркер
+замечает новое поколение по указателю (не чаще раза в REGISTRY_CHECK_SECONDS)
+и подменяет снимок одним присваиванием; задача может закрепить снимок
+(pinned), чтобы все поиски в ней видели одну и ту же версию.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from registry_index import RegistryIndex, split_identifiers
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+REGISTRY_DIR = Path("cbr_data")
+REGISTRY_POINTER = "registry_version.json"
+# Сборки из разных процессов (gunicorn-воркеры, планировщик) выполняются по очереди
+REGISTRY_BUILD_LOCK = "registry_build.lock"
+
+# Сколько старых версий хранилища оставлять на диске (их могут читать другие процессы)
+KEEP_GENERATIONS = 2
+
+# Как часто процесс проверяет, не появилось ли новое поколение реестров
+REGISTRY_CHECK_SECONDS = 5.0
+
+# Сколько записей держать в памяти на один реестр (остальные читаются с диска)
+ENTRY_CACHE_SIZE = 1024
+
+SCHEMA = """
+CREATE TABLE entries (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    name_length INTEGER NOT NULL,
+    inn TEXT,
+    ogrn TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (kind, key)
+) WITHOUT ROWID;
+CREATE UNIQUE INDEX idx_entries_position ON entries(kind, position);
+CREATE INDEX idx_entries_inn ON entries(inn);
+CREATE INDEX idx_entries_ogrn ON entries(ogrn);
+CREATE TABLE tokens (
+    kind TEXT NOT NULL,
+    token TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (kind, token, position)
+) WITHOUT ROWID;
+CREATE TABLE meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _entry_rows(kind: str, registry: Dict[str, Dict[str, Any]]) -> Iterator[tuple]:
+    for position, (key, data) in enumerate(registry.items()):
+        name_tokens = str(data.get("название", "")).lower().split()
+        if kind == "mfo":
+            inn, ogrn = str(key), str(data.get("огрн") or "")
+        else:
+            inn, ogrn = str(data.get("инн") or ""), str(key)
+        yield (
+            kind, str(key), position, str(data.get("название", "")),
+            sum(len(token) for token in name_tokens), inn or None, ogrn or None,
+            json.dumps(data, ensure_ascii=False, separators=(",", ":")),
+        )
+
+
+def _token_rows(kind: str, registry: Dict[str, Dict[str, Any]]) -> Iterator[tuple]:
+    for position, data in enumerate(registry.values()):
+        for token in set(str(data.get("название", "")).lower().split()):
+            yield kind, token, position
+
+
+def _generation_path(directory: Path, generation: int) -> Path:
+    return Path(directory) / f"registry-{generation}.sqlite"
+
+
+def read_generation(directory: Path = REGISTRY_DIR) -> Optional[Tuple[int, Path]]:
+    """Текущее поколение хранилища по указателю: (номер, путь к файлу) или None."""
+    pointer = Path(directory) / REGISTRY_POINTER
+    try:
+        with open(pointer, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        generation = int(info["generation"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    path = Path(directory) / info.get("file", _generation_path(directory, generation).name)
+    return (generation, path) if path.exists() else None
+
+
+class InterProcessLock:
+    """Файловая блокировка между процессами (fcntl / msvcrt).
+
+    Снимается при release() или автоматически при завершении процесса.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._handle = None
+
+    @property
+    def locked(self) -> bool:
+        return self._handle is not None
+
+    def acquire(self, blocking: bool = False) -> bool:
+        """Захватить блокировку; без blocking - не дожидаясь освобождения (False, если занята)"""
+        if self._handle is not None:
+            return True
+        self.path.parent.mkdir(exist_ok=True)
+        handle = open(self.path, "a+")
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    handle.seek(0)
+                    # LK_LOCK сам повторяет попытки ~10 секунд, затем OSError - ждём дальше
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if blocking and fcntl is None:
+                    continue
+                handle.close()
+                return False
+        self._handle = handle
+        return True
+
+    def release(self):
+        if self._handle is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            else:
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._handle.close()
+            self._handle = None
+
+
+def build_registry_store(bank_registry: Dict[str, Dict[str, Any]], mfo_registry: Dict[str, Dict[str, Any]],
+                         directory: Path = REGISTRY_DIR, source_files: Iterable[Path] = ()) -> int:
+    """Собрать новое поколение хранилища и атомарно переключить на него указатель.
+
+    Сборка, переключение указателя и удаление старых поколений выполняются под
+    межпроцессной блокировкой REGISTRY_BUILD_LOCK. source_files - JSON-файлы,
+    из которых загружены реестры: если, пока процесс ждал блокировку, другой
+    процесс уже собрал хранилище не старее их, повторная сборка не выполняется.
+
+    Returns:
+        Номер нового (или уже собранного другим процессом) поколения
+    """
+    directory = Path(directory)
+    directory.mkdir(exist_ok=True)
+    lock = InterProcessLock(directory / REGISTRY_BUILD_LOCK)
+    lock.acquire(blocking=True)
+    try:
+        source_files = list(source_files)
+        if source_files:
+            store = open_registry_store(source_files, directory)
+            if store is not None:
+                return store.generation
+        return _build_generation(bank_registry, mfo_registry, directory)
+    finally:
+        lock.release()
+
+
+def _build_generation(bank_registry: Dict[str, Dict[str, Any]], mfo_registry: Dict[str, Dict[str, Any]],
+                      directory: Path) -> int:
+    current = read_generation(directory)
+    generation = (current[0] if current else 0) + 1
+    path = _generation_path(directory, generation)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    conn = sqlite3.connect(str(tmp_path))
+    try:
+        conn.executescript(SCHEMA)
+        for kind, registry in (("bank", bank_registry), ("mfo", mfo_registry)):
+            conn.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", _entry_rows(kind, registry))
+            conn.executemany("INSERT INTO tokens VALUES (?, ?, ?)", _token_rows(kind, registry))
+            conn.execute("INSERT INTO meta VALUES (?, ?)", (f"{kind}_count", str(len(registry))))
+        conn.execute("INSERT INTO meta VALUES ('generation', ?)", (str(generation),))
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+    pointer = directory / REGISTRY_POINTER
+    pointer_tmp = pointer.with_name(f"{pointer.name}.{os.getpid()}.tmp")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        json.dump({"generation": generation, "file": path.name, "built_at": time.time()}, f)
+    os.replace(pointer_tmp, pointer)
+
+    # Старые версии удаляем по возможности (файл может быть открыт другим процессом)
+    for old in directory.glob("registry-*.sqlite"):
+        try:
+            old_generation = int(old.stem.split("-", 1)[1])
+        except ValueError:
+            continue
+        if old_generation <= generation - KEEP_GENERATIONS:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+    return generation
+
+
+def open_registry_store(source_files: Iterable[Path] = (), directory: Path = REGISTRY_DIR) -> Optional["RegistryStore"]:
+    """Открыть текущее поколение хранилища, если оно не старее исходных JSON-файлов."""
+    current = read_generation(directory)
+    if current is None:
+        return None
+    generation, path = current
+    store_mtime = path.stat().st_mtime
+    for source in source_files:
+        if Path(source).exists() and Path(source).stat().st_mtime > store_mtime:
+            return None
+    return RegistryStore(path, generation)
+
+
+class RegistryStore:
+    """Доступ к одному поколению хранилища только на чтение (отдельное соединение на поток)."""
+
+    def __init__(self, path: Path, generation: int = 0):
+        self.path = Path(path)
+        self.generation = generation
+        self._local = threading.local()
+        self._mappings: Dict[str, "LazyRegistry"] = {}
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path.resolve().as_posix()}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def mapping(self, kind: str) -> "LazyRegistry":
+        """Реестр kind ("bank"/"mfo") как отображение ключ -> данные."""
+        if kind not in self._mappings:
+            self._mappings[kind] = LazyRegistry(self, kind)
+        return self._mappings[kind]
+
+    def count(self, kind: str) -> int:
+        row = self._conn().execute("SELECT value FROM meta WHERE name = ?", (f"{kind}_count",)).fetchone()
+        return int(row[0]) if row else 0
+
+    def get(self, kind: str, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT data FROM entries WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def keys(self, kind: str) -> List[str]:
+        return [row[0] for row in self._conn().execute(
+            "SELECT key FROM entries WHERE kind = ? ORDER BY position", (kind,)
+        )]
+
+    def items(self, kind: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        rows = self._conn().execute("SELECT key, data FROM entries WHERE kind = ? ORDER BY position", (kind,)).fetchall()
+        for key, data in rows:
+            yield key, json.loads(data)
+
+    def entry_at(self, kind: str, position: int) -> Tuple[str, Dict[str, Any]]:
+        key, data = self._conn().execute(
+            "SELECT key, data FROM entries WHERE kind = ? AND position = ?", (kind, position)
+        ).fetchone()
+        return key, json.loads(data)
+
+    def name_lengths(self, kind: str) -> List[int]:
+        """Суммарная длина слов названия для каждой позиции реестра."""
+        return [row[0] for row in self._conn().execute(
+            "SELECT name_length FROM entries WHERE kind = ? ORDER BY position", (kind,)
+        )]
+
+    def token_postings(self, kind: str) -> Iterator[Tuple[str, int]]:
+        """Пары (слово названия, позиция записи) в порядке слов - по индексу (kind, token)."""
+        return iter(self._conn().execute(
+            "SELECT token, position FROM tokens WHERE kind = ? ORDER BY token", (kind,)
+        ).fetchall())
+
+    def lookup(self, inn: Optional[str] = None, ogrn: Optional[str] = None) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        """Точный поиск по ИНН/ОГРН (как IdentifierIndex.lookup): (реестр, ключ, данные)."""
+        inn, ogrn = split_identifiers(inn, ogrn)
+        conn = self._conn()
+        for column, value in (("ogrn", ogrn), ("inn", inn)):
+            if not value:
+                continue
+            # Банки раньше МФО - так же, как при построении IdentifierIndex
+            row = conn.execute(
+                f"SELECT kind, key, data FROM entries WHERE {column} = ? ORDER BY kind = 'mfo', position LIMIT 1",
+                (value,),
+            ).fetchone()
+            if row:
+                return row[0], row[1], json.loads(row[2])
+        return None
+
+
+class LazyRegistry(Mapping):
+    """Реестр поверх RegistryStore: записи читаются с диска по требованию."""
+
+    def __init__(self, store: RegistryStore, kind: str):
+        self.store = store
+        self.kind = kind
+        self._length: Optional[int] = None
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._keyword_index: Optional["StoreKeywordIndex"] = None
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        data = self._cache.get(key)
+        if data is None:
+            data = self.store.get(self.kind, key)
+            if data is None:
+                raise KeyError(key)
+            if len(self._cache) >= ENTRY_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[key] = data
+        return data
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.keys(self.kind))
+
+    def __len__(self) -> int:
+        if self._length is None:
+            self._length = self.store.count(self.kind)
+        return self._length
+
+    def items(self):
+        return self.store.items(self.kind)
+
+    def copy(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self.items())
+
+    def keyword_index(self) -> "StoreKeywordIndex":
+        """Поиск по ключевым словам запросами к таблице tokens (без загрузки реестра)."""
+        if self._keyword_index is None:
+            self._keyword_index = StoreKeywordIndex(self)
+        return self._keyword_index
+
+
+class StoreKeywordIndex(RegistryIndex):
+    """
+    RegistryIndex поверх SQLite; id записи = позиция.
+
+    Словарь слов и триграммы строятся в памяти один раз из таблицы tokens
+    (десятки тысяч коротких строк), поэтому поиск слова идёт по триграммам,
+    а не сканированием таблицы; данные записей по-прежнему читаются с диска.
+    """
+
+    def __init__(self, registry: LazyRegistry):
+        self.store = registry.store
+        self.kind = registry.kind
+        self._registry = registry
+        self._keyword_cache: Dict[str, frozenset] = {}
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._registry)
+
+    def _load(self) -> None:
+        with self._load_lock:
+            if self._loaded:
+                return
+            self.tokens = []
+            self.token_entries = []
+            for token, position in self.store.token_postings(self.kind):
+                if not self.tokens or self.tokens[-1] != token:
+                    self.tokens.append(token)
+                    self.token_entries.append(set())
+                self.token_entries[-1].add(position)
+            self.name_lengths = self.store.name_lengths(self.kind)
+            self._build_trigrams()
+            self._loaded = True
+
+    def _lookup_keyword(self, keyword: str) -> frozenset:
+        if not self._loaded:
+            self._load()
+        return super()._lookup_keyword(keyword)
+
+    def _name_length(self, entry_id: int) -> int:
+        if not self._loaded:
+            self._load()
+        return self.name_lengths[entry_id]
+
+    def _entry(self, entry_id: int) -> Tuple[str, Dict[str, Any]]:
+        return self.store.entry_at(self.kind, entry_id)
+
+
+@dataclass(frozen=True)
+class RegistrySnapshot:
+    """Согласованная пара реестров одной версии."""
+
+    generation: int
+    bank: Mapping
+    mfo: Mapping
+
+
+class RegistrySnapshots:
+    """Текущий снимок реестров процесса с подхватом новых поколений с диска."""
+
+    def __init__(self, directory: Path = REGISTRY_DIR, check_interval: float = REGISTRY_CHECK_SECONDS):
+        self.directory = Path(directory)
+        self.check_interval = check_interval
+        self._current = RegistrySnapshot(0, {}, {})
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._checked_at = 0.0
+
+    def publish(self, bank: Mapping, mfo: Mapping, generation: Optional[int] = None) -> RegistrySnapshot:
+        """Подменить текущий снимок (одним присваиванием - без промежуточных состояний)."""
+        if generation is None:
+            generation = self._current.generation
+        snapshot = RegistrySnapshot(generation, bank, mfo)
+        self._current = snapshot
+        return snapshot
+
+    @property
+    def latest(self) -> RegistrySnapshot:
+        """Последний опубликованный снимок (без учёта закрепления и проверки диска)."""
+        return self._current
+
+    def current(self) -> RegistrySnapshot:
+        """Закреплённый за потоком снимок или последний (с проверкой нового поколения)."""
+        pinned = getattr(self._local, "snapshot", None)
+        if pinned is not None:
+            return pinned
+        self.refresh()
+        return self._current
+
+    def refresh(self, force: bool = False) -> bool:
+        """Переключиться на новое поколение хранилища, если оно появилось."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        current = read_generation(self.directory)
+        if current is None or current[0] <= self._current.generation:
+            return False
+        with self._lock:
+            if current[0] <= self._current.generation:
+                return False
+            store = RegistryStore(current[1], current[0])
+            try:
+                bank, mfo = store.mapping("bank"), store.mapping("mfo")
+                len(bank), len(mfo)  # Проверяем, что файл читается, до подмены
+            except sqlite3.Error as e:
+                print(f"[WARN] Не удалось открыть поколение реестров {current[0]}: {e}")
+                return False
+            self.publish(bank, mfo, current[0])
+            print(f"[REGISTRY] Переключение на поколение реестров {current[0]}")
+            return True
+
+    @contextmanager
+    def pinned(self):
+        """Закрепить текущий снимок за потоком на время задачи (вложенные вызовы не меняют его)."""
+        if getattr(self._local, "snapshot", None) is not None:
+            yield self._local.snapshot
+            return
+        self._local.snapshot = self.current()
+        try:
+            yield self._local.snapshot
+        finally:
+            self._local.snapshot = None
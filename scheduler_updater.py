@@ -1,6 +1,15 @@
 """
 Планировщик автоматического обновления справочников ЦБ РФ
 Запускается ежедневно для актуализации BANK_REGISTRY
+
+При нескольких процессах (gunicorn-воркеры) планировщик запускается в каждом,
+но расписание выполняет только лидер - процесс, захвативший файловую
+блокировку cbr_data/registry_scheduler.lock (сведения о нём пишутся в
+last_update.json). Если лидер завершится, ОС снимет блокировку и её захватит
+другой процесс. Само обновление (плановое или принудительное) выполняется под
+отдельной блокировкой registry_update.lock, поэтому параллельные запуски
+отбрасываются. Остальные процессы узнают о новых реестрах по поколению
+хранилища (registry_store) и переключаются на него.
 """
 
 import schedule
@@ -10,6 +19,11 @@ from datetime import datetime
 from pathlib import Path
 import json
 import logging
+import os
+import socket
+import sqlite3
+
+from registry_store import InterProcessLock, build_registry_store, open_registry_store
 
 # Настройка логирования
 logging.basicConfig(
@@ -30,8 +44,25 @@ class BankRegistryUpdater:
         self.last_update_file = Path("cbr_data") / "last_update.json"
         self.bank_registry_file = Path("cbr_data") / "bank_registry.json"
         self.mfo_registry_file = Path("cbr_data") / "mfo_registry.json"
+        self.leader_lock = InterProcessLock(Path("cbr_data") / "registry_scheduler.lock")
+        self.update_lock_file = Path("cbr_data") / "registry_update.lock"
         self.is_running = False
+        self.is_leader = False
         self.update_thread = None
+        # Вызываются с update_info после каждого обновления (например, для SSE-уведомлений)
+        self.update_listeners = []
+    
+    def add_update_listener(self, callback):
+        """Подписаться на завершение обновления (callback(update_info))"""
+        if callback not in self.update_listeners:
+            self.update_listeners.append(callback)
+    
+    def _notify_listeners(self, info: dict):
+        for callback in self.update_listeners:
+            try:
+                callback(info)
+            except Exception as e:
+                logger.error(f"[ERROR] Ошибка обработчика обновления: {e}")
     
     def get_last_update_info(self) -> dict:
         """Получить информацию о последнем обновлении"""
@@ -51,10 +82,17 @@ class BankRegistryUpdater:
         }
     
     def save_update_info(self, info: dict):
-        """Сохранить информацию об обновлении"""
+        """Сохранить информацию об обновлении (сведения о лидере сохраняются)"""
         self.last_update_file.parent.mkdir(exist_ok=True)
-        with open(self.last_update_file, 'w', encoding='utf-8') as f:
+        if "leader" not in info:
+            leader = self.get_last_update_info().get("leader")
+            if leader:
+                info = {**info, "leader": leader}
+        # Файл читают другие процессы - пишем атомарно
+        tmp_file = self.last_update_file.with_name(f"{self.last_update_file.name}.{os.getpid()}.tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(info, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.last_update_file)
     
     def save_registries(self):
         """Сохранить реестры банков и МФО в файлы"""
@@ -62,13 +100,19 @@ class BankRegistryUpdater:
         
         self.bank_registry_file.parent.mkdir(exist_ok=True)
         
-        # Сохраняем BANK_REGISTRY
+        # Сохраняем BANK_REGISTRY (компактно: файл читается только при сборке хранилища)
         with open(self.bank_registry_file, 'w', encoding='utf-8') as f:
-            json.dump(DocumentProcessor.BANK_REGISTRY, f, ensure_ascii=False, indent=2)
+            json.dump(dict(DocumentProcessor.BANK_REGISTRY.items()), f, ensure_ascii=False, separators=(',', ':'))
         
         # Сохраняем MFO_REGISTRY
         with open(self.mfo_registry_file, 'w', encoding='utf-8') as f:
-            json.dump(DocumentProcessor.MFO_REGISTRY, f, ensure_ascii=False, indent=2)
+            json.dump(dict(DocumentProcessor.MFO_REGISTRY.items()), f, ensure_ascii=False, separators=(',', ':'))
+        
+        # Пересобираем SQLite-хранилище (после JSON, чтобы оно было не старее исходников)
+        try:
+            build_registry_store(DocumentProcessor.BANK_REGISTRY, DocumentProcessor.MFO_REGISTRY)
+        except (OSError, sqlite3.Error) as e:
+            logger.error(f"[ERROR] Ошибка сборки registry.sqlite: {e}")
         
         logger.info(f"[SAVE] Реестры сохранены: {len(DocumentProcessor.BANK_REGISTRY)} банков, {len(DocumentProcessor.MFO_REGISTRY)} МФО")
     
@@ -79,11 +123,23 @@ class BankRegistryUpdater:
         loaded_banks = 0
         loaded_mfo = 0
         
+        # Актуальное SQLite-хранилище открываем лениво, без загрузки JSON
+        store = open_registry_store([self.bank_registry_file, self.mfo_registry_file])
+        if store is not None:
+            try:
+                DocumentProcessor.set_registries(bank_registry=store.mapping("bank"), mfo_registry=store.mapping("mfo"))
+                loaded_banks = len(DocumentProcessor.BANK_REGISTRY)
+                loaded_mfo = len(DocumentProcessor.MFO_REGISTRY)
+                logger.info(f"[LOAD] Открыто хранилище реестров: {loaded_banks} банков, {loaded_mfo} МФО")
+                return loaded_banks, loaded_mfo
+            except sqlite3.Error as e:
+                logger.error(f"[ERROR] Ошибка открытия registry.sqlite: {e}")
+        
         # Загружаем BANK_REGISTRY
         if self.bank_registry_file.exists():
             try:
                 with open(self.bank_registry_file, 'r', encoding='utf-8') as f:
-                    DocumentProcessor.BANK_REGISTRY = json.load(f)
+                    DocumentProcessor.set_registries(bank_registry=json.load(f))
                     loaded_banks = len(DocumentProcessor.BANK_REGISTRY)
                     logger.info(f"[LOAD] Загружено банков из файла: {loaded_banks}")
             except Exception as e:
@@ -93,17 +149,50 @@ class BankRegistryUpdater:
         if self.mfo_registry_file.exists():
             try:
                 with open(self.mfo_registry_file, 'r', encoding='utf-8') as f:
-                    DocumentProcessor.MFO_REGISTRY = json.load(f)
+                    DocumentProcessor.set_registries(mfo_registry=json.load(f))
                     loaded_mfo = len(DocumentProcessor.MFO_REGISTRY)
                     logger.info(f"[LOAD] Загружено МФО из файла: {loaded_mfo}")
             except Exception as e:
                 logger.error(f"[ERROR] Ошибка загрузки MFO_REGISTRY: {e}")
         
+        if loaded_banks or loaded_mfo:
+            try:
+                # Пока ждали блокировку, хранилище мог собрать другой процесс - тогда пересборки не будет
+                build_registry_store(
+                    DocumentProcessor.BANK_REGISTRY, DocumentProcessor.MFO_REGISTRY,
+                    source_files=[self.bank_registry_file, self.mfo_registry_file],
+                )
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"[ERROR] Ошибка сборки registry.sqlite: {e}")
+        
         return loaded_banks, loaded_mfo
     
     def update_registry(self):
-        """Выполнить обновление реестра банков и МФО"""
-        from cbr_registry import CBRExcelRegistry
+        """Выполнить обновление реестра банков и МФО (если оно уже не идёт в другом процессе)
+        
+        Returns:
+            True/False - результат обновления, None - обновление уже выполняется
+        """
+        lock = InterProcessLock(self.update_lock_file)
+        if not lock.acquire():
+            logger.info("[SKIP] Обновление реестров уже выполняется")
+            return None
+        try:
+            return self._update_registry()
+        finally:
+            lock.release()
+    
+    def _log_diff(self, kind: str, diff: dict, old: dict, new: dict):
+        """Записать в лог добавленные, удалённые и изменённые организации"""
+        logger.info(f"[DIFF] {kind}: добавлено {len(diff['added'])}, удалено {len(diff['removed'])}, изменено {len(diff['changed'])}")
+        for label, keys, source in (("+", diff['added'], new), ("-", diff['removed'], old), ("~", diff['changed'], new)):
+            for key in keys[:20]:
+                logger.info(f"[DIFF]   {label} {key}: {source[key].get('название', '')}")
+            if len(keys) > 20:
+                logger.info(f"[DIFF]   {label} ... и ещё {len(keys) - 20}")
+    
+    def _update_registry(self):
+        from cbr_registry import CBRExcelRegistry, apply_registry_diff, build_mfo_registry, diff_registries
         from processor import DocumentProcessor
         
         logger.info("[UPDATE] Начинаю обновление реестра банков и МФО...")
@@ -111,9 +200,12 @@ class BankRegistryUpdater:
         try:
             # Создаем объект для работы с ЦБ
             cbr_registry = CBRExcelRegistry()
+            registries = DocumentProcessor.registries()
+            current_banks = dict(registries.bank.items())
+            current_mfo = dict(registries.mfo.items())
             
             # === ОБНОВЛЕНИЕ БАНКОВ ===
-            # Скачиваем актуальный справочник банков
+            # Скачиваем справочник банков (ETag/Last-Modified + sha256: не изменился - не разбираем)
             logger.info("[DOWNLOAD] Скачиваю справочник банков ЦБ РФ...")
             banks_file = cbr_registry.download_banks_registry()
             
@@ -121,85 +213,94 @@ class BankRegistryUpdater:
                 logger.error("[ERROR] Не удалось скачать справочник банков")
                 return False
             
-            # Парсим справочник банков
-            logger.info("[PARSE] Парсю справочник банков...")
-            banks_data = cbr_registry.parse_banks_registry(banks_file)
-            
-            if not banks_data:
-                logger.error("[ERROR] Не удалось распарсить справочник банков")
-                return False
-            
-            logger.info(f"[OK] Загружено банков: {len(banks_data)}")
-            
-            # Получаем текущий BANK_REGISTRY из processor.py
-            current_registry = DocumentProcessor.BANK_REGISTRY.copy()
-            
-            # Обновляем реестр банков (добавляем все из XLSX + нормализуем названия)
-            logger.info("[UPDATE] Обновляю реестр банков из XLSX...")
-            updated_registry = cbr_registry.update_bank_registry_addresses(
-                current_registry, 
-                banks_data
-            )
-            
-            # Подсчитываем изменения
-            added_count = len(updated_registry) - len(current_registry)
-            updated_count = sum(
-                1 for inn in current_registry.keys()
-                if inn in updated_registry and (
-                    current_registry[inn]['адрес'] != updated_registry[inn]['адрес'] or
-                    current_registry[inn]['название'] != updated_registry[inn]['название']
+            updated_registry = current_banks
+            bank_diff = {'added': [], 'removed': [], 'changed': []}
+            if cbr_registry.download_changed.get('banks') or not current_banks:
+                # Разбираем справочник потоково: строки сразу идут в сборку реестра
+                # (добавляем все банки из XLSX + нормализуем названия)
+                logger.info("[PARSE] Разбираю справочник банков и обновляю реестр...")
+                rebuilt = cbr_registry.update_bank_registry_addresses(
+                    current_banks, cbr_registry.iter_banks(banks_file)
                 )
-            )
-            
-            # Обновляем BANK_REGISTRY в памяти
-            DocumentProcessor.BANK_REGISTRY = updated_registry
-            logger.info(f"[OK] Реестр банков обновлен: {len(updated_registry)} банков (добавлено: {added_count}, обновлено: {updated_count})")
+                
+                if not rebuilt:
+                    logger.error("[ERROR] Не удалось распарсить справочник банков")
+                    return False
+                
+                logger.info(f"[OK] Загружено банков: {len(rebuilt)}")
+                
+                # Построчный дифф: неизменные записи остаются прежними
+                bank_diff = diff_registries(current_banks, rebuilt)
+                updated_registry = apply_registry_diff(current_banks, rebuilt, bank_diff)
+                self._log_diff("Банки", bank_diff, current_banks, rebuilt)
+            else:
+                logger.info("[SKIP] Справочник банков не изменился")
             
             # === ОБНОВЛЕНИЕ МФО ===
             # Скачиваем актуальный справочник МФО
             logger.info("[DOWNLOAD] Скачиваю справочник МФО...")
             mfo_file = cbr_registry.download_mfo_registry()
             
+            mfo_registry = current_mfo
+            mfo_diff = {'added': [], 'removed': [], 'changed': []}
             if not mfo_file or not mfo_file.exists():
-                logger.warning("[WARNING] Не удалось скачать справочник МФО")
-                mfo_data = []
+                # Оставляем текущий реестр МФО, а не очищаем его
+                logger.warning("[WARNING] Не удалось скачать справочник МФО, оставляю текущий")
+            elif cbr_registry.download_changed.get('mfo') or not current_mfo:
+                # Заполняем MFO_REGISTRY из XLSX (потоковый разбор)
+                logger.info("[PARSE] Разбираю справочник МФО...")
+                rebuilt_mfo = cbr_registry.shorten_registry_addresses(
+                    build_mfo_registry(cbr_registry.iter_mfos(mfo_file))
+                )
+                logger.info(f"[OK] Загружено МФО с ИНН: {len(rebuilt_mfo)}")
+                
+                if rebuilt_mfo:
+                    mfo_diff = diff_registries(current_mfo, rebuilt_mfo)
+                    mfo_registry = apply_registry_diff(current_mfo, rebuilt_mfo, mfo_diff)
+                    self._log_diff("МФО", mfo_diff, current_mfo, rebuilt_mfo)
+                else:
+                    logger.warning("[WARNING] Справочник МФО пуст, оставляю текущий")
             else:
-                # Парсим справочник МФО
-                logger.info("[PARSE] Парсю справочник МФО...")
-                mfo_data = cbr_registry.parse_mfo_registry(mfo_file)
-                logger.info(f"[OK] Загружено МФО: {len(mfo_data)}")
+                logger.info("[SKIP] Справочник МФО не изменился")
             
-            # Заполняем MFO_REGISTRY из XLSX
-            mfo_registry = {}
-            for mfo in mfo_data:
-                inn = mfo.get('Идентификационный номер налогоплательщика', '').strip()
-                if inn:
-                    mfo_registry[inn] = {
-                        'название': mfo.get('Полное наименование', '') or mfo.get('Сокращенное наименование', ''),
-                        'адрес': mfo.get('Адрес, указанный в едином государственном реестре юридических лиц', '')
-                    }
+            added_count = len(bank_diff['added'])
+            updated_count = len(bank_diff['changed'])
+            has_changes = any(bank_diff.values()) or any(mfo_diff.values())
             
-            # Обновляем MFO_REGISTRY в памяти
-            DocumentProcessor.MFO_REGISTRY = mfo_registry
-            logger.info(f"[OK] Загружено МФО с ИНН: {len(mfo_registry)}")
+            if has_changes:
+                # Подменяем оба реестра одним снимком (поиск не увидит новые банки со старыми МФО)
+                DocumentProcessor.set_registries(bank_registry=updated_registry, mfo_registry=mfo_registry)
+                logger.info(f"[OK] Реестр банков: {len(updated_registry)} (добавлено: {added_count}, обновлено: {updated_count}, удалено: {len(bank_diff['removed'])})")
+                logger.info(f"[OK] Реестр МФО: {len(mfo_registry)}")
             
             # Сохраняем информацию об обновлении
             update_info = {
                 "last_update": datetime.now().isoformat(),
                 "next_update": self._get_next_update_time(),
-                "banks_count": len(DocumentProcessor.BANK_REGISTRY),
+                "banks_count": len(updated_registry),
                 "banks_added": added_count,
                 "banks_updated": updated_count,
+                "banks_removed": len(bank_diff['removed']),
                 "mfo_count": len(mfo_registry),
-                "registry_size": len(DocumentProcessor.BANK_REGISTRY) + len(DocumentProcessor.MFO_REGISTRY),
+                "mfo_added": len(mfo_diff['added']),
+                "mfo_updated": len(mfo_diff['changed']),
+                "mfo_removed": len(mfo_diff['removed']),
+                "registry_size": len(updated_registry) + len(mfo_registry),
+                "unchanged": not has_changes,
                 "status": "success"
             }
-            self.save_update_info(update_info)
             
-            # Сохраняем реестры в файлы для персистентности
-            self.save_registries()
+            # Сохраняем реестры в файлы для персистентности (только если что-то изменилось)
+            if has_changes:
+                self.save_registries()
+            cbr_registry.commit_download_state()
+            self.save_update_info(update_info)
             
-            logger.info(f"[OK] Обновление завершено! Банков: {len(DocumentProcessor.BANK_REGISTRY)}, МФО: {len(mfo_registry)}, Добавлено: {added_count}, Обновлено: {updated_count}")
+            if has_changes:
+                logger.info(f"[OK] Обновление завершено! Банков: {len(updated_registry)}, МФО: {len(mfo_registry)}, Добавлено: {added_count}, Обновлено: {updated_count}")
+            else:
+                logger.info("[OK] Обновление завершено: изменений в справочниках нет")
+            self._notify_listeners(update_info)
             return True
             
         except Exception as e:
@@ -217,6 +318,7 @@ class BankRegistryUpdater:
                 "error": str(e)
             }
             self.save_update_info(update_info)
+            self._notify_listeners(update_info)
             return False
     
     def _get_next_update_time(self) -> str:
@@ -230,6 +332,35 @@ class BankRegistryUpdater:
         logger.info("⏰ Запланированное обновление началось")
         self.update_registry()
     
+    def try_become_leader(self) -> bool:
+        """Захватить роль лидера планировщика (если её не держит другой процесс)"""
+        if self.is_leader:
+            return True
+        if not self.leader_lock.acquire():
+            return False
+        
+        self.is_leader = True
+        # Планируем обновление каждый день в 3:00 ночи
+        schedule.every().day.at("03:00").do(self.scheduled_update)
+        
+        info = self.get_last_update_info()
+        info["leader"] = {
+            "pid": os.getpid(),
+            "host": socket.gethostname(),
+            "since": datetime.now().isoformat(),
+        }
+        self.save_update_info(info)
+        logger.info(f"[LEADER] Процесс {os.getpid()} ведёт расписание обновлений")
+        logger.info(f"[SCHEDULE] Следующее обновление: {self._get_next_update_time()}")
+        return True
+    
+    def _reload_if_changed(self):
+        """Подхватить реестры, собранные другим процессом (новое поколение хранилища)"""
+        from processor import DocumentProcessor
+        
+        if DocumentProcessor.REGISTRY_SNAPSHOTS.refresh(force=True):
+            DocumentProcessor.registries()
+    
     def start_scheduler(self):
         """Запустить планировщик в фоновом потоке"""
         if self.is_running:
@@ -238,16 +369,21 @@ class BankRegistryUpdater:
         
         self.is_running = True
         
-        # Планируем обновление каждый день в 3:00 ночи
-        schedule.every().day.at("03:00").do(self.scheduled_update)
-        
-        logger.info("[OK] Планировщик запущен. Обновление каждый день в 3:00")
-        logger.info(f"[SCHEDULE] Следующее обновление: {self._get_next_update_time()}")
+        if self.try_become_leader():
+            logger.info("[OK] Планировщик запущен. Обновление каждый день в 3:00")
+        else:
+            logger.info("[OK] Планировщик запущен в режиме ожидания (расписание ведёт другой процесс)")
         
         # Запускаем в отдельном потоке
         def run_scheduler():
             while self.is_running:
-                schedule.run_pending()
+                try:
+                    # Лидер мог завершиться - пробуем занять его место
+                    if self.try_become_leader():
+                        schedule.run_pending()
+                    self._reload_if_changed()
+                except Exception as e:
+                    logger.error(f"[ERROR] Ошибка цикла планировщика: {e}")
                 time.sleep(60)  # Проверяем каждую минуту
         
         self.update_thread = threading.Thread(target=run_scheduler, daemon=True)
@@ -256,12 +392,36 @@ class BankRegistryUpdater:
     def stop_scheduler(self):
         """Остановить планировщик"""
         self.is_running = False
+        if self.is_leader:
+            schedule.clear()
+            self.leader_lock.release()
+            self.is_leader = False
         logger.info("🛑 Планировщик остановлен")
     
     def force_update(self):
         """Принудительно запустить обновление (не дожидаясь расписания)"""
         logger.info("[MANUAL] Принудительное обновление...")
         return self.update_registry()
+    
+    def start_force_update(self) -> bool:
+        """Запустить принудительное обновление в фоне.
+        
+        Returns:
+            False, если обновление уже выполняется (в этом или другом процессе)
+        """
+        lock = InterProcessLock(self.update_lock_file)
+        if not lock.acquire():
+            return False
+        
+        def run_update():
+            try:
+                logger.info("[MANUAL] Принудительное обновление...")
+                self._update_registry()
+            finally:
+                lock.release()
+        
+        threading.Thread(target=run_update, daemon=True).start()
+        return True
 
 
 # Глобальный экземпляр планировщика
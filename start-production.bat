@@ -55,4 +55,4 @@ echo.
 echo ========================================
 echo.
 
-waitress-serve --host=127.0.0.1 --port=8000 --threads=4 --channel-timeout=300 wsgi:app
+waitress-serve --host=127.0.0.1 --port=8000 --threads=8 --channel-timeout=300 wsgi:app
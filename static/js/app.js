@@ -1,6 +1,8 @@
 let selectedFiles = [];
 let currentDebtorId = null;
 let previousStatuses = {}; // Для отслеживания изменений статусов
+let debtorProgress = {}; // Прогресс обработки из SSE: debtor_id -> текст
+let eventsConnected = false; // SSE-поток активен - периодический опрос не нужен
 
 // Маппинг юристов для отображения
 const LAWYER_NAMES = {
@@ -215,6 +217,12 @@ document.getElementById('submitUploadBtn').addEventListener('click', async () =>
     const selectedLawyer = lawyerSelect ? lawyerSelect.value : 'urist1';
     formData.append('lawyer', selectedLawyer);
     
+    // Срочное задание обрабатывается вне общей очереди
+    const urgentCheckbox = document.getElementById('urgentCheckbox');
+    if (urgentCheckbox && urgentCheckbox.checked) {
+        formData.append('urgent', '1');
+    }
+    
     submitBtn.disabled = true;
     submitBtn.textContent = 'Загрузка...';
     
@@ -230,16 +238,20 @@ document.getElementById('submitUploadBtn').addEventListener('click', async () =>
             uploadModal.classList.remove('show');
             selectedFiles = [];
             updateFileList();
+            if (urgentCheckbox) urgentCheckbox.checked = false;
             showNotification('Файлы успешно загружены! Обработка началась...', 'success');
             loadDebtors();
             
-            setTimeout(() => {
-                const interval = setInterval(() => {
-                    loadDebtors();
-                }, 2000);
-                
-                setTimeout(() => clearInterval(interval), 30000);
-            }, 1000);
+            // Без SSE-потока временно опрашиваем чаще, чтобы увидеть начало обработки
+            if (!eventsConnected) {
+                setTimeout(() => {
+                    const interval = setInterval(() => {
+                        loadDebtors();
+                    }, 2000);
+                    
+                    setTimeout(() => clearInterval(interval), 30000);
+                }, 1000);
+            }
         } else {
             showNotification('Ошибка при загрузке файлов', 'error');
         }
@@ -286,11 +298,15 @@ async function loadDebtors(search = '') {
         const queueResponse = await fetch('/api/queue/status');
         const queueData = await queueResponse.json();
         
-        // Создаем карту позиций в очереди
+        // Создаем карту позиций в очереди (эффективный порядок с учётом приоритета)
         const queuePositions = {};
+        const queueUrgent = {};
+        const queueEta = {};
         if (queueData.jobs) {
             queueData.jobs.forEach(job => {
                 queuePositions[job.debtor_id] = job.position;
+                queueUrgent[job.debtor_id] = job.urgent;
+                queueEta[job.debtor_id] = job.eta_finish;
             });
         }
         
@@ -324,9 +340,17 @@ async function loadDebtors(search = '') {
                 statusClass = 'status-queued';
                 const position = queuePositions[debtor.id];
                 statusText = position > 0 ? `В очереди (#${position})` : 'В очереди';
+                if (queueUrgent[debtor.id]) statusText += ' • срочно';
+                if (queueEta[debtor.id]) statusText += ` • готово ~${formatEtaTime(queueEta[debtor.id])}`;
             } else if (debtor.status === 'processing') {
                 statusClass = 'status-processing';
                 statusText = 'Обрабатывается';
+                if (queueEta[debtor.id]) statusText += ` (~${formatEtaTime(queueEta[debtor.id])})`;
+                if (debtorProgress[debtor.id]) {
+                    statusText += `<br><small class="debtor-progress" id="progress-${debtor.id}">${debtorProgress[debtor.id]}</small>`;
+                } else {
+                    statusText += `<br><small class="debtor-progress" id="progress-${debtor.id}"></small>`;
+                }
             } else if (debtor.status === 'completed') {
                 statusClass = 'status-completed';
                 statusText = 'Готово';
@@ -896,6 +920,13 @@ async function viewDeals(debtorId, debtorName) {
     }
 }
 
+// Время из прогноза очереди (ISO) в формате ЧЧ:ММ
+function formatEtaTime(isoString) {
+    const date = new Date(isoString);
+    if (isNaN(date.getTime())) return '';
+    return date.toLocaleTimeString('ru-RU', { hour: '2-digit', minute: '2-digit' });
+}
+
 async function updateQueueStatus() {
     try {
         const response = await fetch('/api/queue/status');
@@ -916,6 +947,14 @@ async function updateQueueStatus() {
                 statusText += `В очереди: ${data.queued}`;
             }
             
+            // Прогноз окончания всей очереди
+            const lastEta = (data.jobs || []).reduce((latest, job) => (
+                job.eta_finish && (!latest || job.eta_finish > latest) ? job.eta_finish : latest
+            ), null);
+            if (lastEta) {
+                statusText += ` • Очередь освободится ~${formatEtaTime(lastEta)}`;
+            }
+            
             queueInfoElement.textContent = statusText;
             queueStatusElement.style.display = 'block';
         } else {
@@ -1081,7 +1120,11 @@ document.getElementById('updateRegistryBtn')?.addEventListener('click', async ()
             method: 'POST'
         });
         
-        if (response.ok) {
+        const result = response.ok ? await response.json() : null;
+        if (result && result.status === 'already_running') {
+            showNotification('Обновление реестра уже выполняется', 'info');
+            setTimeout(updateRegistryStatus, 5000);
+        } else if (response.ok) {
             showNotification('Обновление реестра началось. Проверьте статус через минуту.', 'success');
             // Обновляем статус через 5 секунд
             setTimeout(updateRegistryStatus, 5000);
@@ -1097,6 +1140,100 @@ document.getElementById('updateRegistryBtn')?.addEventListener('click', async ()
     }
 });
 
+// Текст прогресса обработки из события SSE 'progress'
+function formatProgress(progress) {
+    if (progress.stage === 'document') {
+        return `Файл ${progress.index}/${progress.total}: ${progress.file}`;
+    }
+    if (progress.stage === 'batch') {
+        return `${progress.file}: батч ${progress.batch}/${progress.batches}`;
+    }
+    if (progress.stage === 'render') {
+        return 'Формирование документов...';
+    }
+    return '';
+}
+
+// === Периодический опрос (только если SSE недоступен) ===
+let pollingIntervals = [];
+
+function startPolling() {
+    if (pollingIntervals.length > 0) return;
+    
+    // Обновляем список должников и статус очереди каждые 3 секунды
+    pollingIntervals.push(setInterval(() => {
+        loadDebtors(searchInput ? searchInput.value : '');
+        updateQueueStatus();
+    }, 3000));
+    
+    // Обновляем статус реестра каждые 30 секунд
+    pollingIntervals.push(setInterval(updateRegistryStatus, 30000));
+}
+
+function stopPolling() {
+    pollingIntervals.forEach(interval => clearInterval(interval));
+    pollingIntervals = [];
+}
+
+// === SSE: сервер сам присылает изменения статусов, прогресс и обновления реестра ===
+let refreshTimeout = null;
+
+function scheduleRefresh() {
+    // Несколько событий подряд - одно обновление списка
+    clearTimeout(refreshTimeout);
+    refreshTimeout = setTimeout(() => {
+        loadDebtors(searchInput ? searchInput.value : '');
+        updateQueueStatus();
+    }, 300);
+}
+
+function connectEvents() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    
+    const source = new EventSource('/api/events');
+    
+    source.onopen = () => {
+        eventsConnected = true;
+        stopPolling();
+        // Синхронизируемся после (пере)подключения
+        scheduleRefresh();
+    };
+    
+    source.onerror = () => {
+        // Браузер переподключится сам, пока - опрос
+        eventsConnected = false;
+        startPolling();
+    };
+    
+    source.addEventListener('job', (e) => {
+        const data = JSON.parse(e.data);
+        if (data.status !== 'processing') {
+            delete debtorProgress[data.debtor_id];
+        }
+        scheduleRefresh();
+    });
+    
+    source.addEventListener('queue', () => {
+        scheduleRefresh();
+    });
+    
+    source.addEventListener('progress', (e) => {
+        const data = JSON.parse(e.data);
+        debtorProgress[data.debtor_id] = formatProgress(data);
+        const element = document.getElementById(`progress-${data.debtor_id}`);
+        if (element) {
+            element.textContent = debtorProgress[data.debtor_id];
+        }
+    });
+    
+    source.addEventListener('registry', () => {
+        updateRegistryStatus();
+    });
+}
+
 // Запрашиваем разрешение на уведомления при загрузке
 requestNotificationPermission();
 
@@ -1104,11 +1241,4 @@ loadDebtors();
 updateQueueStatus();
 updateRegistryStatus();
 
-// Обновляем список должников и статус очереди каждые 3 секунды
-setInterval(() => {
-    loadDebtors(searchInput ? searchInput.value : '');
-    updateQueueStatus();
-}, 3000);
-
-// Обновляем статус реестра каждые 30 секунд
-setInterval(updateRegistryStatus, 30000);
+connectEvents();
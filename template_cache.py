@@ -0,0 +1,212 @@
+"""
+Кэш шаблонов Word для DocxTemplate (один на процесс).
+
+DocxTemplate(template_path) для каждого документа каждого должника заново
+распаковывает docx, разбирает XML, чистит разметку вокруг {{ }} (patch_xml)
+и компилирует Jinja - для одних и тех же 5 шаблонов templ/urist1..3.
+
+Здесь шаблон готовится один раз на версию файла (путь, mtime, размер):
+- разобранный документ python-docx (эталон, сам не изменяется);
+- результат patch_xml для каждой части (тело, колонтитулы, сноски);
+- скомпилированные Jinja-шаблоны этих частей.
+
+Каждый рендер получает копию эталонного документа: деревья XML копируются
+(DocxTemplate заменяет в них тело, колонтитулы и свойства), двоичные части
+(картинки, шрифты) не копируются - они общие и не изменяются.
+
+Для той же версии шаблона запоминается набор ключей контекста, на которые
+он ссылается (переменные Jinja и плейсхолдеры {{key}}). Отпечаток значений
+этих ключей (context_fingerprint) хранится вместе с документом - после
+правки данных перегенерируются только документы с изменившимся отпечатком.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, Optional, Set, Tuple
+
+from docx import Document
+from docx.opc.part import XmlPart
+from docxtpl import DocxTemplate
+from jinja2 import Environment, TemplateSyntaxError, meta
+
+# {{ключ}} простой подстановки (processor.fill_docx_template): Word может разбить
+# его на несколько тегов <w:r>/<w:t>, ключ из найденного текста - placeholder_key
+PLACEHOLDER_RE = re.compile(r"\{\{([^}]*)\}\}", re.DOTALL)
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def placeholder_key(raw: str) -> str:
+    """Ключ плейсхолдера: без тегов XML и неразрывных пробелов, без пробелов по краям."""
+    return _TAG_RE.sub("", raw).replace("\u00A0", " ").strip()
+
+
+class _TemplateEnvironment(Environment):
+    """Jinja-окружение шаблона: from_string компилирует каждый исходник один раз."""
+
+    def __init__(self):
+        super().__init__()
+        self._compiled: Dict[str, Any] = {}
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals or template_class or not isinstance(source, str):
+            return super().from_string(source, globals, template_class)
+        template = self._compiled.get(source)
+        if template is None:
+            template = super().from_string(source)
+            self._compiled[source] = template
+        return template
+
+
+class CompiledTemplate:
+    """Подготовленный шаблон одной версии файла."""
+
+    def __init__(self, path: Path, version: Tuple[int, int]):
+        self.path = Path(path)
+        self.version = version
+        self.document = Document(str(self.path))
+        self.environment = _TemplateEnvironment()
+        self._patched: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.renders = 0
+        # Время первого (холодного) рендера - база для оценки экономии
+        self.cold_seconds = 0.0
+        self._keys: Optional[FrozenSet[str]] = None
+
+    def new_document(self):
+        """Копия эталонного документа для одного рендера."""
+        return copy.deepcopy(self.document)
+
+    def patch_xml(self, src_xml: str, patch: Callable[[str], str]) -> str:
+        patched = self._patched.get(src_xml)
+        if patched is None:
+            patched = patch(src_xml)
+            self._patched[src_xml] = patched
+        return patched
+
+    def referenced_keys(self) -> FrozenSet[str]:
+        """Ключи верхнего уровня контекста, которые использует шаблон."""
+        if self._keys is None:
+            template = CachedDocxTemplate(self)
+            keys: Set[str] = set()
+            for part in self.document.part.package.iter_parts():
+                if isinstance(part, XmlPart):
+                    xml = template.xml_to_string(part.element)
+                elif part.content_type.endswith("xml"):
+                    xml = part.blob.decode("utf-8", errors="ignore")
+                else:
+                    continue
+                if "{" not in xml:
+                    continue
+                patched = template.patch_xml(xml)
+                try:
+                    keys.update(meta.find_undeclared_variables(self.environment.parse(patched)))
+                except TemplateSyntaxError:
+                    # Часть рендерится только простой подстановкой - по исходному XML, как в ней
+                    keys.update(placeholder_key(raw) for raw in PLACEHOLDER_RE.findall(xml))
+            self._keys = frozenset(keys)
+        return self._keys
+
+    def record_render(self, seconds: float) -> float:
+        """Учесть рендер; вернуть оценку сэкономленного времени (секунды)."""
+        with self._lock:
+            self.renders += 1
+            if self.renders == 1:
+                self.cold_seconds = seconds
+                return 0.0
+            return max(self.cold_seconds - seconds, 0.0)
+
+
+class CachedDocxTemplate(DocxTemplate):
+    """DocxTemplate поверх CompiledTemplate: без повторного разбора и компиляции."""
+
+    def __init__(self, compiled: CompiledTemplate):
+        super().__init__(compiled.path)
+        self.compiled = compiled
+
+    def init_docx(self, reload: bool = True):
+        if not self.docx or (self.is_rendered and reload):
+            self.docx = self.compiled.new_document()
+            self.is_rendered = False
+
+    def patch_xml(self, src_xml):
+        return self.compiled.patch_xml(src_xml, super().patch_xml)
+
+    def render(self, context, jinja_env=None, autoescape=False):
+        # autoescape меняет окружение - общее окружение шаблона для этого не годится
+        if jinja_env is None and not autoescape:
+            jinja_env = self.compiled.environment
+        super().render(context, jinja_env, autoescape)
+
+
+_TEMPLATES: Dict[str, CompiledTemplate] = {}
+_TEMPLATES_LOCK = threading.Lock()
+
+
+def template_version(path: Path) -> Tuple[int, int]:
+    """Версия файла шаблона: (mtime в наносекундах, размер)."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_template(path: Path) -> CompiledTemplate:
+    """Подготовленный шаблон (из кэша, если файл не менялся)."""
+    key = str(Path(path).resolve())
+    version = template_version(path)
+    with _TEMPLATES_LOCK:
+        compiled = _TEMPLATES.get(key)
+        if compiled is None or compiled.version != version:
+            compiled = CompiledTemplate(Path(path), version)
+            _TEMPLATES[key] = compiled
+    return compiled
+
+
+def template_keys(path: Path) -> Optional[FrozenSet[str]]:
+    """Ключи контекста шаблона (кэш на версию файла); None - шаблон не разобран."""
+    try:
+        return get_template(path).referenced_keys()
+    except Exception as e:
+        print(f"[TEMPLATES] Не удалось определить поля шаблона {Path(path).name}: {e}")
+        return None
+
+
+def context_fingerprint(path: Path, context: Dict[str, Any]) -> Optional[str]:
+    """
+    Отпечаток данных, из которых рендерится документ: версия шаблона и значения
+    ключей контекста, на которые он ссылается.
+
+    None - поля шаблона не определены (документ перегенерируется всегда).
+    """
+    keys = template_keys(path)
+    if keys is None:
+        return None
+    values = {key: context.get(key) for key in sorted(keys)}
+    payload = json.dumps([template_version(path), values], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def render_template(path: Path, context: Dict[str, Any]) -> Tuple[CachedDocxTemplate, float]:
+    """
+    Отрендерить шаблон с контекстом.
+
+    Returns:
+        (документ для doc.save(), оценка сэкономленного кэшем времени в секундах)
+    """
+    started = time.perf_counter()
+    doc = CachedDocxTemplate(get_template(path))
+    doc.render(context)
+    return doc, doc.compiled.record_render(time.perf_counter() - started)
+
+
+def clear_templates(path: Optional[Path] = None) -> None:
+    """Сбросить кэш (весь или одного шаблона)."""
+    with _TEMPLATES_LOCK:
+        if path is None:
+            _TEMPLATES.clear()
+        else:
+            _TEMPLATES.pop(str(Path(path).resolve()), None)
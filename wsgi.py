@@ -2,10 +2,15 @@
 
 import os
 from app import app, init_db
+from scheduler_updater import init_scheduler
 
 # Инициализируем БД при старте (только один раз при импорте модуля)
 init_db()
 
+# Планировщик обновления реестров стартует в каждом воркере, но расписание
+# выполняет только один из них (лидер по файловой блокировке)
+init_scheduler()
+
 # Для Gunicorn: экспортируем app на уровне модуля
 application = app
 